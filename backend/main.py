@@ -1,15 +1,66 @@
 import os
+import sys
+import asyncio
+import contextlib
+import contextvars
 import socket
+import stat
 import platform
 import datetime
-from typing import List
-from fastapi import FastAPI, File, UploadFile, HTTPException
+import time
+import hashlib
+import hmac
+import json
+import threading
+import uuid
+import re
+import functools
+import struct
+import ipaddress
+from typing import Dict, List, Optional, Union
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, File, Form, Query, UploadFile, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from urllib.parse import quote
 import uvicorn
 import shutil
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+try:
+    import python_multipart as multipart
+    from python_multipart.multipart import parse_options_header
+except ImportError:  # 旧版本的包名
+    import multipart
+    from multipart.multipart import parse_options_header
 
-app = FastAPI(title="本地文件传输服务", description="端到端文件传输服务")
+# 与 main.py 共用的模块位于仓库根目录
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from localsend_core import (
+    CONTENT_ENCODINGS, DISCOVERY_GROUP, DISCOVERY_PORT, MIN_COMPRESS_SIZE, ArchiveError, AsyncTransferScheduler,
+    HashIndex, HistoryStore, OutputFile, PeerDiscovery, RequestTrace, add_range, choose_encoding, commit_file,
+    covered_end, current_trace, extract_archive, file_etag, format_digest, format_http_date, format_rate,
+    if_range_matches, is_compressible, iter_decompressed, metrics, new_decoder, new_encoder, parse_content_range,
+    parse_digest as parse_digest_value, parse_etags, parse_range_header, parse_rate, preallocate_file, range_covered,
+    record_received_file, release_written, remove_quietly, remove_range, remove_stale_parts, request_trace,
+    set_write_mode, staging_path, sync_directory, sync_path, timestamped_names,
+)
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    """服务运行期间在后台清理上传会话"""
+    task = asyncio.create_task(session_sweeper())
+    try:
+        yield
+    finally:
+        task.cancel()
+
+app = FastAPI(title="本地文件传输服务", description="端到端文件传输服务", lifespan=lifespan)
 
 # 允许跨域请求
 app.add_middleware(
@@ -18,46 +69,1149 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
 # 桌面路径
 DESKTOP_PATH = os.path.join(os.path.expanduser("~"), "Desktop")
 
-# 传输历史记录
-transfer_history = []
+# 分块上传：默认/最大分块大小，以及未完成会话的过期时间（秒）
+DEFAULT_SESSION_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_SESSION_CHUNK_SIZE = 64 * 1024 * 1024
+SESSION_TTL = 6 * 60 * 60
+
+# 清理过期会话的间隔（秒）；启动时目录中的临时文件都来自之前的进程，
+# 但最近 ORPHAN_PART_AGE 秒内修改过的保留，以免误删同时运行的另一个实例正在写入的文件
+SESSION_SWEEP_INTERVAL = 60
+ORPHAN_PART_AGE = 10 * 60
+
+# 下载时每次读取的块大小
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+# SSE：保留的最近事件数、无事件时发送心跳的间隔，以及进度事件的最小间隔（秒）
+EVENT_BUFFER_SIZE = 1000
+SSE_KEEPALIVE = 15
+PROGRESS_INTERVAL = 0.5
+
+# 传输速率的指数平滑系数（每个进度间隔采样一次）
+RATE_SMOOTHING = 0.3
+
+# 由 Starlette 解析表单的上传接口，在中间件中统计其传输进度
+FORM_UPLOAD_PATHS = frozenset(("/api/upload", "/api/upload-multiple"))
+
+# 关闭服务时等待进行中请求的最长时间（秒）
+SHUTDOWN_TIMEOUT = 3
+
+# 每次查询历史记录最多返回的条数
+MAX_HISTORY_PAGE = 1000
+
+# 保存上传文件时每次读取的块大小
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# 上传写盘、摘要计算等文件系统操作使用的线程数，避免阻塞事件循环
+IO_THREADS = 8
+
+# 边接收边解压归档的线程数（解压期间线程会阻塞在网络上，不能占用上面的 IO 线程池）
+ARCHIVE_THREADS = 32
+
+# 批量上传时同时写入的文件数（留出 IO 线程给其他请求），以及一次请求最多包含的文件数
+INGEST_CONCURRENCY = 4
+MAX_BATCH_FILES = 10000
 
-def get_local_ip():
-    """获取本机IP地址"""
+# 流式上传中普通表单字段的最大长度
+MAX_FORM_FIELD_SIZE = 1024 * 1024
+
+# 启动时的上传限速由环境变量设置（字节/秒，可写成 10M 等），运行中通过 /api/admin/limits 调整
+RATE_LIMIT = os.environ.get("LOCALSEND_RATE_LIMIT")
+CLIENT_RATE_LIMIT = os.environ.get("LOCALSEND_CLIENT_RATE_LIMIT")
+
+# 管理接口（调整限速）只接受本机访问；设置了 LOCALSEND_ADMIN_TOKEN 时也接受带 Bearer 令牌的请求
+ADMIN_TOKEN = os.environ.get("LOCALSEND_ADMIN_TOKEN")
+
+# 服务器状态（内容索引等）的保存目录
+STATE_DIR = os.environ.get("LOCALSEND_STATE_DIR") or os.path.join(os.path.expanduser("~"), ".localsend")
+
+# 服务器默认使用的内容校验算法（HASH_ALGORITHMS 之一），设为 none 时不计算
+HASH_ALGORITHM = os.environ.get("LOCALSEND_HASH", "blake2b").lower()
+if HASH_ALGORITHM == "none":
+    HASH_ALGORITHM = None
+
+# 写入模式（LOCALSEND_WRITE_MODE，见 localsend_core.WRITE_MODES）
+set_write_mode(os.environ.get("LOCALSEND_WRITE_MODE", "fast").lower())
+
+# 本机身份信息：检查网卡变化的间隔、强制刷新的间隔（秒）
+IDENTITY_CHECK_INTERVAL = 5
+IDENTITY_REFRESH_INTERVAL = 60
+
+# Linux 上查询网卡 IPv4 地址的 ioctl
+SIOCGIFADDR = 0x8915
+
+# 局域网发现（LOCALSEND_DISCOVERY=0 时不启用），以及本服务在公告中声明的能力
+DISCOVERY_ENABLED = os.environ.get("LOCALSEND_DISCOVERY", "1") != "0"
+DISCOVERY_CAPABILITIES = ("upload", "sessions", "archive", "preflight", "download", "events", "batch")
+
+# 进行中的分块上传会话
+upload_sessions = {}
+# 与请求生命周期无关的后台任务（保持引用，避免被回收）
+background_tasks = set()
+
+def get_local_ip(family: int = socket.AF_INET) -> Optional[str]:
+    """获取默认路由出口的本机IP地址（UDP connect 不会真正发包），失败时返回 None"""
+    probe = "8.8.8.8" if family == socket.AF_INET else "2001:4860:4860::8888"
     try:
         # 连接到一个远程地址来获取本机IP
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        local_ip = s.getsockname()[0]
-        s.close()
-        return local_ip
-    except:
-        return "127.0.0.1"
+        with socket.socket(family, socket.SOCK_DGRAM) as s:
+            s.connect((probe, 80))
+            return s.getsockname()[0]
+    except OSError:
+        return None
+
+def is_loopback_or_link_local(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return True
+    return ip.is_loopback or ip.is_link_local or ip.is_unspecified
+
+def interface_fingerprint() -> tuple:
+    """当前网卡列表，用于廉价地检测网络变化"""
+    try:
+        return tuple(socket.if_nameindex())
+    except (AttributeError, OSError):
+        return ()
+
+def list_local_addresses() -> List[str]:
+    """列出本机所有非回环的 IPv4/IPv6 地址，默认路由的出口地址排在最前面"""
+    addresses: List[str] = []
+
+    def add(address: str):
+        address = address.split("%")[0]
+        if address and address not in addresses and not is_loopback_or_link_local(address):
+            addresses.append(address)
+
+    for family in (socket.AF_INET, socket.AF_INET6):
+        add(get_local_ip(family) or "")
+    # 主机名解析到的地址（Windows/macOS 上通常包含所有网卡）
+    try:
+        for info in socket.getaddrinfo(socket.gethostname(), None, proto=socket.IPPROTO_TCP):
+            add(info[4][0])
+    except OSError:
+        pass
+    # Linux：逐个网卡查询 IPv4 地址，从 /proc 读取 IPv6 地址
+    if fcntl is not None:
+        for _, name in interface_fingerprint():
+            try:
+                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                    packed = fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack("256s", name.encode()[:15]))
+                add(socket.inet_ntoa(packed[20:24]))
+            except OSError:
+                pass
+    try:
+        with open("/proc/net/if_inet6") as f:
+            for line in f:
+                add(str(ipaddress.IPv6Address(bytes.fromhex(line.split()[0]))))
+    except (OSError, ValueError):
+        pass
+    return addresses
+
+class ServerIdentity:
+    """缓存的本机身份信息（主机名、平台信息、所有本机地址）
+
+    平台信息只在启动时收集一次（platform.processor() 在 Linux 上可能启动子进程）。
+    请求处理只读取缓存的快照；后台线程每 IDENTITY_CHECK_INTERVAL 秒比较一次网卡列表，
+    网卡变化或距上次刷新超过 IDENTITY_REFRESH_INTERVAL 秒时重新收集地址。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.platform_info = {
+            "system": platform.system(),
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+        }
+        self.refresh()
+
+    def refresh(self):
+        fingerprint = interface_fingerprint()
+        addresses = list_local_addresses()
+        # 快照整体替换，读取方无需加锁
+        self.info = {
+            "hostname": platform.node(),
+            **self.platform_info,
+            "ip": addresses[0] if addresses else "127.0.0.1",
+            "addresses": addresses or ["127.0.0.1"],
+        }
+        self.fingerprint = fingerprint
+        self.refreshed = time.monotonic()
+
+    def get(self) -> dict:
+        """返回当前快照，首次调用时启动后台刷新线程"""
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None and not self.stop_event.is_set():
+                    self.thread = threading.Thread(target=self.run, name="identity", daemon=True)
+                    self.thread.start()
+        return self.info
+
+    def run(self):
+        while not self.stop_event.wait(IDENTITY_CHECK_INTERVAL):
+            if (interface_fingerprint() != self.fingerprint
+                    or time.monotonic() - self.refreshed >= IDENTITY_REFRESH_INTERVAL):
+                self.refresh()
+
+    def close(self):
+        self.stop_event.set()
+
+server_identity = ServerIdentity()
+
+# 启动后的局域网发现服务（未启用时为 None）
+peer_discovery: Optional[PeerDiscovery] = None
 
 def get_device_info():
-    """获取设备信息"""
+    """获取设备信息（缓存的快照）以及支持的传输压缩编码"""
+    return {**server_identity.get(), "encodings": list(CONTENT_ENCODINGS)}
+
+def add_to_history(filename: str, size: int, client_ip: str, digest: Optional[str] = None, count_file: bool = True):
+    """添加传输记录到持久化的历史中，并推送给订阅者；文件夹的记录不计入文件数指标（由解压时逐个计入）"""
+    if count_file:
+        record_received_file(size)
+    record = transfer_history.add(filename, client_ip, size, digest)
+    event_bus.publish("history", record)
+    return record
+
+class RequestDecompressionMiddleware:
+    """解压带 Content-Encoding（gzip/zstd）的请求体，边接收边解压，不缓冲整个请求
+
+    下游看到的是解压后的数据，请求头中去掉了 Content-Encoding 和 Content-Length
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = next((value.decode("latin-1").strip().lower()
+                         for name, value in scope["headers"] if name == b"content-encoding"), None)
+        if not encoding or encoding == "identity":
+            return await self.app(scope, receive, send)
+        decoder = new_decoder(encoding)
+        if decoder is None:
+            response = JSONResponse(status_code=415, content={"detail": f"不支持的 Content-Encoding: {encoding}"})
+            return await response(scope, receive, send)
+        headers = [(name, value) for name, value in scope["headers"]
+                   if name not in (b"content-encoding", b"content-length")]
+
+        # 每条消息最多带 COPY_CHUNK_SIZE 字节解压后的数据，一条原始消息可能拆成多条
+        chunks = iter(())
+        more_body = True
+        finished = False
+
+        async def decompressing_receive():
+            nonlocal chunks, more_body, finished
+            while not finished:
+                try:
+                    return {"type": "http.request", "body": next(chunks), "more_body": True}
+                except StopIteration:
+                    pass
+                except Exception as e:
+                    raise HTTPException(status_code=400, detail=f"请求体解压失败: {e}")
+                if not more_body:
+                    # 请求体读完了但压缩流没有结束，说明数据被截断
+                    if not decoder.eof:
+                        raise HTTPException(status_code=400, detail="请求体压缩数据不完整")
+                    finished = True
+                    return {"type": "http.request", "body": b"", "more_body": False}
+                message = await receive()
+                if message["type"] != "http.request":
+                    return message
+                more_body = message.get("more_body", False)
+                chunks = iter_decompressed(decoder, message.get("body", b""), COPY_CHUNK_SIZE)
+            return await receive()
+
+        # 就地修改 scope：外层的 MetricsMiddleware 从同一个 scope 读取匹配到的路由
+        scope["headers"] = headers
+        await self.app(scope, decompressing_receive, send)
+
+app.add_middleware(RequestDecompressionMiddleware)
+
+metrics.define("localsend_upload_sessions", "gauge", "进行中的分块上传会话数", collect=lambda: len(upload_sessions))
+
+class MetricsMiddleware:
+    """记录每个请求的次数、耗时和状态码，以及上传请求接收的字节数和分阶段耗时
+
+    在最外层，按连接上收到的原始字节计数；路由标签取 Starlette 匹配到的路由模板，未匹配的归为 other。
+    表单上传在进入接口前由 Starlette 解析完请求体，这里顺带为它们登记传输进度。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        trace = RequestTrace()
+        token = request_trace.set(trace)
+        status = 0
+        received = 0
+        progress = None
+        if scope["method"] == "POST" and scope["path"] in FORM_UPLOAD_PATHS:
+            length = next((value for name, value in scope["headers"] if name == b"content-length"), b"")
+            progress = ProgressReporter(None, int(length) if length.isdigit() else None,
+                                        scope["client"][0] if scope.get("client") else "未知")
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request" and message.get("body"):
+                if not received:
+                    metrics.inc("localsend_active_transfers")
+                received += len(message["body"])
+                if progress is not None:
+                    progress.update(received)
+            return message
+
+        async def status_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, status_send)
+        finally:
+            request_trace.reset(token)
+            if progress is not None:
+                progress.finish(200 <= status < 400)
+            route = getattr(scope.get("route"), "path", "other")
+            method = scope["method"]
+            if received:
+                metrics.inc("localsend_active_transfers", -1)
+                metrics.inc("localsend_received_bytes_total", received)
+            metrics.inc("localsend_http_requests_total", method=method, route=route, status=status)
+            metrics.observe("localsend_http_request_duration_seconds", time.perf_counter() - trace.started, route=route)
+            is_upload = method in ("POST", "PUT") and route.startswith(("/upload", "/api/upload"))
+            if is_upload and not 200 <= status < 400:
+                metrics.inc("localsend_upload_errors_total", route=route, status=status)
+            if trace.stages:
+                client_ip = scope["client"][0] if scope.get("client") else ""
+                trace.finish(f"{method} {route}", status, client_ip)
+
+transfer_scheduler = AsyncTransferScheduler(parse_rate(RATE_LIMIT), parse_rate(CLIENT_RATE_LIMIT))
+
+SESSION_ROUTE = re.compile(r"/api/upload/session/([^/]+)(?:/chunk/[^/]+)?")
+
+def transfer_key(scope) -> tuple:
+    """请求所属的传输及其大小：上传会话的分块和区间属于同一个会话，其他请求各自独立"""
+    match = SESSION_ROUTE.fullmatch(scope["path"])
+    session = upload_sessions.get(match.group(1)) if match else None
+    if session is not None:
+        return session.session_id, session.size
+    length = next((value for name, value in scope["headers"] if name == b"content-length"), b"")
+    return uuid.uuid4().hex, int(length) if length.isdigit() else -1
+
+class BandwidthMiddleware:
+    """按带宽调度器限制上传速度：每收到一段请求体先申请令牌，等待期间不再读取连接，形成背压
+
+    按连接上收到的原始字节计数，因此位于解压中间件之外
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in ("GET", "HEAD"):
+            return await self.app(scope, receive, send)
+        flow = None
+
+        async def throttled_receive():
+            nonlocal flow
+            message = await receive()
+            body = message.get("body") if message["type"] == "http.request" else None
+            if body and transfer_scheduler.limited():
+                if flow is None:
+                    key, size = transfer_key(scope)
+                    flow = transfer_scheduler.flow(key, scope["client"][0] if scope.get("client") else "", size)
+                await transfer_scheduler.acquire(flow, len(body))
+            return message
+
+        await self.app(scope, throttled_receive, send)
+
+app.add_middleware(BandwidthMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+def parse_digest(value: str):
+    """解析 "算法:十六进制摘要"（省略算法时使用 blake2b），返回 (算法, 摘要)"""
+    try:
+        return parse_digest_value(value)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def new_hasher(expected=None):
+    """有期望摘要时使用相同算法，否则使用服务器默认算法；不需要计算时返回 None"""
+    algorithm = expected[0] if expected else HASH_ALGORITHM
+    return hashlib.new(algorithm) if algorithm else None
+
+io_executor = ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix="upload-io")
+
+async def run_io(func, *args, **kwargs):
+    """在有界的 IO 线程池中执行阻塞的文件系统操作（带上当前的上下文，如请求的计时）"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        io_executor, functools.partial(context.run, func, *args, **kwargs))
+
+archive_executor = ThreadPoolExecutor(max_workers=ARCHIVE_THREADS, thread_name_prefix="archive")
+
+async def run_archive(func, *args):
+    """在单独的线程池中执行边接收边处理请求体的拉取式任务；它们会等待网络数据，不能占用 IO 线程池"""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        archive_executor, functools.partial(context.run, func, *args))
+
+def write_and_hash(f, hasher, data: bytes):
+    trace = current_trace()
+    t = time.perf_counter()
+    f.write(data)
+    if hasher:
+        t = trace.add("write", t)
+        # hashlib 处理大块数据时会释放 GIL
+        hasher.update(data)
+        trace.add("hash", t)
+    else:
+        trace.add("write", t)
+
+async def save_upload_file(file: UploadFile, temp_path: str, expected=None):
+    """把上传的文件写入临时文件 temp_path，同时增量计算摘要，返回 (大小, 摘要)；出错或摘要不一致时删除临时文件
+
+    读取 UploadFile 和写盘都不阻塞事件循环
+    """
+    hasher = new_hasher(expected)
+    size = 0
+    try:
+        buffer = await run_io(OutputFile, temp_path, file.size)
+        trace = current_trace()
+        try:
+            while True:
+                t = time.perf_counter()
+                data = await file.read(COPY_CHUNK_SIZE)
+                trace.add("parse", t)
+                if not data:
+                    break
+                await run_io(write_and_hash, buffer, hasher, data)
+                size += len(data)
+            await run_io(buffer.finish)
+        finally:
+            await run_io(buffer.close)
+        if expected and hasher.hexdigest() != expected[1]:
+            raise HTTPException(status_code=422, detail=f"文件 {file.filename} 校验失败，摘要不一致")
+    except BaseException:
+        await run_io(remove_quietly, temp_path)
+        raise
+    return size, format_digest(hasher)
+
+def record_upload(file_path: str, size: int, client_ip: str, digest: Optional[str]):
+    """把保存好的文件登记到内容索引和传输历史"""
+    hash_index.record(file_path, digest)
+    add_to_history(os.path.basename(file_path), size, client_ip, digest)
+
+def record_uploads(saved: List[tuple], client_ip: str):
+    """把一批保存好的文件 (路径, 大小, 摘要, stat) 登记到内容索引和传输历史，每个库只用一个事务"""
+    hash_index.record_many([(path, digest, stat) for path, _, digest, stat in saved])
+    for _, size, _, _ in saved:
+        record_received_file(size)
+    records = transfer_history.add_many([(os.path.basename(path), client_ip, size, digest)
+                                         for path, size, digest, _ in saved])
+    for record in records:
+        event_bus.publish("history", record)
+
+class NameAllocator:
+    """按目录快照批量分配不重名的文件名，不必为每个文件去文件系统上试探
+
+    快照之后才出现的同名文件由 publish_file 的原子检查兜底
+    """
+
+    def __init__(self, directory: str):
+        self.taken = set(os.listdir(directory))
+
+    def allocate(self, filename: str) -> str:
+        for candidate in timestamped_names(filename):
+            if candidate not in self.taken:
+                self.taken.add(candidate)
+                return candidate
+
+def publish_file(filename: str, temp_path: str) -> str:
+    """用预先分配的名字发布临时文件；名字已被占用或不支持硬链接时退回到 commit_file"""
+    file_path = os.path.join(DESKTOP_PATH, filename)
+    started = time.perf_counter()
+    try:
+        os.link(temp_path, file_path)
+    except OSError:
+        return commit_file(DESKTOP_PATH, filename, temp_path, timestamped_names)
+    os.remove(temp_path)
+    current_trace().add("resolve_name", started)
+    sync_directory(DESKTOP_PATH)
+    return file_path
+
+def ingest_file(file: UploadFile, filename: str, expected=None):
+    """在一个 IO 线程调用中完成单个文件的写入、摘要计算和发布，返回 (路径, 大小, 摘要, stat)"""
+    temp_path = staging_path(DESKTOP_PATH)
+    hasher = new_hasher(expected)
+    size = 0
+    try:
+        trace = current_trace()
+        with OutputFile(temp_path, file.size) as f:
+            file.file.seek(0)
+            while True:
+                t = time.perf_counter()
+                data = file.file.read(COPY_CHUNK_SIZE)
+                trace.add("parse", t)
+                if not data:
+                    break
+                write_and_hash(f, hasher, data)
+                size += len(data)
+            f.finish()
+            stat = os.fstat(f.fileno())
+        if expected and hasher.hexdigest() != expected[1]:
+            raise HTTPException(status_code=422, detail=f"文件 {file.filename} 校验失败，摘要不一致")
+        file_path = publish_file(filename, temp_path)
+    except BaseException:
+        remove_quietly(temp_path)
+        raise
+    return file_path, size, format_digest(hasher), stat
+
+class UploadBatch:
+    """批量保存一次请求中的多个文件
+
+    目录只创建一次，文件名按目录快照一次分配好；每个文件的写入、摘要和发布在 IO 线程池中一次完成，
+    最多 INGEST_CONCURRENCY 个文件同时进行；全部写完后内容索引和传输历史各用一个事务登记。
+    结果按完成顺序放入 queue（最后放入 None），流式响应可以逐条发送；
+    run 作为独立的任务运行，客户端中途断开时已保存的文件同样会登记，完成后关闭所有上传的文件。
+    """
+
+    def __init__(self, files: List[UploadFile], expected_digests: dict, client_ip: str):
+        self.files = [file for file in files if file.filename]
+        self.expected_digests = expected_digests
+        self.client_ip = client_ip
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.results: List[Optional[dict]] = [None] * len(self.files)
+
+    def allocate_names(self) -> List[str]:
+        os.makedirs(DESKTOP_PATH, exist_ok=True)
+        allocator = NameAllocator(DESKTOP_PATH)
+        return [allocator.allocate(os.path.basename(file.filename.replace("\\", "/")) or "file")
+                for file in self.files]
+
+    async def run(self) -> List[dict]:
+        saved = []
+        semaphore = asyncio.Semaphore(INGEST_CONCURRENCY)
+
+        async def ingest(index: int, file: UploadFile, filename: str):
+            async with semaphore:
+                try:
+                    file_path, size, digest, stat = await run_io(
+                        ingest_file, file, filename, self.expected_digests.get(file.filename))
+                    saved.append((file_path, size, digest, stat))
+                    result = {"success": True, "filename": os.path.basename(file_path), "size": size, "digest": digest}
+                except HTTPException as e:
+                    result = {"success": False, "filename": file.filename, "error": e.detail}
+                except Exception as e:
+                    result = {"success": False, "filename": file.filename, "error": str(e)}
+            self.results[index] = result
+            self.queue.put_nowait(result)
+
+        try:
+            names = await run_io(self.allocate_names)
+            await asyncio.gather(*(ingest(index, file, name)
+                                   for index, (file, name) in enumerate(zip(self.files, names))))
+        finally:
+            if saved:
+                await run_io(record_uploads, saved, self.client_ip)
+            self.queue.put_nowait(None)
+            for file in self.files:
+                await file.close()
+        return self.results
+
+async def store_upload(file: UploadFile, expected=None, client_ip: str = "未知") -> dict:
+    """保存一个上传的文件并登记，返回结果"""
+    temp_path = await run_io(staging_path, DESKTOP_PATH)
+    file_size, file_digest = await save_upload_file(file, temp_path, expected)
+    file_path = await run_io(commit_file, DESKTOP_PATH, os.path.basename(file.filename), temp_path, timestamped_names)
+    await run_io(record_upload, file_path, file_size, client_ip, file_digest)
     return {
-        "hostname": platform.node(),
-        "system": platform.system(),
-        "machine": platform.machine(),
-        "processor": platform.processor(),
-        "ip": get_local_ip()
+        "success": True,
+        "filename": os.path.basename(file_path),
+        "size": file_size,
+        "path": file_path,
+        "digest": file_digest
     }
 
-def add_to_history(filename: str, size: int, client_ip: str):
-    """添加传输记录到历史"""
-    record = {
-        "filename": filename,
-        "size": size,
-        "client_ip": client_ip,
-        "timestamp": datetime.datetime.now().isoformat(),
-        "id": len(transfer_history) + 1
-    }
-    transfer_history.append(record)
+class FileRangeResponse(Response):
+    """发送文件的 [start, end) 区间：在线程池中用 pread 分块读取，不阻塞事件循环
+
+    不使用 http.response.zerocopysend：uvicorn 不支持这个扩展，而且绕过 send 的数据
+    不会经过外层中间件的计数
+    """
+
+    def __init__(self, path: str, start: int, end: int, status_code: int, headers: dict):
+        super().__init__(status_code=status_code, headers=headers, media_type="application/octet-stream")
+        self.path = path
+        self.start = start
+        self.end = end
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method") == "HEAD" or self.end == self.start:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        with open(self.path, "rb") as f:
+            offset = self.start
+            while offset < self.end:
+                data = await run_in_threadpool(os.pread, f.fileno(), min(DOWNLOAD_CHUNK_SIZE, self.end - offset), offset)
+                if not data:
+                    break
+                offset += len(data)
+                await send({"type": "http.response.body", "body": data, "more_body": offset < self.end})
+        if offset < self.end:
+            # 文件在发送过程中被截断
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+class EventBus:
+    """最近事件的环形缓冲区，SSE 订阅者按事件 id 断点续传
+
+    publish 可以在事件循环或线程池中调用，订阅者在事件循环中等待
+    """
+
+    def __init__(self, capacity: int = EVENT_BUFFER_SIZE):
+        self.events = deque(maxlen=capacity)
+        self.next_id = 1
+        self.lock = threading.Lock()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.changed: Optional[asyncio.Event] = None
+
+    def publish(self, event_type: str, data: dict):
+        """发布一个事件，唤醒所有等待中的订阅者"""
+        with self.lock:
+            self.events.append((self.next_id, event_type, json.dumps(data, ensure_ascii=False)))
+            self.next_id += 1
+        if self.loop is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._notify()
+        else:
+            self.loop.call_soon_threadsafe(self._notify)
+
+    def _notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    def since(self, last_id: Optional[int]) -> list:
+        with self.lock:
+            latest = self.next_id - 1
+            if last_id is None or last_id > latest or (self.events and last_id < self.events[0][0] - 1):
+                # 新订阅者、服务器重启过或缓冲区已覆盖断开期间的事件：让客户端重新获取完整数据
+                return [(latest, "reset", "{}")]
+            return [event for event in self.events if event[0] > last_id]
+
+    async def wait(self, last_id: Optional[int], timeout: float) -> list:
+        """返回 last_id 之后的事件，没有新事件时最多等待 timeout 秒"""
+        if self.loop is None:
+            self.loop = asyncio.get_running_loop()
+            self.changed = asyncio.Event()
+        # 先取出当前的 Event 再检查事件，避免错过两者之间发布的事件
+        changed = self.changed
+        events = self.since(last_id)
+        if events:
+            return events
+        try:
+            await asyncio.wait_for(changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.since(last_id)
+
+class ProgressReporter:
+    """在写入循环中节流地发布上传进度事件，并登记到 transfers 供 /api/transfers 查询
+
+    每个块只记录字节数；速率只在发布进度时按 PROGRESS_INTERVAL 采样平滑一次
+    """
+
+    def __init__(self, filename: Optional[str], total: Optional[int], client_ip: str):
+        self.transfer_id = uuid.uuid4().hex
+        self.filename = filename
+        self.total = total
+        self.client_ip = client_ip
+        self.received = 0
+        self.last_report = 0.0
+        self.started = time.time()
+        self.sample_time = time.monotonic()
+        self.sample_received = 0
+        self.rate: Optional[float] = None
+        transfers.add(self)
+
+    def current_rate(self, now: float) -> Optional[float]:
+        """平滑后的速率（字节/秒）；超过一个间隔没有采样时按停顿期间的平均速率衰减"""
+        elapsed = now - self.sample_time
+        if elapsed <= PROGRESS_INTERVAL:
+            return self.rate
+        recent = (self.received - self.sample_received) / elapsed
+        return recent if self.rate is None else min(self.rate, recent)
+
+    def event(self, **extra) -> dict:
+        rate = self.current_rate(time.monotonic())
+        eta = None
+        if rate and self.total is not None:
+            eta = round(max(self.total - self.received, 0) / rate, 1)
+        return dict(transfer_id=self.transfer_id, filename=self.filename, client_ip=self.client_ip,
+                    received=self.received, total=self.total, started=self.started,
+                    rate=round(rate) if rate is not None else None, eta=eta, **extra)
+
+    def update(self, received: int):
+        """更新已接收的字节数，距上次发布超过 PROGRESS_INTERVAL 秒时采样速率并发布进度"""
+        self.received = received
+        now = time.monotonic()
+        if now - self.last_report >= PROGRESS_INTERVAL:
+            self.last_report = now
+            elapsed = now - self.sample_time
+            if elapsed >= PROGRESS_INTERVAL:
+                sample = (received - self.sample_received) / elapsed
+                self.rate = sample if self.rate is None else \
+                    RATE_SMOOTHING * sample + (1 - RATE_SMOOTHING) * self.rate
+                self.sample_time = now
+                self.sample_received = received
+            event_bus.publish("progress", self.event())
+
+    def finish(self, success: bool):
+        transfers.remove(self)
+        event_bus.publish("progress", self.event(done=True, success=success))
+
+class TransferRegistry:
+    """进行中的上传：transfer_id -> ProgressReporter，查询时才生成快照"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active: Dict[str, ProgressReporter] = {}
+
+    def add(self, progress: ProgressReporter):
+        with self.lock:
+            self.active[progress.transfer_id] = progress
+
+    def remove(self, progress: ProgressReporter):
+        with self.lock:
+            self.active.pop(progress.transfer_id, None)
+
+    def __len__(self) -> int:
+        return len(self.active)
+
+    def snapshot(self) -> List[dict]:
+        with self.lock:
+            active = list(self.active.values())
+        return sorted((progress.event() for progress in active), key=lambda item: item["started"])
+
+transfers = TransferRegistry()
+event_bus = EventBus()
+
+class UploadSession:
+    """一次可续传的分块上传：各分块/字节区间用 pwrite 写入桌面目录中预分配的临时文件"""
+
+    def __init__(self, filename: str, size: int, chunk_size: int, client_ip: str, expected_digest=None):
+        self.session_id = uuid.uuid4().hex
+        self.filename = filename
+        self.size = size
+        self.chunk_size = chunk_size
+        self.client_ip = client_ip
+        self.total_chunks = (size + chunk_size - 1) // chunk_size
+        # 已写入的字节区间，按起点排序且互不相邻
+        self.received: List[List[int]] = []
+        self.updated_at = time.time()
+        # 正在写入的请求数；开始完成会话后不再接受写入，有写入进行中时也不能完成
+        self.writers = 0
+        self.finalizing = False
+        # 摘要已覆盖到的位置：按顺序到达的数据在写入时直接计算，乱序的部分补齐后从文件读取
+        self.expected_digest = expected_digest
+        self.hasher = new_hasher(expected_digest)
+        self.hashed_upto = 0
+        # 写入在 IO 线程池中进行，摘要的推进需要加锁
+        self.hash_lock = threading.Lock()
+        self.partial_path = staging_path(DESKTOP_PATH, self.session_id)
+        # 预分配文件空间，多个连接可以并发写入各自的位置；失败时不留下临时文件，也不登记传输
+        try:
+            preallocate_file(self.partial_path, size)
+        except OSError:
+            remove_quietly(self.partial_path)
+            raise
+        self.progress = ProgressReporter(filename, size, client_ip)
+
+    def chunk_length(self, index: int) -> int:
+        """返回第 index 个分块应有的字节数"""
+        if index < 0 or index >= self.total_chunks:
+            raise HTTPException(status_code=416, detail=f"分块编号超出范围: {index}")
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    async def write_range(self, start: int, request: Request, length: int):
+        """把请求体写入 [start, start + length)，可与其他区间并发写入"""
+        end = start + length
+        if start < 0 or end > self.size:
+            raise HTTPException(status_code=416, detail=f"区间超出文件大小: {start}-{end}")
+        if self.finalizing:
+            raise HTTPException(status_code=409, detail="上传会话正在完成，不再接受数据")
+        self.writers += 1
+        try:
+            await self._write_range(start, request, length)
+        finally:
+            self.writers -= 1
+
+    async def _write_range(self, start: int, request: Request, length: int):
+        end = start + length
+        # 重传的区间在写完之前视为缺失
+        remove_range(self.received, start, end)
+        if self.hasher and start < self.hashed_upto:
+            with self.hash_lock:
+                # 已计入摘要的数据被重写，只能重新计算
+                self.hasher = new_hasher(self.expected_digest)
+                self.hashed_upto = 0
+        try:
+            fd = await run_io(os.open, self.partial_path, os.O_WRONLY)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="上传会话已结束")
+        offset = start
+        trace = current_trace()
+        try:
+            t = time.perf_counter()
+            async for data in request.stream():
+                trace.add("parse", t)
+                if offset + len(data) > end:
+                    raise HTTPException(status_code=400, detail=f"请求体长度应为 {length} 字节")
+                await run_io(self.write_block, fd, data, offset)
+                offset += len(data)
+                t = time.perf_counter()
+            await run_io(release_written, fd, start, offset - start)
+        finally:
+            await run_io(os.close, fd)
+        if offset != end:
+            raise HTTPException(status_code=400, detail="分块数据不完整")
+        add_range(self.received, start, end)
+        self.updated_at = time.time()
+        self.progress.update(self.received_bytes())
+        # 区间集合只在事件循环中修改，在这里算好摘要可以推进到的位置
+        await run_io(self.advance_hash, covered_end(self.received, self.hashed_upto))
+
+    def write_block(self, fd: int, data: bytes, offset: int):
+        """在 offset 处写入数据，正好接在摘要位置之后时顺便计入摘要"""
+        trace = current_trace()
+        t = time.perf_counter()
+        os.pwrite(fd, data, offset)
+        t = trace.add("write", t)
+        if self.hasher and self.hashed_upto == offset:
+            with self.hash_lock:
+                if self.hashed_upto == offset:
+                    self.hasher.update(data)
+                    self.hashed_upto += len(data)
+            trace.add("hash", t)
+
+    def advance_hash(self, end: Optional[int] = None):
+        """把摘要推进到连续已写入数据的末尾（或 end），乱序到达的数据此时通常还在页缓存中"""
+        if not self.hasher:
+            return
+        with self.hash_lock:
+            if end is None:
+                end = covered_end(self.received, self.hashed_upto)
+            if end <= self.hashed_upto:
+                return
+            t = time.perf_counter()
+            with open(self.partial_path, "rb") as f:
+                f.seek(self.hashed_upto)
+                while self.hashed_upto < end:
+                    data = f.read(min(COPY_CHUNK_SIZE, end - self.hashed_upto))
+                    if not data:
+                        break
+                    self.hasher.update(data)
+                    self.hashed_upto += len(data)
+            current_trace().add("hash", t)
+
+    def received_bytes(self) -> int:
+        """返回已写入的字节数"""
+        return sum(end - start for start, end in self.received)
+
+    def received_ranges(self) -> List[List[int]]:
+        """返回已保存的字节区间列表 [[start, end), ...]"""
+        return [list(r) for r in self.received]
+
+    def missing_chunks(self) -> List[int]:
+        """返回尚未完整收到的分块编号"""
+        return [i for i in range(self.total_chunks)
+                if not range_covered(self.received, i * self.chunk_size, i * self.chunk_size + self.chunk_length(i))]
+
+    def is_complete(self) -> bool:
+        """整个文件是否都已写入"""
+        return range_covered(self.received, 0, self.size)
+
+    def begin_finalize(self):
+        """数据已全部到齐且没有进行中的写入时把会话标记为正在完成，之后到达的写入会被拒绝"""
+        if self.writers:
+            raise HTTPException(status_code=409, detail="还有分块正在写入")
+        if not self.is_complete():
+            raise HTTPException(status_code=409, detail="还有分块尚未上传")
+        self.finalizing = True
+
+    def to_dict(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "filename": self.filename,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "total_chunks": self.total_chunks,
+            "received_ranges": self.received_ranges(),
+            "missing_chunks": self.missing_chunks(),
+        }
+
+    def discard(self):
+        """放弃会话并删除临时文件"""
+        self.progress.finish(False)
+        try:
+            os.remove(self.partial_path)
+        except FileNotFoundError:
+            pass
+
+def get_session(session_id: str) -> UploadSession:
+    session = upload_sessions.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="上传会话不存在或已过期")
+    return session
+
+async def sweep_sessions():
+    """删除过期的会话，以及不属于任何会话、超过 SESSION_TTL 没有修改的临时文件"""
+    now = time.time()
+    for session in [s for s in upload_sessions.values() if now - s.updated_at > SESSION_TTL and not s.writers]:
+        del upload_sessions[session.session_id]
+        await run_io(session.discard)
+    active = {s.partial_path for s in upload_sessions.values()}
+    await run_io(remove_stale_parts, DESKTOP_PATH, active, SESSION_TTL)
+
+async def session_sweeper():
+    """清理之前的进程遗留的临时文件，之后每 SESSION_SWEEP_INTERVAL 秒清理一次过期会话"""
+    await run_io(remove_stale_parts, DESKTOP_PATH, set(), ORPHAN_PART_AGE)
+    while True:
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL)
+        await sweep_sessions()
+
+class StreamingUpload:
+    """边接收边解析 multipart 请求体，文件内容直接写入保存目录中的临时文件，完成后原子改名
+
+    不经过 Starlette 的 SpooledTemporaryFile，每个字节只写一次盘，且临时文件与目标在同一文件系统。
+    python-multipart 的推送式解析器在 IO 线程池中运行，回调中直接写盘，内存占用与文件大小无关。
+    普通字段 digest 对紧随其后的一个文件生效，digests（JSON，文件名 -> 摘要）对所有文件生效。
+    已发布的文件在请求结束时一次性登记到内容索引和传输历史。
+    """
+
+    def __init__(self, boundary: bytes, client_ip: str, progress: ProgressReporter):
+        self.client_ip = client_ip
+        self.progress = progress
+        self.results: List[dict] = []
+        self.saved: List[tuple] = []
+        self.expected_digests = {}
+        self.next_digest = None
+        self.ended = False
+        self.part: Optional[dict] = None
+        self.header_field = b""
+        self.header_value = b""
+        self.headers = {}
+        self.parser = multipart.MultipartParser(boundary, callbacks={
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": self.on_header_field,
+            "on_header_value": self.on_header_value,
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+            "on_end": self.on_end,
+        })
+
+    def write(self, data: bytes):
+        # 解析器在回调中写盘，parse 只计解析本身的耗时
+        trace = current_trace()
+        nested = trace.total("write", "hash", "fsync", "resolve_name")
+        started = time.perf_counter()
+        self.parser.write(data)
+        trace.add("parse", started + trace.total("write", "hash", "fsync", "resolve_name") - nested)
+
+    def finish(self):
+        """请求体接收完毕，检查 multipart 是否完整"""
+        self.parser.finalize()
+        if not self.ended:
+            raise HTTPException(status_code=400, detail="请求体不完整")
+        self.flush()
+
+    def flush(self):
+        """把已发布的文件一次性登记到内容索引和传输历史"""
+        saved, self.saved = self.saved, []
+        if saved:
+            record_uploads(saved, self.client_ip)
+
+    def abort(self):
+        """出错或客户端断开时删除未完成的临时文件，已发布的文件照常登记"""
+        self.flush()
+        part, self.part = self.part, None
+        if part and part.get("file"):
+            part["file"].close()
+            try:
+                os.remove(part["temp_path"])
+            except FileNotFoundError:
+                pass
+
+    def on_part_begin(self):
+        self.headers = {}
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self.header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self.header_value += data[start:end]
+
+    def on_header_end(self):
+        self.headers[self.header_field.lower()] = self.header_value
+        self.header_field = b""
+        self.header_value = b""
+
+    def on_headers_finished(self):
+        _, params = parse_options_header(self.headers.get(b"content-disposition", b""))
+        name = params.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" not in params:
+            self.part = {"name": name, "value": bytearray()}
+            return
+        filename = os.path.basename(params[b"filename"].decode("utf-8", "replace").replace("\\", "/"))
+        self.part = {"name": name, "filename": filename}
+        if not filename:
+            # 没有选择文件的文件字段
+            return
+        expected = self.next_digest or self.expected_digests.get(filename)
+        self.next_digest = None
+        temp_path = staging_path(DESKTOP_PATH)
+        self.part.update(temp_path=temp_path, file=OutputFile(temp_path), expected=expected,
+                         hasher=new_hasher(expected), size=0)
+        self.progress.filename = filename
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        part = self.part
+        if part.get("file"):
+            write_and_hash(part["file"], part["hasher"], data[start:end])
+            part["size"] += end - start
+        elif "value" in part:
+            if len(part["value"]) + end - start > MAX_FORM_FIELD_SIZE:
+                raise HTTPException(status_code=413, detail=f"字段 {part['name']} 过大")
+            part["value"] += data[start:end]
+
+    def on_part_end(self):
+        part, self.part = self.part, None
+        if "value" in part:
+            value = part["value"].decode("utf-8", "replace")
+            if part["name"] == "digest" and value:
+                self.next_digest = parse_digest(value)
+            elif part["name"] == "digests" and value:
+                try:
+                    self.expected_digests = {name: parse_digest(item) for name, item in json.loads(value).items()}
+                except (ValueError, AttributeError) as e:
+                    raise HTTPException(status_code=400, detail=f"digests 字段无效: {e}")
+            return
+        if not part.get("file"):
+            return
+        part["file"].finish()
+        stat = os.fstat(part["file"].fileno())
+        part["file"].close()
+        expected, hasher = part["expected"], part["hasher"]
+        if expected and hasher.hexdigest() != expected[1]:
+            os.remove(part["temp_path"])
+            self.results.append({"success": False, "filename": part["filename"],
+                                 "error": f"文件 {part['filename']} 校验失败，摘要不一致"})
+            return
+        try:
+            file_path = commit_file(DESKTOP_PATH, part["filename"], part["temp_path"], timestamped_names)
+        except OSError:
+            remove_quietly(part["temp_path"])
+            raise
+        digest = format_digest(hasher)
+        self.saved.append((file_path, part["size"], digest, stat))
+        self.results.append({"success": True, "filename": os.path.basename(file_path), "size": part["size"],
+                             "digest": digest})
+
+    def on_end(self):
+        self.ended = True
+
+class BlockingStreamReader:
+    """让工作线程中的拉取式解析器（如 tarfile）以阻塞的 read() 读取异步的请求体流
+
+    每次缺数据时才向事件循环要下一块，内存中只有当前这一块
+    """
+
+    def __init__(self, stream, loop: asyncio.AbstractEventLoop):
+        self.stream = stream.__aiter__()
+        self.loop = loop
+        self.buffer = bytearray()
+        self.received = 0
+        self.ended = False
+
+    async def next_chunk(self) -> Optional[bytes]:
+        try:
+            return await self.stream.__anext__()
+        except StopAsyncIteration:
+            return None
+
+    def read(self, size: int = -1) -> bytes:
+        while not self.ended and (size < 0 or len(self.buffer) < size):
+            data = asyncio.run_coroutine_threadsafe(self.next_chunk(), self.loop).result()
+            if data is None:
+                self.ended = True
+                break
+            self.received += len(data)
+            self.buffer += data
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+hash_index = HashIndex(os.path.join(STATE_DIR, "hash_index.db"))
+
+class TransferHistory(HistoryStore):
+    @staticmethod
+    def to_record(row) -> dict:
+        item_id, filename, size, client_ip, created, digest = row
+        record = {
+            "filename": filename,
+            "size": size,
+            "client_ip": client_ip,
+            "timestamp": datetime.datetime.fromtimestamp(created).isoformat(),
+            "id": item_id
+        }
+        if digest:
+            record["digest"] = digest
+        return record
+
+# 传输历史记录
+transfer_history = TransferHistory(os.path.join(STATE_DIR, "backend_history.db"))
+
+class SessionCreate(BaseModel):
+    filename: str
+    size: int
+    chunk_size: Optional[int] = None
+    digest: Optional[str] = None
+
+class PreflightFile(BaseModel):
+    filename: str
+    size: int
+    digest: str
+
+class PreflightRequest(BaseModel):
+    files: List[PreflightFile]
+    materialize: bool = False
+
+class LimitsUpdate(BaseModel):
+    rate: Optional[Union[int, str]] = None
+    client_rate: Optional[Union[int, str]] = None
+    clients: Dict[str, Optional[Union[int, str]]] = {}
 
 @app.get("/")
 async def root():
@@ -69,121 +1223,483 @@ async def get_server_info():
     """获取服务器信息"""
     return get_device_info()
 
+@app.get("/api/peers")
+async def get_peers():
+    """通过组播发现的局域网中的其他实例"""
+    return {"enabled": peer_discovery is not None, "peers": peer_discovery.snapshot() if peer_discovery else []}
+
+@app.get("/api/transfers")
+async def get_transfers():
+    """进行中的上传：已接收字节数、速率（字节/秒）和预计剩余秒数"""
+    return {"transfers": transfers.snapshot()}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus 文本格式的指标"""
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.get("/api/events")
+async def events(request: Request, last_event_id: Optional[int] = None):
+    """SSE 事件流：推送历史记录的增删和进行中的上传进度，支持 Last-Event-ID 续传"""
+    header = request.headers.get("last-event-id")
+    last_id = int(header) if header and header.isdigit() else last_event_id
+
+    async def stream():
+        nonlocal last_id
+        yield "retry: 3000\n\n"
+        while not await request.is_disconnected():
+            events = await event_bus.wait(last_id, SSE_KEEPALIVE)
+            if events:
+                last_id = events[-1][0]
+                yield "".join(f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+                              for event_id, event_type, data in events)
+            else:
+                yield ": keepalive\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
 @app.get("/api/history")
-async def get_history():
-    """获取传输历史记录"""
-    return {"history": transfer_history}
+async def get_history(
+    request: Request,
+    limit: int = Query(100, ge=1, le=MAX_HISTORY_PAGE),
+    before_id: Optional[int] = None,
+    start: Optional[datetime.datetime] = None,
+    end: Optional[datetime.datetime] = None,
+    client_ip: Optional[str] = None,
+    since: Optional[int] = Query(None, ge=0),
+):
+    """获取传输历史记录：最新的 limit 条（按 id 升序），before_id 用于向前翻页，可按时间范围和来源 IP 过滤
+
+    带 If-None-Match 且历史没有变化时返回 304；since 为上次响应中的 version 时只返回之后的增删
+    """
+    version = transfer_history.version
+    etag = transfer_history.etag(version)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in parse_etags(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    filters = {
+        "start": start.timestamp() if start else None,
+        "end": end.timestamp() if end else None,
+        "client_ip": client_ip,
+    }
+    if since is not None:
+        return JSONResponse(content=transfer_history.changes_since(since, **filters), headers=headers)
+    history = transfer_history.query(limit=limit, before_id=before_id, **filters)
+    return JSONResponse(
+        content={"history": history, "has_more": len(history) == limit, "version": version}, headers=headers)
 
 @app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...)):
-    """上传文件"""
+async def upload_file(file: UploadFile = File(...), digest: Optional[str] = Form(None)):
+    """上传文件，可选的 digest 字段为期望的摘要（"算法:十六进制"）"""
     try:
         if not file.filename:
             raise HTTPException(status_code=400, detail="文件名不能为空")
+        expected = parse_digest(digest) if digest else None
         
-        # 确保桌面目录存在
-        os.makedirs(DESKTOP_PATH, exist_ok=True)
-        
-        # 文件保存路径
-        file_path = os.path.join(DESKTOP_PATH, file.filename)
-        
-        # 如果文件已存在，添加时间戳
-        if os.path.exists(file_path):
-            name, ext = os.path.splitext(file.filename)
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            file_path = os.path.join(DESKTOP_PATH, f"{name}_{timestamp}{ext}")
+        # 保存文件（文件已存在则添加时间戳），同时计算摘要并添加到历史记录
+        result = await store_upload(file, expected)
         
-        # 保存文件
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # 获取文件大小
-        file_size = os.path.getsize(file_path)
-        
-        # 添加到历史记录
-        add_to_history(os.path.basename(file_path), file_size, "未知")
-        
-        return JSONResponse(content={
-            "success": True,
-            "message": f"文件 {os.path.basename(file_path)} 已成功保存到桌面",
-            "filename": os.path.basename(file_path),
-            "size": file_size,
-            "path": file_path
-        })
+        return JSONResponse(content={**result, "message": f"文件 {result['filename']} 已成功保存到桌面"})
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"文件上传失败: {str(e)}")
 
 @app.post("/api/upload-multiple")
-async def upload_multiple_files(files: List[UploadFile] = File(...)):
-    """上传多个文件"""
-    results = []
+async def upload_multiple_files(request: Request):
+    """上传多个文件（files 字段），可选的 digests 字段为 JSON（文件名 -> "算法:十六进制"），按批次并发写入
+
+    Accept 包含 application/x-ndjson 时，每个文件保存好就返回一行结果，最后一行为汇总；
+    否则全部完成后按上传顺序返回 {"results": [...]}。
+    自行解析表单以放宽 Starlette 默认的 1000 个文件上限，上传的文件由 UploadBatch 在保存完后关闭。
+    """
+    form = await request.form(max_files=MAX_BATCH_FILES)
+    files = [file for file in form.getlist("files") if not isinstance(file, str)]
+    digests = form.get("digests")
+    if not files:
+        await form.close()
+        raise HTTPException(status_code=400, detail="没有上传文件")
+    try:
+        expected_digests = {name: parse_digest(value) for name, value in json.loads(digests).items()} if digests else {}
+    except (ValueError, AttributeError) as e:
+        await form.close()
+        raise HTTPException(status_code=400, detail=f"digests 字段无效: {e}")
+
+    batch = UploadBatch(files, expected_digests, request.client.host if request.client else "未知")
+    task = asyncio.create_task(batch.run())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    if "application/x-ndjson" not in request.headers.get("accept", ""):
+        return JSONResponse(content={"results": await task})
+
+    async def stream():
+        succeeded = failed = 0
+        while True:
+            result = await batch.queue.get()
+            if result is None:
+                break
+            if result["success"]:
+                succeeded += 1
+            else:
+                failed += 1
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+        yield json.dumps({"done": True, "succeeded": succeeded, "failed": failed}) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/api/upload/stream")
+async def upload_stream(request: Request):
+    """流式上传一个或多个文件（multipart/form-data），边接收边写入桌面，不在临时目录中转"""
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or not params.get(b"boundary"):
+        raise HTTPException(status_code=400, detail="请求必须是带 boundary 的 multipart/form-data")
+    client_ip = request.client.host if request.client else "未知"
+    content_length = request.headers.get("content-length")
+    progress = ProgressReporter(None, int(content_length) if content_length and content_length.isdigit() else None,
+                                client_ip)
+    upload = StreamingUpload(params[b"boundary"], client_ip, progress)
+    received = 0
+    try:
+        async for data in request.stream():
+            await run_io(upload.write, data)
+            received += len(data)
+            progress.update(received)
+        await run_io(upload.finish)
+    except BaseException as e:
+        await run_io(upload.abort)
+        progress.finish(False)
+        if isinstance(e, multipart.exceptions.MultipartParseError):
+            raise HTTPException(status_code=400, detail=f"multipart 格式错误: {e}")
+        raise
+    progress.finish(True)
+    return {"results": upload.results}
+
+@app.post("/api/upload/archive")
+async def upload_archive(request: Request, name: str = Query(...)):
+    """上传文件夹：请求体是 tar 流（可以是 .tar.gz 等），边接收边解压到桌面上的同名文件夹，保留目录结构
+
+    成千上万个小文件只需要一个请求；解压在单独的线程池中进行，不阻塞事件循环，也不占用其他请求写盘用的 IO 线程
+    """
+    folder_name = os.path.basename(name.replace("\\", "/").rstrip("/"))
+    if folder_name in ("", ".", ".."):
+        raise HTTPException(status_code=400, detail="缺少文件夹名称 name")
+    client_ip = request.client.host if request.client else "未知"
+    content_length = request.headers.get("content-length")
+    progress = ProgressReporter(folder_name, int(content_length) if content_length and content_length.isdigit() else None,
+                                client_ip)
+    reader = BlockingStreamReader(request.stream(), asyncio.get_running_loop())
+    try:
+        dir_path, files, size, skipped = await run_archive(extract_archive, reader, DESKTOP_PATH, folder_name,
+                                                           lambda: progress.update(reader.received), timestamped_names)
+    except BaseException as e:
+        progress.finish(False)
+        if isinstance(e, ArchiveError):
+            raise HTTPException(status_code=400, detail=str(e))
+        raise
+    await run_io(add_to_history, os.path.basename(dir_path), size, client_ip, count_file=False)
+    progress.finish(True)
+    return {
+        "success": True,
+        "folder": os.path.basename(dir_path),
+        "files": files,
+        "size": size,
+        "skipped": skipped,
+        "path": dir_path
+    }
+
+@app.post("/api/upload/session", status_code=201)
+async def create_upload_session(body: SessionCreate, request: Request):
+    """创建分块上传会话"""
+    filename = os.path.basename(body.filename)
+    if not filename:
+        raise HTTPException(status_code=400, detail="文件名不能为空")
+    chunk_size = body.chunk_size or DEFAULT_SESSION_CHUNK_SIZE
+    if body.size < 0:
+        raise HTTPException(status_code=400, detail="文件大小无效")
+    if chunk_size <= 0 or chunk_size > MAX_SESSION_CHUNK_SIZE:
+        raise HTTPException(status_code=400, detail=f"分块大小必须在 1 到 {MAX_SESSION_CHUNK_SIZE} 字节之间")
     
-    for file in files:
-        try:
-            if not file.filename:
+    expected_digest = parse_digest(body.digest) if body.digest else None
+    await run_io(os.makedirs, DESKTOP_PATH, exist_ok=True)
+    # 预分配大文件可能耗时，放到 IO 线程池中
+    session = await run_io(UploadSession, filename, body.size, chunk_size,
+                           request.client.host if request.client else "未知", expected_digest)
+    upload_sessions[session.session_id] = session
+    return session.to_dict()
+
+@app.get("/api/upload/session/{session_id}")
+async def get_upload_session(session_id: str):
+    """查询已保存的区间和缺失的分块"""
+    return get_session(session_id).to_dict()
+
+@app.put("/api/upload/session/{session_id}/chunk/{index}")
+async def upload_chunk(session_id: str, index: int, request: Request):
+    """上传一个分块，请求体为原始数据"""
+    session = get_session(session_id)
+    expected = session.chunk_length(index)
+    content_length = request.headers.get("content-length")
+    if content_length is not None:
+        if not content_length.isdigit():
+            raise HTTPException(status_code=400, detail="Content-Length 无效")
+        if int(content_length) != expected:
+            raise HTTPException(status_code=400, detail=f"分块 {index} 的长度应为 {expected} 字节")
+    
+    await session.write_range(index * session.chunk_size, request, expected)
+    return {"index": index, "received_bytes": session.received_bytes()}
+
+@app.put("/api/upload/session/{session_id}")
+async def upload_range(session_id: str, request: Request):
+    """按 Content-Range 写入任意字节区间，多个连接可并发写入同一个文件"""
+    session = get_session(session_id)
+    content_range = parse_content_range(request.headers.get("content-range"))
+    if content_range is None:
+        raise HTTPException(status_code=400, detail="缺少或无效的 Content-Range")
+    start, end, total = content_range
+    if total is not None and total != session.size:
+        raise HTTPException(status_code=416, detail=f"文件总大小应为 {session.size} 字节")
+    
+    await session.write_range(start, request, end - start)
+    return {"start": start, "end": end, "received_bytes": session.received_bytes()}
+
+@app.post("/api/upload/session/{session_id}/complete")
+async def complete_upload_session(session_id: str):
+    """所有分块到齐后生成最终文件"""
+    session = get_session(session_id)
+    session.begin_finalize()
+    del upload_sessions[session_id]
+    
+    # 校验摘要，不一致时丢弃整个文件
+    await run_io(session.advance_hash)
+    if session.expected_digest and session.hasher.hexdigest() != session.expected_digest[1]:
+        await run_io(session.discard)
+        raise HTTPException(status_code=422, detail="文件校验失败，摘要不一致")
+    digest = format_digest(session.hasher)
+    
+    try:
+        await run_io(sync_path, session.partial_path)
+        file_path = await run_io(commit_file, DESKTOP_PATH, session.filename, session.partial_path, timestamped_names)
+    except BaseException:
+        # 会话已结束，发布失败时同样结束进度并删除临时文件
+        await run_io(session.discard)
+        raise
+    session.progress.finish(True)
+    await run_io(record_upload, file_path, session.size, session.client_ip, digest)
+    
+    return {
+        "success": True,
+        "message": f"文件 {os.path.basename(file_path)} 已成功保存到桌面",
+        "filename": os.path.basename(file_path),
+        "size": session.size,
+        "path": file_path,
+        "digest": digest
+    }
+
+@app.delete("/api/upload/session/{session_id}")
+async def cancel_upload_session(session_id: str):
+    """取消分块上传会话"""
+    session = get_session(session_id)
+    del upload_sessions[session_id]
+    await run_io(session.discard)
+    return {"message": "上传会话已取消"}
+
+@app.post("/api/preflight")
+async def preflight(body: PreflightRequest, request: Request):
+    """上传前查询桌面上已有哪些文件
+
+    已有内容相同的文件时返回 exists，客户端可以跳过上传；materialize 为 true 且已有文件名字不同时，
+    用硬链接（或复制）生成同名文件。查询可能需要计算已有文件的摘要，在 IO 线程池中执行
+    """
+    return {"results": await run_io(check_preflight, body, request.client.host if request.client else "未知")}
+
+def check_preflight(body: PreflightRequest, client_ip: str) -> List[dict]:
+    results = []
+    for item in body.files:
+        filename = os.path.basename(item.filename)
+        algorithm, hexdigest = parse_digest(item.digest)
+        existing = hash_index.lookup(DESKTOP_PATH, item.size, algorithm, hexdigest, prefer=filename)
+        result = {"filename": filename, "exists": existing is not None, "existing": existing}
+        if existing and body.materialize and filename and existing != filename:
+            # 先在临时文件上生成硬链接（或副本），再原子地发布
+            source_path = os.path.join(DESKTOP_PATH, existing)
+            temp_path = staging_path(DESKTOP_PATH)
+            try:
+                try:
+                    os.link(source_path, temp_path)
+                except OSError:
+                    shutil.copyfile(source_path, temp_path)
+                file_path = commit_file(DESKTOP_PATH, filename, temp_path, timestamped_names)
+            except OSError as e:
+                # 已有文件可能刚被删除或无法复制，让客户端照常上传这一个文件
+                remove_quietly(temp_path)
+                result.update(exists=False, error=f"生成同名文件失败: {e}")
+                results.append(result)
                 continue
-                
-            # 确保桌面目录存在
-            os.makedirs(DESKTOP_PATH, exist_ok=True)
-            
-            # 文件保存路径
-            file_path = os.path.join(DESKTOP_PATH, file.filename)
-            
-            # 如果文件已存在，添加时间戳
-            if os.path.exists(file_path):
-                name, ext = os.path.splitext(file.filename)
-                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                file_path = os.path.join(DESKTOP_PATH, f"{name}_{timestamp}{ext}")
-            
-            # 保存文件
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            
-            # 获取文件大小
-            file_size = os.path.getsize(file_path)
-            
-            # 添加到历史记录
-            add_to_history(os.path.basename(file_path), file_size, "未知")
-            
-            results.append({
-                "success": True,
-                "filename": os.path.basename(file_path),
-                "size": file_size
-            })
-            
-        except Exception as e:
-            results.append({
-                "success": False,
-                "filename": file.filename,
-                "error": str(e)
+            digest = f"{algorithm}:{hexdigest}"
+            record_upload(file_path, item.size, client_ip, digest)
+            result["saved_as"] = os.path.basename(file_path)
+        results.append(result)
+    return results
+
+@app.get("/api/files")
+async def list_files():
+    """列出桌面上可供下载的文件（跳过隐藏文件和未完成的上传）"""
+    files = []
+    if os.path.isdir(DESKTOP_PATH):
+        for entry in os.scandir(DESKTOP_PATH):
+            if entry.name.startswith(".") or not entry.is_file():
+                continue
+            stat = entry.stat()
+            files.append({
+                "filename": entry.name,
+                "size": stat.st_size,
+                "modified": datetime.datetime.fromtimestamp(stat.st_mtime).isoformat()
             })
+    files.sort(key=lambda item: item["filename"])
+    return {"files": files}
+
+@app.api_route("/api/download/{filename}", methods=["GET", "HEAD"])
+async def download_file(filename: str, request: Request, compress: bool = Query(False)):
+    """下载桌面上的文件，支持 Range 断点续传；compress=1 时边读边压缩"""
+    if filename != os.path.basename(filename) or filename.startswith("."):
+        raise HTTPException(status_code=404, detail="文件不存在")
+    file_path = os.path.join(DESKTOP_PATH, filename)
+    # 文件系统调用可能阻塞（如网络盘），和其他文件操作一样放到 IO 线程池中
+    try:
+        file_stat = await run_io(os.stat, file_path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="文件不存在")
+    if not stat.S_ISREG(file_stat.st_mode):
+        raise HTTPException(status_code=404, detail="文件不存在")
     
-    return JSONResponse(content={"results": results})
+    size = file_stat.st_size
+    etag = file_etag(file_stat)
+    # If-Range 与当前文件不一致时文件已经变化，忽略 Range 发送完整文件
+    range_header = request.headers.get("range")
+    if not if_range_matches(request.headers.get("if-range"), etag, file_stat.st_mtime):
+        range_header = None
+    try:
+        byte_range = parse_range_header(range_header, size)
+    except ValueError:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    start, end = byte_range or (0, size)
+    headers = {
+        "Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}",
+        "Accept-Ranges": "bytes",
+    }
+    # 客户端要求压缩、请求整个文件且内容可压缩时，按客户端接受的编码边读边压缩
+    encoding = None
+    if compress and not byte_range and size >= MIN_COMPRESS_SIZE and is_compressible(filename):
+        encoding = choose_encoding(request.headers.get("accept-encoding"))
+    if encoding:
+        headers.update({"Content-Encoding": encoding, "Vary": "Accept-Encoding"})
+        body = compress_file(file_path, encoding) if request.method != "HEAD" else iter(())
+        return StreamingResponse(body, media_type="application/octet-stream", headers=headers)
+    headers.update({"ETag": etag, "Last-Modified": format_http_date(file_stat.st_mtime),
+                    "Content-Length": str(end - start)})
+    if byte_range:
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    return FileRangeResponse(file_path, start, end, 206 if byte_range else 200, headers)
+
+async def compress_file(file_path: str, encoding: str):
+    """逐块读取并压缩文件，读取和压缩都在 IO 线程池中进行"""
+    encoder = new_encoder(encoding)
+
+    def next_block(f) -> Optional[bytes]:
+        data = f.read(DOWNLOAD_CHUNK_SIZE)
+        return encoder.compress(data) if data else None
+
+    f = await run_io(open, file_path, "rb")
+    try:
+        while True:
+            block = await run_io(next_block, f)
+            if block is None:
+                break
+            if block:
+                yield block
+        yield encoder.flush()
+    finally:
+        await run_io(f.close)
+
+def require_admin(request: Request):
+    """管理接口只接受本机访问，或者带有 LOCALSEND_ADMIN_TOKEN 令牌的请求"""
+    try:
+        loopback = request.client is not None and ipaddress.ip_address(request.client.host).is_loopback
+    except ValueError:
+        # 不是 IP 地址（如 Unix 套接字或测试客户端的主机名），按非本机处理
+        loopback = False
+    if loopback:
+        return
+    authorization = request.headers.get("authorization") or ""
+    if not (ADMIN_TOKEN and hmac.compare_digest(authorization.encode(), f"Bearer {ADMIN_TOKEN}".encode())):
+        raise HTTPException(status_code=403, detail="只允许本机访问管理接口")
+
+@app.get("/api/admin/limits")
+async def get_limits(request: Request):
+    """查看上传限速"""
+    require_admin(request)
+    return transfer_scheduler.limits()
+
+@app.put("/api/admin/limits")
+async def update_limits(body: LimitsUpdate, request: Request):
+    """调整上传限速；字段省略或为 null 时不变，速率为字节/秒（可写成 "10M"），0 表示不限速；
+    clients 中速率为 null 时删除该客户端的单独设置
+    """
+    require_admin(request)
+    try:
+        for client_ip in body.clients:
+            ipaddress.ip_address(client_ip)
+        await transfer_scheduler.configure(
+            rate=None if body.rate is None else parse_rate(body.rate),
+            client_rate=None if body.client_rate is None else parse_rate(body.client_rate),
+            clients={ip: None if rate is None else parse_rate(rate) for ip, rate in body.clients.items()})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return transfer_scheduler.limits()
 
 @app.delete("/api/history/{item_id}")
 async def delete_history_item(item_id: int):
     """删除历史记录项"""
-    global transfer_history
-    transfer_history = [item for item in transfer_history if item["id"] != item_id]
+    if not transfer_history.delete(item_id):
+        raise HTTPException(status_code=404, detail="历史记录不存在")
+    event_bus.publish("history-deleted", {"id": item_id})
     return {"message": "历史记录已删除"}
 
 @app.delete("/api/history")
 async def clear_history():
     """清空历史记录"""
-    global transfer_history
-    transfer_history = []
+    transfer_history.clear()
+    event_bus.publish("history-cleared", {})
     return {"message": "历史记录已清空"}
 
 if __name__ == "__main__":
-    local_ip = get_local_ip()
+    identity = server_identity.get()
+    local_ip = identity["ip"]
     port = 8000
     
     print(f"🚀 服务器启动成功!")
     print(f"📱 本地访问地址: http://localhost:{port}")
-    print(f"🌐 网络访问地址: http://{local_ip}:{port}")
-    print(f"💻 设备名称: {platform.node()}")
+    # 服务器只监听 IPv4
+    for address in identity["addresses"]:
+        if ":" not in address:
+            print(f"🌐 网络访问地址: http://{address}:{port}")
+    print(f"💻 设备名称: {identity['hostname']}")
     print(f"📁 文件将保存到: {DESKTOP_PATH}")
     print(f"🔗 其他设备请访问: http://{local_ip}:{port}")
+    limits = transfer_scheduler.limits()
+    if limits["rate"] or limits["client_rate"]:
+        print(f"🚦 上传限速: 合计 {format_rate(limits['rate'])} / 每个客户端 {format_rate(limits['client_rate'])}"
+              f"（可通过 /api/admin/limits 调整）")
+    if DISCOVERY_ENABLED:
+        try:
+            peer_discovery = PeerDiscovery(port, server_identity, "backend", DISCOVERY_CAPABILITIES).start()
+            print(f"📡 局域网发现: {DISCOVERY_GROUP}:{DISCOVERY_PORT}（其他设备见 /api/peers）")
+        except OSError as e:
+            print(f"⚠️ 局域网发现未启用: {e}")
     
-    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
+    # SSE 连接不会自己结束，关闭服务时最多等待 SHUTDOWN_TIMEOUT 秒
+    try:
+        uvicorn.run(app, host="0.0.0.0", port=port, timeout_graceful_shutdown=SHUTDOWN_TIMEOUT)
+    finally:
+        if peer_discovery:
+            peer_discovery.close()
\ No newline at end of file
@@ -0,0 +1,338 @@
+# 性能基准：在回环地址上启动 main.py 或 backend/main.py，运行固定的上传负载，输出 JSON 结果便于跨版本比较
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import shutil
+import platform
+import argparse
+import tempfile
+import datetime
+import threading
+import subprocess
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# 等待服务启动的最长时间（秒）
+STARTUP_TIMEOUT = 30
+
+# 单个请求的超时时间（秒）
+REQUEST_TIMEOUT = 120
+
+# 大文件和并发上传使用的分块大小
+CHUNK_SIZE = 8 * 1024 * 1024
+
+# 测试数据：重复使用一块随机数据，避免客户端读写磁盘影响结果
+PAYLOAD_BLOCK = os.urandom(CHUNK_SIZE)
+
+# 各服务的接口差异：单文件表单上传、表单字段名和历史记录接口
+SERVERS = {
+    'main': {'upload': '/upload', 'field': 'files', 'history': '/history?limit=100'},
+    'backend': {'upload': '/api/upload', 'field': 'file', 'history': '/api/history?limit=100'},
+}
+
+WORKLOADS = ('large', 'form', 'small', 'concurrent', 'history')
+
+# 服务的写入模式，通过环境变量 LOCALSEND_WRITE_MODE 传给服务进程
+WRITE_MODES = ('fast', 'safe', 'bulk')
+
+MB = 1024 * 1024
+
+def payload(size):
+    """size 字节的测试数据"""
+    if size <= len(PAYLOAD_BLOCK):
+        return PAYLOAD_BLOCK[:size]
+    return (PAYLOAD_BLOCK * (size // len(PAYLOAD_BLOCK) + 1))[:size]
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def percentile(values, percent):
+    """按最近秩取百分位数"""
+    if not values:
+        return None
+    values = sorted(values)
+    index = max(0, min(len(values) - 1, int(round(percent / 100 * len(values) + 0.5)) - 1))
+    return values[index]
+
+def latency_summary(latencies):
+    """请求延迟的统计（毫秒）"""
+    return {
+        'count': len(latencies),
+        'p50': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p99': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        'max': round(max(latencies) * 1000, 2) if latencies else None,
+    }
+
+class ServerProcess:
+    """在临时的 HOME 和状态目录中启动一个只监听回环地址的服务进程，读取它的 CPU 时间和峰值内存"""
+    def __init__(self, kind, extra_env=None):
+        self.kind = kind
+        self.port = free_port()
+        self.home = tempfile.mkdtemp(prefix='localsend-bench-')
+        os.makedirs(os.path.join(self.home, 'Desktop'))
+        env = dict(os.environ, HOME=self.home, USERPROFILE=self.home,
+                   LOCALSEND_STATE_DIR=os.path.join(self.home, '.localsend'), LOCALSEND_DISCOVERY='0',
+                   **(extra_env or {}))
+        if kind == 'main':
+            command = [sys.executable, os.path.join(ROOT, 'main.py'), '--host', '127.0.0.1',
+                       '--port', str(self.port), '--no-discovery']
+        else:
+            command = [sys.executable, '-m', 'uvicorn', 'main:app', '--app-dir', os.path.join(ROOT, 'backend'),
+                       '--host', '127.0.0.1', '--port', str(self.port), '--log-level', 'warning', '--no-access-log']
+        self.process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        self.wait_ready()
+
+    def wait_ready(self):
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'{self.kind} 服务启动失败:\n{self.process.stderr.read().decode(errors="replace")}')
+            try:
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=1)
+                conn.request('GET', '/api/server-info')
+                if conn.getresponse().status == 200:
+                    conn.close()
+                    return
+            except OSError:
+                time.sleep(0.1)
+        self.close()
+        raise RuntimeError(f'{self.kind} 服务在 {STARTUP_TIMEOUT} 秒内没有启动')
+
+    def cpu_seconds(self):
+        """进程已使用的 CPU 时间（用户态 + 内核态），不支持时返回 None"""
+        try:
+            with open(f'/proc/{self.process.pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def peak_rss(self):
+        """进程的峰值常驻内存（字节），不支持时返回 None"""
+        try:
+            with open(f'/proc/{self.process.pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def close(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        shutil.rmtree(self.home, ignore_errors=True)
+
+class BenchClient:
+    """记录每个请求延迟的 HTTP 客户端；每个线程使用各自的连接"""
+    def __init__(self, port):
+        self.port = port
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.errors = 0
+
+    def request(self, method, path, body=None, headers=None, record=True):
+        """发送请求，返回 (状态码, 响应体)；连接错误时记为失败并返回状态码 0"""
+        started = time.perf_counter()
+        try:
+            conn = getattr(self.local, 'conn', None)
+            if conn is None:
+                conn = self.local.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=REQUEST_TIMEOUT)
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            data = response.read()
+            if response.will_close:
+                self.local.conn = None
+                conn.close()
+            status = response.status
+        except (http.client.HTTPException, OSError):
+            self.local.conn = None
+            status, data = 0, b''
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            if record:
+                self.latencies.append(elapsed)
+            if not 200 <= status < 300:
+                self.errors += 1
+        return status, data
+
+    def upload_session(self, filename, size):
+        """用分块上传会话发送一个文件"""
+        body = json.dumps({'filename': filename, 'size': size, 'chunk_size': CHUNK_SIZE}).encode()
+        status, data = self.request('POST', '/api/upload/session', body, {'Content-Type': 'application/json'})
+        if status != 201:
+            return
+        session = json.loads(data)
+        for index in range(session['total_chunks']):
+            start = index * CHUNK_SIZE
+            self.request('PUT', f'/api/upload/session/{session["session_id"]}/chunk/{index}',
+                         payload(min(CHUNK_SIZE, size - start)))
+        self.request('POST', f'/api/upload/session/{session["session_id"]}/complete')
+
+    def upload_form(self, api, filename, size):
+        """用 multipart 表单发送一个文件"""
+        boundary = uuid.uuid4().hex
+        body = (f'--{boundary}\r\nContent-Disposition: form-data; name="{api["field"]}"; filename="{filename}"\r\n'
+                f'Content-Type: application/octet-stream\r\n\r\n').encode() + payload(size) + f'\r\n--{boundary}--\r\n'.encode()
+        self.request('POST', api['upload'], body, {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+
+def run_large(client, api, args):
+    """单个大文件，分块依次上传"""
+    client.upload_session('large.bin', args.large_size * MB)
+    return args.large_size * MB, {}
+
+def run_form(client, api, args):
+    """单个大文件，用一个 multipart 表单请求上传（不经过分块会话，大小事先未知）"""
+    client.upload_form(api, 'form.bin', args.form_size * MB)
+    return args.form_size * MB, {}
+
+def run_small(client, api, args):
+    """大量小文件，每个文件一个表单请求，由 small_workers 个连接并发发送"""
+    size = args.small_size * 1024
+    with ThreadPoolExecutor(max_workers=args.small_workers) as pool:
+        for future in [pool.submit(client.upload_form, api, f'small-{i}.bin', size) for i in range(args.small_count)]:
+            future.result()
+    return args.small_count * size, {}
+
+def run_concurrent(client, api, args):
+    """clients 个客户端同时各上传一个文件"""
+    size = args.client_size * MB
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        for future in [pool.submit(client.upload_session, f'client-{i}.bin', size) for i in range(args.clients)]:
+            future.result()
+    return args.clients * size, {}
+
+def run_history(client, api, args):
+    """在并发上传的同时不断轮询历史记录，单独统计轮询的延迟"""
+    stop = threading.Event()
+    poller = BenchClient(client.port)
+
+    def poll():
+        while not stop.is_set():
+            poller.request('GET', api['history'])
+            time.sleep(args.poll_interval)
+
+    thread = threading.Thread(target=poll, daemon=True)
+    thread.start()
+    try:
+        size, _ = run_concurrent(client, api, args)
+    finally:
+        stop.set()
+        thread.join()
+    return size, {'poll_latency_ms': latency_summary(poller.latencies), 'poll_errors': poller.errors}
+
+RUNNERS = {'large': run_large, 'form': run_form, 'small': run_small, 'concurrent': run_concurrent,
+           'history': run_history}
+
+def run_workload(kind, workload, args, write_mode=None):
+    """在新启动的服务上运行一个负载，返回结果字典（每个负载单独启动服务，峰值内存互不影响）"""
+    env = dict(args.env)
+    if write_mode:
+        env['LOCALSEND_WRITE_MODE'] = write_mode
+    server = ServerProcess(kind, env)
+    try:
+        client = BenchClient(server.port)
+        cpu_before = server.cpu_seconds()
+        started = time.perf_counter()
+        size, extra = RUNNERS[workload](client, SERVERS[kind], args)
+        elapsed = time.perf_counter() - started
+        cpu_after = server.cpu_seconds()
+        peak_rss = server.peak_rss()
+    finally:
+        server.close()
+    cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    return {
+        'server': kind,
+        'workload': workload,
+        'write_mode': env.get('LOCALSEND_WRITE_MODE', 'fast'),
+        'bytes': size,
+        'seconds': round(elapsed, 3),
+        'mb_per_s': round(size / MB / elapsed, 2) if elapsed else None,
+        'requests': len(client.latencies),
+        'errors': client.errors,
+        'latency_ms': latency_summary(client.latencies),
+        'peak_rss_mb': round(peak_rss / MB, 1) if peak_rss is not None else None,
+        'cpu_seconds': round(cpu, 3) if cpu is not None else None,
+        'cpu_seconds_per_gb': round(cpu / (size / 1024 ** 3), 3) if cpu is not None and size else None,
+        **extra,
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def parse_env(value):
+    name, sep, text = value.partition('=')
+    if not sep or not name:
+        raise argparse.ArgumentTypeError('格式应为 NAME=VALUE')
+    return name, text
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='在回环地址上对 main.py 和 backend/main.py 的上传接口做基准测试，结果以 JSON 输出')
+    parser.add_argument('--server', choices=('main', 'backend', 'both'), default='both', help='测试哪个服务')
+    parser.add_argument('--workload', choices=WORKLOADS, action='append', help='要运行的负载（可重复，默认全部）')
+    parser.add_argument('--repeat', type=int, default=1, help='每个负载重复的次数')
+    parser.add_argument('--large-size', type=int, default=512, help='large：文件大小（MB）')
+    parser.add_argument('--form-size', type=int, default=128, help='form：文件大小（MB）')
+    parser.add_argument('--small-count', type=int, default=2000, help='small：文件数量')
+    parser.add_argument('--small-size', type=int, default=4, help='small：每个文件的大小（KB）')
+    parser.add_argument('--small-workers', type=int, default=4, help='small：并发连接数')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent/history：并发客户端数')
+    parser.add_argument('--client-size', type=int, default=64, help='concurrent/history：每个客户端上传的大小（MB）')
+    parser.add_argument('--poll-interval', type=float, default=0.05, help='history：两次轮询之间的间隔（秒）')
+    parser.add_argument('--env', type=parse_env, action='append', default=[], metavar='NAME=VALUE',
+                        help='传给服务进程的环境变量（可重复）')
+    parser.add_argument('--write-mode', choices=WRITE_MODES, action='append',
+                        help='服务的写入模式（可重复，每种模式各跑一遍所有负载以便对比，默认使用服务自身的设置）')
+    parser.add_argument('--output', help='把结果写入文件（默认输出到标准输出）')
+    args = parser.parse_args(argv)
+
+    servers = ('main', 'backend') if args.server == 'both' else (args.server,)
+    results = []
+    for kind in servers:
+        for workload in args.workload or WORKLOADS:
+            for write_mode in args.write_mode or (None,):
+                for _ in range(args.repeat):
+                    print(f'⏱️ {kind} / {workload}' + (f' / {write_mode}' if write_mode else '') + ' ...',
+                          file=sys.stderr, flush=True)
+                    result = run_workload(kind, workload, args, write_mode)
+                    print(f'   {result["mb_per_s"]} MB/s，p50 {result["latency_ms"]["p50"]} ms，'
+                          f'p99 {result["latency_ms"]["p99"]} ms，错误 {result["errors"]}', file=sys.stderr, flush=True)
+                    results.append(result)
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'options': {key: value for key, value in vars(args).items() if key != 'output'},
+        },
+        'results': results,
+    }
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 1 if any(result['errors'] for result in results) else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
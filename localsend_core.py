@@ -0,0 +1,1409 @@
+# main.py 和 backend/main.py 共用的部分：局域网发现、写盘与发布、归档解压、字节区间、压缩编码、
+# 带宽调度、指标与追踪，以及历史记录和内容索引的存储
+import os
+import sys
+import socket
+import asyncio
+import threading
+import contextvars
+import json
+import time
+import datetime
+import email.utils
+import re
+import hashlib
+import sqlite3
+import shutil
+import bisect
+import uuid
+import random
+import struct
+import tarfile
+import zlib
+try:
+    from compression import zstd  # Python 3.14+
+except ImportError:
+    zstd = None
+
+# 局域网发现：组播地址和端口（可用环境变量覆盖）、公告间隔（秒，实际在 ±50% 内随机抖动）、
+# 对端过期时间、看到新设备后提前公告的最小间隔，以及公告的最大长度
+DISCOVERY_GROUP = os.environ.get('LOCALSEND_DISCOVERY_GROUP', '224.0.0.167')
+DISCOVERY_PORT = int(os.environ.get('LOCALSEND_DISCOVERY_PORT', 53317))
+DISCOVERY_INTERVAL = 30
+PEER_TTL = 100
+DISCOVERY_REPLY_INTERVAL = 5
+MAX_ANNOUNCE_SIZE = 4096
+DISCOVERY_PROTOCOL = 'localsend-lite/1'
+
+# 未完成的上传（分块会话、暂存文件、解压中的归档）在保存目录中的临时文件前缀
+PARTIAL_FILE_PREFIX = '.localsend-'
+
+# 写入模式：fast 只做缓冲写入；safe 在发布前把文件和目录项 fsync 到磁盘；
+# bulk 在 safe 的基础上按已知大小预分配空间、用对齐的大块写入，并把写出的数据及时从页缓存中丢弃。
+# 两个服务启动时用 set_write_mode 设置
+WRITE_MODES = ('fast', 'safe', 'bulk')
+write_mode = 'fast'
+
+# bulk 模式每次写入的块大小（写入位置按它对齐），以及每写出多少字节落盘并丢弃一次页缓存
+BULK_WRITE_SIZE = 4 * 1024 * 1024
+BULK_RELEASE_SIZE = 64 * 1024 * 1024
+
+# 从文件中复制、校验数据时每次读取的块大小
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# 支持的内容校验算法
+HASH_ALGORITHMS = ('blake2b', 'sha256')
+
+# 支持的传输压缩编码（按优先级）；只压缩不在 COMPRESSED_EXTENSIONS 中、不小于 MIN_COMPRESS_SIZE 的文件
+CONTENT_ENCODINGS = ('zstd', 'gzip') if zstd else ('gzip',)
+GZIP_LEVEL = 1
+ZSTD_LEVEL = 3
+MIN_COMPRESS_SIZE = 1024
+COMPRESSED_EXTENSIONS = frozenset((
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.heif', '.avif',
+    '.mp4', '.mov', '.mkv', '.avi', '.webm', '.m4v', '.mp3', '.aac', '.m4a', '.ogg', '.opus', '.flac',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar', '.apk', '.jar',
+    '.docx', '.xlsx', '.pptx', '.pdf', '.woff', '.woff2',
+))
+
+# 上传带宽调度：速率单位为字节/秒，0 表示不限速；令牌桶容量相当于 BUCKET_BURST_SECONDS 秒的流量。
+# 限速时请求体按 BANDWIDTH_QUANTUM 分片读取，每片先向调度器申请令牌；
+# 不超过 SMALL_TRANSFER_SIZE 的传输按 SMALL_TRANSFER_WEIGHT 倍的权重分配带宽
+BUCKET_BURST_SECONDS = 0.25
+BANDWIDTH_QUANTUM = 64 * 1024
+SMALL_TRANSFER_SIZE = 16 * 1024 * 1024
+SMALL_TRANSFER_WEIGHT = 8
+MAX_SCHEDULER_ENTRIES = 1024
+SCHEDULER_MAX_WAIT = 1.0
+
+# 指标和追踪：直方图的桶（秒 / 字节）；设置 LOCALSEND_TRACE 时把每个上传请求的分阶段耗时
+# 作为一行 JSON 输出（值为 - 时输出到标准错误，否则追加到该文件）
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+STAGE_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+SIZE_BUCKETS = (4 * 1024, 64 * 1024, 1024 * 1024, 16 * 1024 * 1024, 128 * 1024 * 1024,
+                1024 * 1024 * 1024, 8 * 1024 * 1024 * 1024)
+TRACE_PATH = os.environ.get('LOCALSEND_TRACE')
+
+# 历史变更日志最多保留的条数，更早的 since 查询会要求客户端重新拉取
+MAX_CHANGE_LOG = 10000
+
+class PeerDiscovery:
+    """通过 UDP 组播发现局域网中的其他实例（main.py、backend/main.py 和 send.py 使用相同的协议）
+
+    每隔约 DISCOVERY_INTERVAL 秒（随机抖动，避免多台设备同步发送）在每个 IPv4 网卡上公告一次
+    本机的名称、端口和能力，其余时间只被动监听；看到新设备时提前公告一次（限速），让对方尽快发现本机；收到查询时直接单播回复。
+    收到的公告保存在对端表中，超过 PEER_TTL 秒没有再收到即过期；退出时发送 bye 让对端立即删除。
+    identity 提供本机名称和地址（get() 返回的字典）；interface 指定只在一个本机地址上收发，例如 127.0.0.1，便于在回环上测试。
+    """
+    def __init__(self, port, identity, server, capabilities, interface=None, group=DISCOVERY_GROUP,
+                 discovery_port=DISCOVERY_PORT):
+        self.instance_id = uuid.uuid4().hex
+        self.port = port
+        self.identity = identity
+        self.server = server
+        self.capabilities = list(capabilities)
+        self.interface = interface
+        self.group = group
+        self.discovery_port = discovery_port
+        self.peers = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.joined = set()
+        self.last_reply = 0.0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        try:
+            # 同一台机器上的多个实例共用发现端口
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, 'SO_REUSEPORT'):
+                self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            self.sock.bind(('', discovery_port))
+        except OSError:
+            self.sock.close()
+            raise
+        self.thread = threading.Thread(target=self.run, name='discovery', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def interfaces(self):
+        if self.interface:
+            return [self.interface]
+        return [address for address in self.identity.get()['addresses'] if ':' not in address]
+
+    def join(self):
+        """在新出现的网卡上加入组播组"""
+        group = socket.inet_aton(self.group)
+        for address in self.interfaces():
+            if address in self.joined:
+                continue
+            try:
+                self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                     struct.pack('4s4s', group, socket.inet_aton(address)))
+            except OSError:
+                continue
+            self.joined.add(address)
+
+    def message(self, bye=False):
+        identity = self.identity.get()
+        message = {
+            'protocol': DISCOVERY_PROTOCOL,
+            'id': self.instance_id,
+            'name': identity.get('name') or identity.get('hostname'),
+            'port': self.port,
+            'addresses': [address for address in identity['addresses'] if ':' not in address],
+            'server': self.server,
+            'capabilities': self.capabilities,
+            'encodings': list(CONTENT_ENCODINGS),
+        }
+        if bye:
+            message['bye'] = True
+        return message
+
+    def announce(self, bye=False):
+        """在每个网卡上发送一次公告"""
+        payload = json.dumps(self.message(bye), ensure_ascii=False).encode('utf-8')
+        for address in self.interfaces():
+            try:
+                self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(address))
+                self.sock.sendto(payload, (self.group, self.discovery_port))
+            except OSError:
+                pass
+
+    def reply(self, sender):
+        """单播回复一次公告"""
+        try:
+            self.sock.sendto(json.dumps(self.message(), ensure_ascii=False).encode('utf-8'), sender)
+        except OSError:
+            pass
+
+    def handle(self, data, sender):
+        """处理收到的公告，返回是否是新出现的设备"""
+        try:
+            message = json.loads(data)
+        except ValueError:
+            return False
+        if (not isinstance(message, dict) or message.get('protocol') != DISCOVERY_PROTOCOL
+                or not isinstance(message.get('id'), str) or message['id'] == self.instance_id):
+            return False
+        peer_id = message['id']
+        if message.get('query'):
+            # 只发现不接收的客户端（如 send.py）的查询：直接单播回复到查询的来源端口，不加入对端表
+            self.reply(sender)
+            return False
+        if message.get('bye'):
+            with self.lock:
+                self.peers.pop(peer_id, None)
+            return False
+        port = message.get('port')
+        if not isinstance(port, int) or not 0 < port < 65536:
+            return False
+        as_list = lambda value: [str(item) for item in value][:32] if isinstance(value, list) else []
+        peer = {
+            'id': peer_id,
+            'name': str(message.get('name') or sender[0])[:255],
+            'ip': sender[0],
+            'port': port,
+            'url': f'http://{sender[0]}:{port}',
+            'addresses': as_list(message.get('addresses')),
+            'server': str(message.get('server') or ''),
+            'capabilities': as_list(message.get('capabilities')),
+            'encodings': as_list(message.get('encodings')),
+            'last_seen': time.time(),
+        }
+        with self.lock:
+            is_new = peer_id not in self.peers
+            self.peers[peer_id] = peer
+        return is_new
+
+    def expire(self):
+        deadline = time.time() - PEER_TTL
+        with self.lock:
+            for peer_id in [peer_id for peer_id, peer in self.peers.items() if peer['last_seen'] < deadline]:
+                del self.peers[peer_id]
+
+    def snapshot(self):
+        """当前的对端表（按名称排序）"""
+        self.expire()
+        with self.lock:
+            peers = sorted(self.peers.values(), key=lambda peer: (peer['name'], peer['ip']))
+        return [dict(peer, last_seen=datetime.datetime.fromtimestamp(peer['last_seen']).isoformat()) for peer in peers]
+
+    def run(self):
+        # 立即加入组播组以便响应查询，启动后很快公告一次，之后按抖动的间隔公告
+        self.join()
+        next_announce = time.monotonic() + random.uniform(0, 1)
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            if now >= next_announce:
+                self.join()
+                self.announce()
+                self.expire()
+                next_announce = now + DISCOVERY_INTERVAL * random.uniform(0.5, 1.5)
+            # 最多阻塞 1 秒，以便及时响应 close
+            self.sock.settimeout(max(0.01, min(next_announce - now, 1.0)))
+            try:
+                data, sender = self.sock.recvfrom(MAX_ANNOUNCE_SIZE)
+            except socket.timeout:
+                continue
+            except OSError:
+                if self.stop_event.is_set():
+                    break
+                continue
+            if self.handle(data, sender) and now - self.last_reply >= DISCOVERY_REPLY_INTERVAL:
+                # 新设备：稍后提前公告一次，随机延迟避免多台设备同时回应
+                self.last_reply = now
+                next_announce = min(next_announce, now + random.uniform(0.1, 1.0))
+
+    def close(self):
+        """发送 bye 并停止"""
+        if self.stop_event.is_set():
+            return
+        self.stop_event.set()
+        self.announce(bye=True)
+        self.thread.join(timeout=2)
+        self.sock.close()
+
+# 解析客户端提供的摘要
+def parse_digest(value):
+    """解析 "算法:十六进制摘要"（省略算法时使用 blake2b），返回 (算法, 摘要)，格式错误时抛出 ValueError"""
+    algorithm, sep, hexdigest = str(value).strip().partition(':')
+    if not sep:
+        algorithm, hexdigest = 'blake2b', algorithm
+    algorithm = algorithm.lower()
+    if algorithm not in HASH_ALGORITHMS or not re.fullmatch(r'[0-9a-fA-F]+', hexdigest):
+        raise ValueError(f'无效的摘要: {value}')
+    return algorithm, hexdigest.lower()
+
+# 格式化摘要
+def format_digest(hasher):
+    return f'{hasher.name}:{hasher.hexdigest()}' if hasher else None
+
+def set_write_mode(mode):
+    """设置写入模式（fast/safe/bulk），无效时抛出 ValueError"""
+    global write_mode
+    if mode not in WRITE_MODES:
+        raise ValueError(f"无效的写入模式: {mode}，应为 {'/'.join(WRITE_MODES)} 之一")
+    write_mode = mode
+
+# 尽量让文件系统一次分配好 size 字节的连续空间
+def allocate_space(fd, size):
+    """成功返回 True；不支持预分配的平台或文件系统返回 False"""
+    if size <= 0 or not hasattr(os, 'posix_fallocate'):
+        return False
+    try:
+        os.posix_fallocate(fd, 0, size)
+        return True
+    except OSError:
+        return False
+
+def sync_file(fd):
+    """safe/bulk 模式下把文件数据 fsync 到磁盘"""
+    if write_mode == 'fast':
+        return
+    t = time.perf_counter()
+    os.fsync(fd)
+    current_trace().add('fsync', t)
+
+def sync_path(path):
+    """safe/bulk 模式下 fsync 已写好的文件（如分块上传会话的临时文件）"""
+    if write_mode == 'fast':
+        return
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        sync_file(fd)
+    finally:
+        os.close(fd)
+
+def sync_directory(path):
+    """safe/bulk 模式下 fsync 目录，让新建、改名的目录项落盘；不支持的平台或文件系统上忽略"""
+    if write_mode == 'fast' or os.name == 'nt':
+        return
+    t = time.perf_counter()
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+    current_trace().add('fsync', t)
+
+def drop_cache(fd, offset, length):
+    """提示内核丢弃 [offset, offset + length) 的页缓存（length 为 0 表示到文件末尾），只对已落盘的数据有效"""
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+
+def release_cache(fd, offset, length):
+    """把 [offset, offset + length) 落盘后从页缓存中丢弃"""
+    getattr(os, 'fdatasync', os.fsync)(fd)
+    drop_cache(fd, offset, length)
+
+def release_written(fd, offset, length):
+    """bulk 模式下把分块会话刚写入的区间落盘并丢弃页缓存，其他模式不做任何事"""
+    if write_mode != 'bulk':
+        return
+    t = time.perf_counter()
+    release_cache(fd, offset, length)
+    current_trace().add('fsync', t)
+
+class OutputFile:
+    """按写入模式写入一个新文件：数据写完后调用 finish，再关闭
+
+    bulk 模式按声明的大小预分配，数据攒成 BULK_WRITE_SIZE 的整数倍再写出，写入位置始终对齐；
+    每写出 BULK_RELEASE_SIZE 就落盘并丢弃页缓存（这部分耗时计入写入），大文件不会挤掉其他缓存
+    """
+    def __init__(self, path, size=None, mode='xb'):
+        self.bulk = write_mode == 'bulk'
+        self.file = open(path, mode, buffering=0 if self.bulk else -1)
+        self.size = size
+        self.written = 0
+        self.released = 0
+        self.buffer = bytearray()
+        if self.bulk and size:
+            allocate_space(self.file.fileno(), size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def write(self, data):
+        if not self.bulk:
+            self.file.write(data)
+            return
+        self.buffer += data
+        if len(self.buffer) >= BULK_WRITE_SIZE:
+            self.write_buffer(len(self.buffer) - len(self.buffer) % BULK_WRITE_SIZE)
+            if self.written - self.released >= BULK_RELEASE_SIZE:
+                release_cache(self.file.fileno(), self.released, self.written - self.released)
+                self.released = self.written
+
+    def write_buffer(self, length):
+        """写出缓冲区开头的 length 字节（无缓冲的文件可能只写入一部分，需要循环）"""
+        with memoryview(self.buffer) as view:
+            offset = 0
+            while offset < length:
+                offset += self.file.write(view[offset:length])
+        del self.buffer[:length]
+        self.written += length
+
+    def finish(self):
+        """写出剩余数据，去掉多预分配的空间，safe/bulk 模式下落盘"""
+        if self.bulk:
+            self.write_buffer(len(self.buffer))
+            if self.size and self.written < self.size:
+                self.file.truncate(self.written)
+        else:
+            self.file.flush()
+        sync_file(self.file.fileno())
+        if self.bulk:
+            drop_cache(self.file.fileno(), self.released, 0)
+
+    def close(self):
+        self.file.close()
+
+# 为文件预分配空间
+def preallocate_file(path, size):
+    """创建长度为 size 的文件，尽量让文件系统一次分配好连续空间"""
+    with open(path, 'wb') as f:
+        # 部分文件系统不支持预分配，退回到稀疏文件
+        if not allocate_space(f.fileno(), size):
+            f.truncate(size)
+
+def staging_path(directory, name=None):
+    """保存目录中隐藏的临时文件路径，写完后再用 commit_file 发布；异常退出后遗留的会被定期清理"""
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f'{PARTIAL_FILE_PREFIX}{name or uuid.uuid4().hex}.part')
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def remove_stale_parts(directory, active, max_age):
+    """删除目录中不在 active 里、max_age 秒内没有修改过的临时文件（解压归档用的是临时目录）"""
+    now = time.time()
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return
+    for entry in entries:
+        if entry.name.startswith(PARTIAL_FILE_PREFIX) and entry.name.endswith('.part') and entry.path not in active:
+            try:
+                if now - entry.stat(follow_symlinks=False).st_mtime > max_age:
+                    if entry.is_dir(follow_symlinks=False):
+                        shutil.rmtree(entry.path)
+                    else:
+                        os.remove(entry.path)
+            except OSError:
+                pass
+
+# 重名时依次尝试的保存文件名
+def numbered_names(filename, split_ext=True):
+    """原名、name(1)ext、name(2)ext...（main.py 的命名方式；文件夹名不拆分扩展名）"""
+    yield filename
+    name, ext = os.path.splitext(filename) if split_ext else (filename, '')
+    counter = 1
+    while True:
+        yield f'{name}({counter}){ext}'
+        counter += 1
+
+def timestamped_names(filename, split_ext=True):
+    """原名、原名_时间戳、原名_时间戳_1...（backend 的命名方式；文件夹名不拆分扩展名）"""
+    yield filename
+    name, ext = os.path.splitext(filename) if split_ext else (filename, '')
+    timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+    yield f'{name}_{timestamp}{ext}'
+    counter = 1
+    while True:
+        yield f'{name}_{timestamp}_{counter}{ext}'
+        counter += 1
+
+# 原子地把临时文件发布为不重名的最终文件
+def commit_file(directory, filename, temp_path, names=numbered_names):
+    """按 names(filename) 给出的顺序尝试文件名，返回最终路径
+
+    用硬链接占用名字：目标已存在时 link 直接失败，不会覆盖其他并发上传的文件，
+    也不会让未写完的文件以最终名字出现。文件系统不支持硬链接时，先用 O_EXCL 创建占位文件再替换。
+    """
+    started = time.perf_counter()
+    for candidate in names(filename):
+        target_path = os.path.join(directory, candidate)
+        try:
+            os.link(temp_path, target_path)
+        except FileExistsError:
+            continue
+        except OSError:
+            try:
+                os.close(os.open(target_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            except FileExistsError:
+                continue
+            os.replace(temp_path, target_path)
+            break
+        os.remove(temp_path)
+        break
+    current_trace().add('resolve_name', started)
+    sync_directory(directory)
+    return target_path
+
+# 原子地把解压好的临时目录发布为不重名的文件夹
+def commit_directory(directory, name, temp_path, names=numbered_names):
+    """按 names(name) 给出的顺序尝试文件夹名，返回最终路径
+
+    先用 mkdir 占用名字，再用 rename 替换占位的空目录（POSIX 上是原子的）；
+    Windows 不能替换已存在的目录，先删除占位目录再改名。
+    """
+    started = time.perf_counter()
+    for candidate in names(name, split_ext=False):
+        target_path = os.path.join(directory, candidate)
+        try:
+            os.mkdir(target_path)
+        except FileExistsError:
+            continue
+        try:
+            os.replace(temp_path, target_path)
+        except OSError:
+            os.rmdir(target_path)
+            os.rename(temp_path, target_path)
+        current_trace().add('resolve_name', started)
+        sync_directory(directory)
+        return target_path
+
+class ArchiveError(ValueError):
+    """tar 归档格式错误或包含不安全的路径"""
+
+def archive_member_path(root, name):
+    """把归档成员名映射为 root 下的路径；绝对路径、盘符或 .. 视为不安全，只有 ./ 之类的空路径返回 None"""
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if (name.startswith(('/', '\\')) or '..' in parts
+            or any(os.path.isabs(part) or os.path.splitdrive(part)[0] for part in parts)):
+        raise ArchiveError(f'归档包含不安全的路径: {name}')
+    if not parts:
+        return None
+    path = os.path.join(root, *parts)
+    if os.path.commonpath([root, os.path.normpath(path)]) != root:
+        raise ArchiveError(f'归档包含不安全的路径: {name}')
+    return path
+
+# 边接收边解压 tar 归档
+def extract_archive(fp, directory, folder_name, on_progress=None, names=numbered_names):
+    """从 fp 中流式读取 tar（可以是 gzip/bz2/xz 压缩的），解压为 directory 下名为 folder_name 的文件夹
+
+    按顺序逐个处理成员，不回溯也不保留成员列表，内存占用与归档大小无关。只解压普通文件和目录，
+    跳过符号链接、硬链接和设备文件；任何成员路径不安全时整个归档失败。先解压到隐藏的临时目录，
+    全部完成后再用 commit_directory 发布，失败时删除临时目录。返回 (最终路径, 文件数, 总字节数, 跳过的成员数)
+    """
+    temp_path = staging_path(directory)
+    os.mkdir(temp_path)
+    files = size = skipped = 0
+    trace = current_trace()
+    try:
+        try:
+            t = time.perf_counter()
+            with tarfile.open(fileobj=fp, mode='r|*') as tar:
+                while True:
+                    member = tar.next()
+                    t = trace.add('parse', t)
+                    if member is None:
+                        # 正常结束时刚读过全零的结束块；数据在成员头处截断时 next() 同样返回 None
+                        if tar.fileobj.tell() != tar.offset + tarfile.BLOCKSIZE:
+                            raise ArchiveError('归档不完整')
+                        break
+                    # 流式模式下 TarFile 会把每个成员追加到 members，成员很多时不断占用内存
+                    tar.members.clear()
+                    path = archive_member_path(temp_path, member.name)
+                    if path is None:
+                        continue
+                    if member.isdir():
+                        os.makedirs(path, exist_ok=True)
+                    elif member.isfile():
+                        os.makedirs(os.path.dirname(path), exist_ok=True)
+                        source = tar.extractfile(member)
+                        with OutputFile(path, member.size, 'wb') as f:
+                            while True:
+                                t = time.perf_counter()
+                                data = source.read(COPY_CHUNK_SIZE)
+                                t = trace.add('parse', t)
+                                if not data:
+                                    break
+                                f.write(data)
+                                trace.add('write', t)
+                                if on_progress:
+                                    on_progress()
+                            f.finish()
+                        try:
+                            os.utime(path, (member.mtime, member.mtime))
+                        except (OSError, OverflowError, ValueError):
+                            pass
+                        files += 1
+                        size += member.size
+                        record_received_file(member.size)
+                    else:
+                        skipped += 1
+                    t = time.perf_counter()
+        except (tarfile.TarError, EOFError) as e:
+            raise ArchiveError(f'归档格式错误: {e}')
+        if write_mode != 'fast':
+            for root, _, _ in os.walk(temp_path):
+                sync_directory(root)
+        return commit_directory(directory, folder_name, temp_path, names), files, size, skipped
+    except BaseException:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+
+# 字节区间集合：ranges 是按起点排序、互不重叠也不相邻的 [start, end) 列表
+def add_range(ranges, start, end):
+    """把 [start, end) 并入区间集合"""
+    if start >= end:
+        return
+    i = bisect.bisect_left(ranges, [start])
+    if i > 0 and ranges[i - 1][1] >= start:
+        i -= 1
+    j = i
+    while j < len(ranges) and ranges[j][0] <= end:
+        start = min(start, ranges[j][0])
+        end = max(end, ranges[j][1])
+        j += 1
+    ranges[i:j] = [[start, end]]
+
+def remove_range(ranges, start, end):
+    """从区间集合中去掉 [start, end)"""
+    if start >= end:
+        return
+    i = bisect.bisect_left(ranges, [start])
+    if i > 0 and ranges[i - 1][1] > start:
+        i -= 1
+    j = i
+    pieces = []
+    while j < len(ranges) and ranges[j][0] < end:
+        if ranges[j][0] < start:
+            pieces.append([ranges[j][0], start])
+        if ranges[j][1] > end:
+            pieces.append([end, ranges[j][1]])
+        j += 1
+    ranges[i:j] = pieces
+
+def covered_end(ranges, position):
+    """返回从 position 开始连续已覆盖区间的末尾，position 未被覆盖时返回 position"""
+    i = bisect.bisect_right(ranges, [position, float('inf')]) - 1
+    if i >= 0 and ranges[i][0] <= position < ranges[i][1]:
+        return ranges[i][1]
+    return position
+
+def range_covered(ranges, start, end):
+    """[start, end) 是否完全包含在区间集合中"""
+    if start >= end:
+        return True
+    i = bisect.bisect_right(ranges, [start, float('inf')]) - 1
+    return i >= 0 and ranges[i][0] <= start and ranges[i][1] >= end
+
+# 解析 Content-Range 请求头
+def parse_content_range(value):
+    """解析 "bytes start-end/total"，返回 (start, end, total)，end 不包含在内，total 可能为 None"""
+    match = re.fullmatch(r'bytes\s+(\d+)-(\d+)/(\d+|\*)', (value or '').strip())
+    if not match:
+        return None
+    start, last, total = match.groups()
+    start, end = int(start), int(last) + 1
+    if end <= start:
+        return None
+    return start, end, None if total == '*' else int(total)
+
+# 解析 Range 请求头
+def parse_range_header(value, size):
+    """解析单个 "bytes=start-end" 区间，返回 (start, end)，end 不包含在内
+
+    没有 Range 或包含多个区间时返回 None（发送完整文件），区间无法满足时抛出 ValueError
+    """
+    if not value or not value.startswith('bytes=') or ',' in value:
+        return None
+    first, _, last = value[len('bytes='):].strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = int(last) + 1 if last else size
+        else:
+            # bytes=-N 表示最后 N 个字节
+            start = max(0, size - int(last))
+            end = size
+    except ValueError:
+        return None
+    end = min(end, size)
+    if start >= end:
+        raise ValueError('无法满足的区间')
+    return start, end
+
+def file_etag(st):
+    """由修改时间和大小生成的文件 ETag（强校验），断点续传时用 If-Range 确认文件没有变化"""
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+def format_http_date(timestamp):
+    return email.utils.formatdate(timestamp, usegmt=True)
+
+def if_range_matches(value, etag, mtime):
+    """没有 If-Range，或它与文件当前的 ETag / Last-Modified（精确到秒）一致时返回 True，否则应忽略 Range"""
+    if not value:
+        return True
+    value = value.strip()
+    if value.startswith('"'):
+        return value == etag
+    try:
+        return email.utils.parsedate_to_datetime(value).timestamp() == int(mtime)
+    except (TypeError, ValueError):
+        # 弱 ETag 或无法解析的日期都不能用于 If-Range
+        return False
+
+def parse_etags(value):
+    """解析 If-None-Match 头，返回其中的 ETag 列表（忽略弱校验前缀 W/）"""
+    if not value:
+        return []
+    return [tag.strip().removeprefix('W/') for tag in value.split(',')]
+
+def new_decoder(encoding):
+    """返回解压 Content-Encoding 的对象（有 decompress 方法），不支持的编码返回 None"""
+    if encoding == 'gzip':
+        return zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    if encoding == 'zstd' and zstd:
+        return zstd.ZstdDecompressor()
+    return None
+
+def iter_decompressed(decoder, data, max_length):
+    """逐块解压 data，每块最多 max_length 字节，一小段高压缩比的数据不会一次膨胀出大块内存
+
+    zlib 把这次没处理的输入放在 unconsumed_tail 中，需要再传回去；zstd 自己保留未处理的输入，
+    输出填满时用空输入继续取。解压到流结束（decoder.eof）后不再处理剩余数据
+    """
+    while True:
+        out = decoder.decompress(data, max_length)
+        data = getattr(decoder, 'unconsumed_tail', b'')
+        if out:
+            yield out
+        if decoder.eof or (not data and len(out) < max_length):
+            return
+
+def new_encoder(encoding):
+    """返回按 encoding 压缩的对象（有 compress/flush 方法）"""
+    if encoding == 'zstd':
+        return zstd.ZstdCompressor(level=ZSTD_LEVEL)
+    return zlib.compressobj(GZIP_LEVEL, wbits=16 + zlib.MAX_WBITS)
+
+def is_compressible(filename):
+    return os.path.splitext(filename)[1].lower() not in COMPRESSED_EXTENSIONS
+
+def choose_encoding(accept_encoding):
+    """按服务器的优先级选择客户端接受的压缩编码，都不接受时返回 None"""
+    for encoding in CONTENT_ENCODINGS:
+        if accepts_encoding(accept_encoding, encoding):
+            return encoding
+    return None
+
+def accepts_encoding(value, encoding):
+    """Accept-Encoding 头是否接受指定的编码（q=0 表示拒绝）"""
+    for item in (value or '').split(','):
+        name, _, params = item.strip().partition(';')
+        if name.strip().lower() in (encoding, '*'):
+            return params.strip() not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+    return False
+
+def parse_rate(value):
+    """解析速率：字节/秒，可带 K/M/G 后缀（按 1024 计，如 10M）；None、空串和 0 表示不限速"""
+    if value is None or value == '':
+        return 0
+    if isinstance(value, bool):
+        raise ValueError(f'无效的速率: {value}')
+    if isinstance(value, (int, float)):
+        rate = value
+    else:
+        match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?(?:/s)?\s*', str(value), re.I)
+        if not match:
+            raise ValueError(f'无效的速率: {value}')
+        rate = float(match.group(1)) * 1024 ** ' kmg'.index(match.group(2).lower() or ' ')
+    if rate < 0:
+        raise ValueError(f'无效的速率: {value}')
+    return int(rate)
+
+def format_rate(rate):
+    if not rate:
+        return '不限'
+    for unit in ('B', 'KB', 'MB'):
+        if rate < 1024:
+            return f'{rate:.0f} {unit}/s'
+        rate /= 1024
+    return f'{rate:.1f} GB/s'
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌（字节），最多积累 BUCKET_BURST_SECONDS 秒
+
+    取令牌时允许透支，令牌为负时需要等待补回，因此任意大小的读取都能按平均速率放行
+    """
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = self.capacity()
+        self.updated = time.monotonic()
+
+    def capacity(self):
+        return max(self.rate * BUCKET_BURST_SECONDS, BANDWIDTH_QUANTUM)
+
+    def refill(self, now):
+        if self.rate:
+            self.tokens = min(self.capacity(), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """还需要等待多少秒才能取令牌，0 表示现在就可以"""
+        self.refill(now)
+        if not self.rate or self.tokens > 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def take(self, size):
+        if self.rate:
+            self.tokens -= size
+
+    def full(self, now):
+        self.refill(now)
+        return self.tokens >= self.capacity()
+
+    def set_rate(self, rate):
+        self.refill(time.monotonic())
+        self.rate = rate
+        self.tokens = min(self.tokens, self.capacity()) if rate else self.capacity()
+
+class TransferFlow:
+    """调度器中的一个传输（一个请求，或同一个上传会话的所有分块）"""
+    def __init__(self, scheduler, key, client_ip, size):
+        self.scheduler = scheduler
+        self.key = key
+        self.client_ip = client_ip
+        self.weight = SMALL_TRANSFER_WEIGHT if 0 <= size <= SMALL_TRANSFER_SIZE else 1
+        self.finish_tag = 0.0
+
+    def acquire(self, size):
+        """申请 size 字节（AsyncTransferScheduler 的传输需要 await 返回值）"""
+        return self.scheduler.acquire(self, size)
+
+class FairScheduler:
+    """上传带宽调度的排队和限速状态：全局和按客户端 IP 的令牌桶，并发的传输之间公平排队，小文件优先
+
+    排队采用起始时间公平排队（SFQ）：每次申请的标签为 max(虚拟时间, 该传输上一次的结束标签)，
+    结束标签再加上 字节数/权重，标签最小的先放行。于是每个传输按权重分得带宽，
+    小文件的权重更高，在大文件传输的间隙中很快完成，但大文件也不会被饿死。
+    同一个上传会话的并行分块属于同一个传输，多开连接不会多占带宽。没有任何限速时不排队。
+    本身不加锁，由 TransferScheduler（线程）和 AsyncTransferScheduler（事件循环）在各自的条件变量下调用
+    """
+    def __init__(self, rate=0, client_rate=0):
+        self.global_bucket = TokenBucket(rate)
+        self.client_rate = client_rate
+        self.client_rates = {}
+        self.client_buckets = {}
+        self.flows = {}
+        self.waiters = []
+        self.virtual_time = 0.0
+        self.sequence = 0
+
+    def limited(self):
+        return bool(self.global_bucket.rate or self.client_rate or self.client_rates)
+
+    def get_flow(self, key, client_ip, size):
+        """取得传输 key 对应的调度对象，同一个 key 共用排队标签"""
+        flow = self.flows.get(key)
+        if flow is None:
+            if len(self.flows) >= MAX_SCHEDULER_ENTRIES:
+                # 丢弃已经不再排在前面的传输
+                self.flows = {k: f for k, f in self.flows.items() if f.finish_tag > self.virtual_time}
+            flow = self.flows[key] = TransferFlow(self, key, client_ip, size)
+        return flow
+
+    def client_bucket(self, client_ip):
+        """客户端的令牌桶，不限速时返回 None"""
+        rate = self.client_rates.get(client_ip, self.client_rate)
+        if not rate:
+            return None
+        bucket = self.client_buckets.get(client_ip)
+        if bucket is None:
+            if len(self.client_buckets) >= MAX_SCHEDULER_ENTRIES:
+                now = time.monotonic()
+                self.client_buckets = {ip: b for ip, b in self.client_buckets.items() if not b.full(now)}
+            bucket = self.client_buckets[client_ip] = TokenBucket(rate)
+        elif bucket.rate != rate:
+            bucket.set_rate(rate)
+        return bucket
+
+    def enqueue(self, flow, size):
+        """为一次申请分配排队标签，返回等待项"""
+        start = max(self.virtual_time, flow.finish_tag)
+        flow.finish_tag = start + size / flow.weight
+        self.sequence += 1
+        waiter = (start, self.sequence, flow, size)
+        self.waiters.append(waiter)
+        return waiter
+
+    def wait_time(self, waiter, now):
+        """waiter 还需要等待的秒数，0 表示可以放行；排在别的传输之后时返回 SCHEDULER_MAX_WAIT（放行时会被唤醒）"""
+        flow = waiter[2]
+        bucket = self.client_bucket(flow.client_ip)
+        delay = bucket.delay(now) if bucket else 0.0
+        if delay:
+            return delay
+        ready = [w for w in self.waiters
+                 if not (b := self.client_bucket(w[2].client_ip)) or not b.delay(now)]
+        if bucket and min(w for w in ready if w[2].client_ip == flow.client_ip) is not waiter:
+            return SCHEDULER_MAX_WAIT
+        if self.global_bucket.rate:
+            if min(ready) is not waiter:
+                return SCHEDULER_MAX_WAIT
+            return self.global_bucket.delay(now)
+        return 0.0
+
+    def grant(self, waiter):
+        """放行 waiter：从令牌桶中扣除它的字节数并推进虚拟时间"""
+        start, _, flow, size = waiter
+        self.global_bucket.take(size)
+        bucket = self.client_bucket(flow.client_ip)
+        if bucket:
+            bucket.take(size)
+        self.virtual_time = max(self.virtual_time, start)
+
+    def snapshot(self):
+        return {
+            'rate': self.global_bucket.rate,
+            'client_rate': self.client_rate,
+            'clients': dict(self.client_rates),
+            'waiting': len(self.waiters),
+        }
+
+    def update(self, rate=None, client_rate=None, clients=None):
+        """调整限速；clients 为 {IP: 速率}，速率为 None 时删除该客户端的单独设置"""
+        if rate is not None:
+            self.global_bucket.set_rate(rate)
+        if client_rate is not None:
+            self.client_rate = client_rate
+        for client_ip, limit in (clients or {}).items():
+            if limit is None:
+                self.client_rates.pop(client_ip, None)
+            else:
+                self.client_rates[client_ip] = limit
+
+class TransferScheduler(FairScheduler):
+    """在线程中使用的带宽调度器（main.py）：acquire 阻塞当前线程直到轮到为止"""
+    def __init__(self, rate=0, client_rate=0):
+        super().__init__(rate, client_rate)
+        self.cond = threading.Condition()
+
+    def flow(self, key, client_ip, size):
+        with self.cond:
+            return self.get_flow(key, client_ip, size)
+
+    def acquire(self, flow, size):
+        """申请发送 size 字节，必要时阻塞到按限速和排队顺序轮到为止"""
+        with self.cond:
+            if not self.limited():
+                return
+            waiter = self.enqueue(flow, size)
+            try:
+                while self.limited():
+                    delay = self.wait_time(waiter, time.monotonic())
+                    if not delay:
+                        break
+                    self.cond.wait(min(delay, SCHEDULER_MAX_WAIT))
+                else:
+                    return
+                self.grant(waiter)
+            finally:
+                self.waiters.remove(waiter)
+                self.cond.notify_all()
+
+    def limits(self):
+        with self.cond:
+            return self.snapshot()
+
+    def configure(self, rate=None, client_rate=None, clients=None):
+        """调整限速（见 FairScheduler.update），唤醒等待中的传输按新的限速重新计算"""
+        with self.cond:
+            self.update(rate, client_rate, clients)
+            self.cond.notify_all()
+
+class AsyncTransferScheduler(FairScheduler):
+    """在事件循环中使用的带宽调度器（backend）：所有方法都在事件循环中调用，acquire 和 configure 是协程"""
+    def __init__(self, rate=0, client_rate=0):
+        super().__init__(rate, client_rate)
+        self.cond = asyncio.Condition()
+
+    def flow(self, key, client_ip, size):
+        return self.get_flow(key, client_ip, size)
+
+    async def acquire(self, flow, size):
+        """申请接收 size 字节，必要时等待到按限速和排队顺序轮到为止"""
+        if not self.limited():
+            return
+        async with self.cond:
+            waiter = self.enqueue(flow, size)
+            try:
+                while self.limited():
+                    delay = self.wait_time(waiter, time.monotonic())
+                    if not delay:
+                        break
+                    try:
+                        await asyncio.wait_for(self.cond.wait(), min(delay, SCHEDULER_MAX_WAIT))
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    return
+                self.grant(waiter)
+            finally:
+                self.waiters.remove(waiter)
+                self.cond.notify_all()
+
+    def limits(self):
+        return self.snapshot()
+
+    async def configure(self, rate=None, client_rate=None, clients=None):
+        """调整限速（见 FairScheduler.update），唤醒等待中的传输按新的限速重新计算"""
+        async with self.cond:
+            self.update(rate, client_rate, clients)
+            self.cond.notify_all()
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class MetricsRegistry:
+    """进程内的指标，按 Prometheus 文本格式输出
+
+    更新在一把锁下完成；上传的热路径只在 RequestTrace 中累加耗时，每个请求结束时才更新一次指标
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.families = {}
+        self.samples = {}
+
+    def define(self, name, kind, help_text, buckets=None, collect=None):
+        """定义指标；collect 为输出时才计算当前值的函数（用于 gauge）"""
+        self.families[name] = (kind, help_text, buckets, collect)
+        self.samples[name] = {}
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            samples = self.samples[name]
+            samples[key] = samples.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            histogram = self.samples[name].get(key)
+            if histogram is None:
+                histogram = self.samples[name][key] = Histogram(self.families[name][2])
+            histogram.observe(value)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (kind, help_text, buckets, collect) in self.families.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                samples = {(): collect()} if collect else self.samples[name]
+                for key, value in samples.items():
+                    if kind != 'histogram':
+                        lines.append(f'{name}{format_labels(key)} {format_metric_value(value)}')
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets + (float('inf'),), value.counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else format_metric_value(bound)
+                        lines.append(f'{name}_bucket{format_labels(key + (("le", le),))} {cumulative}')
+                    lines.append(f'{name}_sum{format_labels(key)} {format_metric_value(value.sum)}')
+                    lines.append(f'{name}_count{format_labels(key)} {value.count}')
+        return '\n'.join(lines) + '\n'
+
+def format_labels(key):
+    if not key:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in key) + '}'
+
+def format_metric_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# 两个服务共有的指标；各自的服务再定义依赖自身状态的 gauge（如进行中的上传会话数）
+metrics = MetricsRegistry()
+metrics.define('localsend_http_requests_total', 'counter', '处理的 HTTP 请求数')
+metrics.define('localsend_http_request_duration_seconds', 'histogram', 'HTTP 请求的处理时间', REQUEST_BUCKETS)
+metrics.define('localsend_upload_errors_total', 'counter', '失败的上传请求数（状态码 >= 400，0 表示没有发出响应）')
+metrics.define('localsend_received_bytes_total', 'counter', '从上传请求体中读取的字节数（压缩时为压缩后的字节数）')
+metrics.define('localsend_files_received_total', 'counter', '成功保存的文件数')
+metrics.define('localsend_upload_size_bytes', 'histogram', '成功保存的文件大小', SIZE_BUCKETS)
+metrics.define('localsend_active_transfers', 'gauge', '正在接收请求体的上传请求数')
+metrics.define('localsend_stage_seconds', 'histogram',
+               '每个上传请求在各阶段的累计耗时：parse 读取并解析请求体，write 写盘，hash 计算摘要，'
+               'fsync 刷盘，resolve_name 占用最终文件名', STAGE_BUCKETS)
+for name in ('localsend_received_bytes_total', 'localsend_files_received_total', 'localsend_active_transfers'):
+    metrics.inc(name, 0)
+
+def record_received_file(size):
+    metrics.inc('localsend_files_received_total')
+    metrics.observe('localsend_upload_size_bytes', size)
+
+class RequestTrace:
+    """一个请求的分阶段计时
+
+    热路径上的用法是 t = trace.add('write', t)：累加从 t 到现在的耗时并返回现在的时间，
+    不加锁、不分配对象。请求结束时 finish 把各阶段的累计耗时记入指标；设置了 LOCALSEND_TRACE 时
+    再输出一行 JSON，每个阶段是一个 span（start_ms 为第一次进入该阶段的时间）
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+
+    def add(self, stage, started):
+        now = time.perf_counter()
+        entry = self.stages.get(stage)
+        if entry is None:
+            self.stages[stage] = [started - self.started, now - started, 1]
+        else:
+            entry[1] += now - started
+            entry[2] += 1
+        return now
+
+    def total(self, *stages):
+        """几个阶段的累计耗时之和"""
+        return sum(self.stages[stage][1] for stage in stages if stage in self.stages)
+
+    def finish(self, name, status, client_ip):
+        # IO 线程中可能还有未结束的写入在添加阶段，先复制一份
+        stages = list(self.stages.items())
+        for stage, (_, elapsed, _) in stages:
+            metrics.observe('localsend_stage_seconds', elapsed, stage=stage)
+        if TRACE_PATH and stages:
+            write_trace({
+                'trace_id': uuid.uuid4().hex,
+                'name': name,
+                'client': client_ip,
+                'status': status,
+                'start': time.time() - (time.perf_counter() - self.started),
+                'duration_ms': round((time.perf_counter() - self.started) * 1000, 3),
+                'spans': [{'name': stage, 'start_ms': round(offset * 1000, 3), 'duration_ms': round(elapsed * 1000, 3),
+                           'count': count} for stage, (offset, elapsed, count) in stages],
+            })
+
+class NullTrace(RequestTrace):
+    """不在请求中时（如后台清理）使用的空计时"""
+    def add(self, stage, started):
+        return time.perf_counter()
+
+NULL_TRACE = NullTrace()
+# 当前请求的计时：main.py 每个请求在自己的线程中处理，backend 的 run_io 把上下文带到 IO 线程中
+request_trace = contextvars.ContextVar('request_trace', default=NULL_TRACE)
+trace_lock = threading.Lock()
+
+def current_trace():
+    return request_trace.get()
+
+def write_trace(record):
+    line = json.dumps(record, ensure_ascii=False) + '\n'
+    with trace_lock:
+        if TRACE_PATH == '-':
+            sys.stderr.write(line)
+        else:
+            with open(TRACE_PATH, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+class HistoryStore:
+    """持久化的传输历史（SQLite WAL），id 稳定不复用，按 id/时间/来源 IP 查询都走索引
+
+    每次增删都在 changes 表追加一条变更（删除和清空以墓碑形式记录），变更序号即历史版本号。
+    版本号缓存在内存中，用于生成 ETag；客户端带上旧版本号可以只取这之后的变化。
+    两个服务返回的记录格式不同，由子类实现 to_record
+    """
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            self.conn.executescript('''
+                CREATE TABLE IF NOT EXISTS history (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    filename TEXT NOT NULL, size INTEGER, client_ip TEXT, created REAL, digest TEXT);
+                CREATE INDEX IF NOT EXISTS history_by_created ON history (created);
+                CREATE INDEX IF NOT EXISTS history_by_client ON history (client_ip, id);
+                CREATE TABLE IF NOT EXISTS changes (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT, op TEXT NOT NULL, item_id INTEGER);
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            ''')
+            self.conn.execute("INSERT OR IGNORE INTO meta VALUES ('instance', ?)", (uuid.uuid4().hex[:12],))
+            self.instance = self.conn.execute("SELECT value FROM meta WHERE key = 'instance'").fetchone()[0]
+            self.version = self.conn.execute('SELECT COALESCE(MAX(seq), 0) FROM changes').fetchone()[0]
+
+    def etag(self, version):
+        """版本对应的 ETag，数据库重建后实例标识不同，旧 ETag 不会误匹配"""
+        return f'"{self.instance}-{version}"'
+
+    def log_change(self, op, item_id=None):
+        """记录一次变更（需在持有锁的事务中调用），超出 MAX_CHANGE_LOG 的旧变更定期清理"""
+        seq = self.conn.execute('INSERT INTO changes (op, item_id) VALUES (?, ?)', (op, item_id)).lastrowid
+        if op == 'clear':
+            self.conn.execute('DELETE FROM changes WHERE seq < ?', (seq,))
+        elif seq % 1000 == 0:
+            self.conn.execute('DELETE FROM changes WHERE seq <= ?', (seq - MAX_CHANGE_LOG,))
+        self.version = seq
+
+    def to_record(self, row):
+        """把 (id, 文件名, 大小, 来源 IP, 时间戳, 摘要) 转换为接口返回的记录"""
+        raise NotImplementedError
+
+    def add(self, filename, client_ip, size, digest=None):
+        """添加一条记录并返回它"""
+        return self.add_many([(filename, client_ip, size, digest)])[0]
+
+    def add_many(self, entries):
+        """在一个事务中添加多条记录 (文件名, 来源 IP, 大小, 摘要)，返回它们"""
+        created = time.time()
+        rows = []
+        with self.lock, self.conn:
+            for filename, client_ip, size, digest in entries:
+                cursor = self.conn.execute(
+                    'INSERT INTO history (filename, size, client_ip, created, digest) VALUES (?, ?, ?, ?, ?)',
+                    (filename, size, client_ip, created, digest))
+                self.log_change('add', cursor.lastrowid)
+                rows.append((cursor.lastrowid, filename, size, client_ip, created, digest))
+        return [self.to_record(row) for row in rows]
+
+    @staticmethod
+    def filter_conditions(start=None, end=None, client_ip=None):
+        conditions, params = [], []
+        if start is not None:
+            conditions.append('created >= ?')
+            params.append(start)
+        if end is not None:
+            conditions.append('created < ?')
+            params.append(end)
+        if client_ip:
+            conditions.append('client_ip = ?')
+            params.append(client_ip)
+        return conditions, params
+
+    def query(self, limit=100, before_id=None, start=None, end=None, client_ip=None):
+        """返回满足条件的最新 limit 条记录（按 id 升序）；before_id 用于向前翻页"""
+        conditions, params = self.filter_conditions(start, end, client_ip)
+        if before_id is not None:
+            conditions.append('id < ?')
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        with self.lock:
+            rows = self.conn.execute(
+                f'SELECT id, filename, size, client_ip, created, digest FROM history {where} ORDER BY id DESC LIMIT ?',
+                params + [limit]).fetchall()
+        return [self.to_record(row) for row in reversed(rows)]
+
+    def changes_since(self, since, start=None, end=None, client_ip=None):
+        """返回版本 since 之后的变化：新增的记录、被删除的 id、期间是否清空过
+
+        since 早于保留的变更记录（或来自别的数据库实例）时返回 reset，客户端应重新拉取完整列表
+        """
+        with self.lock:
+            version = self.version
+            oldest = self.conn.execute('SELECT MIN(seq) FROM changes').fetchone()[0]
+            if since > version or (since < version and (oldest is None or since < oldest - 1)):
+                return {'version': version, 'reset': True}
+            rows = self.conn.execute(
+                'SELECT op, item_id FROM changes WHERE seq > ? AND seq <= ? ORDER BY seq', (since, version)).fetchall()
+            cleared, added, removed = False, set(), set()
+            for op, item_id in rows:
+                if op == 'clear':
+                    cleared = True
+                    added.clear()
+                    removed.clear()
+                elif op == 'add':
+                    added.add(item_id)
+                else:
+                    added.discard(item_id)
+                    removed.add(item_id)
+            records = []
+            if added:
+                # id 单调递增，新增记录都不小于其中最小的 id
+                conditions, params = self.filter_conditions(start, end, client_ip)
+                conditions.append('id >= ?')
+                params.append(min(added))
+                records = [row for row in self.conn.execute(
+                    f"SELECT id, filename, size, client_ip, created, digest FROM history "
+                    f"WHERE {' AND '.join(conditions)} ORDER BY id", params) if row[0] in added]
+        return {
+            'version': version,
+            'reset': False,
+            'cleared': cleared,
+            'added': [self.to_record(row) for row in records],
+            'removed': sorted(removed),
+        }
+
+    def delete(self, item_id):
+        """删除一条记录，返回是否存在"""
+        with self.lock, self.conn:
+            deleted = self.conn.execute('DELETE FROM history WHERE id = ?', (item_id,)).rowcount > 0
+            if deleted:
+                self.log_change('delete', item_id)
+            return deleted
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM history')
+            self.log_change('clear')
+
+class HashIndex:
+    """保存目录的持久化内容索引，用于识别接收方已有的文件
+
+    files 表记录目录中每个文件的大小和修改时间，只在目录的修改时间变化时重新扫描（不读取内容）；
+    digests 表缓存文件的摘要。查询时先按大小筛选，只有大小相同的候选文件才会按需计算摘要。
+    """
+    def __init__(self, db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.conn:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.executescript('''
+                CREATE TABLE IF NOT EXISTS dirs (dir TEXT PRIMARY KEY, mtime_ns INTEGER);
+                CREATE TABLE IF NOT EXISTS files (
+                    dir TEXT, name TEXT, size INTEGER, mtime_ns INTEGER, PRIMARY KEY (dir, name));
+                CREATE INDEX IF NOT EXISTS files_by_size ON files (dir, size);
+                CREATE TABLE IF NOT EXISTS digests (
+                    dir TEXT, name TEXT, algorithm TEXT, digest TEXT, size INTEGER, mtime_ns INTEGER,
+                    PRIMARY KEY (dir, name, algorithm));
+                CREATE INDEX IF NOT EXISTS digests_by_value ON digests (dir, algorithm, digest);
+            ''')
+
+    def refresh(self, directory):
+        """目录有变化时更新文件列表"""
+        try:
+            dir_mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return
+        with self.lock:
+            row = self.conn.execute('SELECT mtime_ns FROM dirs WHERE dir = ?', (directory,)).fetchone()
+        if row and row[0] == dir_mtime:
+            return
+        entries = {}
+        for entry in os.scandir(directory):
+            if entry.name.startswith('.') or not entry.is_file():
+                continue
+            stat = entry.stat()
+            entries[entry.name] = (stat.st_size, stat.st_mtime_ns)
+        with self.lock, self.conn:
+            known = {name for (name,) in self.conn.execute('SELECT name FROM files WHERE dir = ?', (directory,))}
+            removed = [(directory, name) for name in known - entries.keys()]
+            self.conn.executemany('DELETE FROM files WHERE dir = ? AND name = ?', removed)
+            self.conn.executemany('DELETE FROM digests WHERE dir = ? AND name = ?', removed)
+            self.conn.executemany('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                                  [(directory, name, size, mtime) for name, (size, mtime) in entries.items()])
+            self.conn.execute('INSERT OR REPLACE INTO dirs VALUES (?, ?)', (directory, dir_mtime))
+
+    def record(self, path, digest):
+        """记录刚保存的文件及其摘要（"算法:十六进制"），避免之后重新计算"""
+        self.record_many([(path, digest, os.stat(path))])
+
+    def record_many(self, entries):
+        """在一个事务中记录多个刚保存的文件 (路径, 摘要, stat)"""
+        with self.lock, self.conn:
+            for path, digest, stat in entries:
+                directory, name = os.path.split(path)
+                self.conn.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                                  (directory, name, stat.st_size, stat.st_mtime_ns))
+                if digest:
+                    algorithm, hexdigest = parse_digest(digest)
+                    self.conn.execute('INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?)',
+                                      (directory, name, algorithm, hexdigest, stat.st_size, stat.st_mtime_ns))
+
+    def lookup(self, directory, size, algorithm, hexdigest, prefer=None):
+        """返回目录中内容相同的文件名（有多个时优先返回 prefer），没有时返回 None"""
+        self.refresh(directory)
+        with self.lock:
+            cached = self.conn.execute(
+                'SELECT name, size, mtime_ns FROM digests WHERE dir = ? AND algorithm = ? AND digest = ?',
+                (directory, algorithm, hexdigest)).fetchall()
+            # 大小相同、但还没有该算法有效摘要的候选文件
+            candidates = self.conn.execute(
+                '''SELECT f.name FROM files f LEFT JOIN digests d
+                   ON d.dir = f.dir AND d.name = f.name AND d.algorithm = ?
+                   WHERE f.dir = ? AND f.size = ? AND (d.mtime_ns IS NULL OR d.mtime_ns != f.mtime_ns)''',
+                (algorithm, directory, size)).fetchall()
+        matches = []
+        for name, cached_size, cached_mtime in cached:
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            if stat.st_size == cached_size == size and stat.st_mtime_ns == cached_mtime:
+                matches.append(name)
+        if matches:
+            return prefer if prefer in matches else matches[0]
+        for name in sorted((name for (name,) in candidates), key=lambda name: name != prefer):
+            path = os.path.join(directory, name)
+            try:
+                hasher = hashlib.new(algorithm)
+                with open(path, 'rb') as f:
+                    for data in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+                        hasher.update(data)
+                self.record(path, format_digest(hasher))
+            except OSError:
+                continue
+            if hasher.hexdigest() == hexdigest:
+                return name
+        return None
@@ -2,14 +2,38 @@
 import os
 import socket
 import threading
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+import argparse
 import urllib.parse
 import json
 import time
-from pathlib import Path
-import cgi
-import tempfile
+import datetime
+import re
+import hashlib
+import hmac
+import gzip
 import shutil
+import uuid
+import struct
+import ipaddress
+from pathlib import Path
+from collections import deque
+from email.message import Message
+from email.utils import collapse_rfc2231_value
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+from localsend_core import (
+    BANDWIDTH_QUANTUM, CONTENT_ENCODINGS, DISCOVERY_GROUP, DISCOVERY_PORT, HASH_ALGORITHMS, MIN_COMPRESS_SIZE,
+    WRITE_MODES, ArchiveError, HashIndex, HistoryStore, OutputFile, PeerDiscovery, RequestTrace, TransferScheduler,
+    accepts_encoding, add_range, choose_encoding, commit_file, covered_end, current_trace, extract_archive, file_etag,
+    format_digest, format_http_date, format_rate, if_range_matches, is_compressible, iter_decompressed, metrics,
+    new_decoder, new_encoder, parse_content_range, parse_digest, parse_etags, parse_range_header, parse_rate,
+    preallocate_file, range_covered, record_received_file, release_written, remove_quietly, remove_range,
+    remove_stale_parts, request_trace, set_write_mode, staging_path, sync_path,
+)
 
 # 获取桌面路径
 def get_desktop_path():
@@ -30,17 +54,65 @@ def get_desktop_path():
     return str(home)
 
 # 获取本机IP地址
-def get_local_ip():
-    """获取本机局域网IP地址"""
+def get_local_ip(family=socket.AF_INET):
+    """获取默认路由出口的局域网IP地址（UDP connect 不会真正发包），失败时返回 None"""
+    probe = '8.8.8.8' if family == socket.AF_INET else '2001:4860:4860::8888'
     try:
         # 连接到一个远程地址来获取本机IP
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return ip
-    except:
-        return "127.0.0.1"
+        with socket.socket(family, socket.SOCK_DGRAM) as s:
+            s.connect((probe, 80))
+            return s.getsockname()[0]
+    except OSError:
+        return None
+
+# 列出本机所有的 IPv4/IPv6 地址
+def list_local_addresses():
+    """列出本机所有非回环地址，默认路由的出口地址排在最前面"""
+    addresses = []
+    def add(address):
+        address = address.split('%')[0]
+        if address and address not in addresses and not is_loopback_or_link_local(address):
+            addresses.append(address)
+
+    for family in (socket.AF_INET, socket.AF_INET6):
+        add(get_local_ip(family) or '')
+    # 主机名解析到的地址（Windows/macOS 上通常包含所有网卡）
+    try:
+        for info in socket.getaddrinfo(socket.gethostname(), None, proto=socket.IPPROTO_TCP):
+            add(info[4][0])
+    except OSError:
+        pass
+    # Linux：逐个网卡查询 IPv4 地址，从 /proc 读取 IPv6 地址
+    if fcntl is not None:
+        for _, name in interface_fingerprint():
+            try:
+                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                    packed = fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack('256s', name.encode()[:15]))
+                add(socket.inet_ntoa(packed[20:24]))
+            except OSError:
+                pass
+    try:
+        with open('/proc/net/if_inet6') as f:
+            for line in f:
+                raw = line.split()[0]
+                add(str(ipaddress.IPv6Address(bytes.fromhex(raw))))
+    except (OSError, ValueError):
+        pass
+    return addresses
+
+def is_loopback_or_link_local(address):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return True
+    return ip.is_loopback or ip.is_link_local or ip.is_unspecified
+
+def interface_fingerprint():
+    """当前网卡列表，用于廉价地检测网络变化"""
+    try:
+        return tuple(socket.if_nameindex())
+    except (AttributeError, OSError):
+        return ()
 
 # 获取设备名称
 def get_device_name():
@@ -50,6 +122,63 @@ def get_device_name():
     except:
         return "Unknown Device"
 
+# 本机身份信息：检查网卡变化的间隔、强制刷新的间隔（秒）
+IDENTITY_CHECK_INTERVAL = 5
+IDENTITY_REFRESH_INTERVAL = 60
+
+# Linux 上查询网卡 IPv4 地址的 ioctl
+SIOCGIFADDR = 0x8915
+
+class ServerIdentity:
+    """缓存的本机身份信息（设备名称、所有本机地址）
+
+    请求处理只读取缓存的快照；后台线程每 IDENTITY_CHECK_INTERVAL 秒比较一次网卡列表，
+    网卡变化或距上次刷新超过 IDENTITY_REFRESH_INTERVAL 秒时重新收集。
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.refresh()
+
+    def refresh(self):
+        fingerprint = interface_fingerprint()
+        addresses = list_local_addresses()
+        # 快照整体替换，读取方无需加锁
+        self.info = {
+            'name': get_device_name(),
+            'ip': addresses[0] if addresses else '127.0.0.1',
+            'addresses': addresses or ['127.0.0.1'],
+        }
+        self.fingerprint = fingerprint
+        self.refreshed = time.monotonic()
+
+    def get(self):
+        """返回当前快照，首次调用时启动后台刷新线程"""
+        if self.thread is None:
+            with self.lock:
+                if self.thread is None and not self.stop_event.is_set():
+                    self.thread = threading.Thread(target=self.run, name='identity', daemon=True)
+                    self.thread.start()
+        return self.info
+
+    def run(self):
+        while not self.stop_event.wait(IDENTITY_CHECK_INTERVAL):
+            if (interface_fingerprint() != self.fingerprint
+                    or time.monotonic() - self.refreshed >= IDENTITY_REFRESH_INTERVAL):
+                self.refresh()
+
+    def close(self):
+        self.stop_event.set()
+
+server_identity = ServerIdentity()
+
+# 本服务在局域网发现的公告中声明的能力
+DISCOVERY_CAPABILITIES = ('upload', 'sessions', 'archive', 'preflight', 'download', 'events')
+
+# 启动后的局域网发现服务（未启用时为 None）
+peer_discovery = None
+
 # 检查端口是否可用
 def is_port_available(port):
     """检查指定端口是否可用"""
@@ -68,74 +197,793 @@ def find_available_port(start_port=8888, max_attempts=100):
             return port
     return None
 
+# 并发限制的默认值
+DEFAULT_MAX_CONNECTIONS = 64
+DEFAULT_MAX_UPLOADS = 16
+
+# 等待上传名额的最长时间（秒）
+UPLOAD_SLOT_TIMEOUT = 60
+
+# 连接数达到上限时新连接等待空闲名额的最长时间（秒），超时后直接回复 BUSY_RESPONSE
+CONNECTION_SLOT_TIMEOUT = 5
+BUSY_RESPONSE = (b'HTTP/1.0 503 Service Unavailable\r\n'
+                 b'Retry-After: 5\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+
+# 分块上传：默认/最大分块大小，以及未完成会话的过期时间（秒）
+DEFAULT_SESSION_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_SESSION_CHUNK_SIZE = 64 * 1024 * 1024
+SESSION_TTL = 6 * 60 * 60
+
+# 清理过期会话的间隔（秒）；启动时目录中的临时文件都来自之前的进程，
+# 但最近 ORPHAN_PART_AGE 秒内修改过的保留，以免误删同时运行的另一个实例正在写入的文件
+SESSION_SWEEP_INTERVAL = 60
+ORPHAN_PART_AGE = 10 * 60
+
+# 服务器状态（内容索引等）的保存目录
+STATE_DIR = os.environ.get('LOCALSEND_STATE_DIR') or str(Path.home() / '.localsend')
+
+# 服务器默认使用的内容校验算法（HASH_ALGORITHMS 之一），None 表示不计算
+hash_algorithm = 'blake2b'
+
+# 创建增量计算摘要的对象
+def new_hasher(expected=None):
+    """有期望摘要时使用相同算法，否则使用服务器默认算法；不需要计算时返回 None"""
+    algorithm = expected[0] if expected else hash_algorithm
+    return hashlib.new(algorithm) if algorithm else None
+
+# 在保存目录中创建隐藏的临时文件，写完后调用 finish 再用 commit_file 发布
+def create_staging_file(directory, size=None):
+    """返回 (OutputFile, 临时路径)；命名规则与分块上传的临时文件相同，异常退出后遗留的会被定期清理"""
+    temp_path = staging_path(directory)
+    return OutputFile(temp_path, size), temp_path
+
+# 列出可供下载的文件
+def list_shared_files(directory):
+    """返回保存目录中可下载的文件（跳过隐藏文件和未完成的上传）"""
+    files = []
+    try:
+        entries = list(os.scandir(directory))
+    except OSError:
+        return files
+    for entry in entries:
+        if entry.name.startswith('.') or not entry.is_file():
+            continue
+        stat = entry.stat()
+        files.append({
+            'filename': entry.name,
+            'size': stat.st_size,
+            'modified': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stat.st_mtime))
+        })
+    files.sort(key=lambda item: item['filename'])
+    return files
+
+# 查找要下载的文件
+def resolve_shared_file(directory, filename):
+    """返回保存目录中 filename 的路径，文件不存在或不允许下载时返回 None"""
+    if not filename or filename != os.path.basename(filename) or filename.startswith('.'):
+        return None
+    path = os.path.join(directory, filename)
+    return path if os.path.isfile(path) else None
+
+# 添加传输记录
+def add_to_history(filename, client_ip, size, digest=None, count_file=True):
+    """添加传输记录到持久化的历史中，并推送给订阅者；文件夹的记录不计入文件数指标（由解压时逐个计入）"""
+    if count_file:
+        record_received_file(size)
+    record = transfer_history.add(filename, client_ip, size, digest)
+    event_bus.publish('history', record)
+    return record
+
+# 解析历史查询中的时间参数
+def parse_time_param(value):
+    """接受 Unix 时间戳或 ISO 格式时间，返回 Unix 时间戳"""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+# 流式读写的块大小
+CHUNK_SIZE = 64 * 1024
+
+# multipart 单个分段头部的最大长度
+MAX_PART_HEADER_SIZE = 16 * 1024
+
+# SSE：保留的最近事件数、无事件时发送心跳的间隔，以及进度事件的最小间隔（秒）
+EVENT_BUFFER_SIZE = 1000
+SSE_KEEPALIVE = 15
+PROGRESS_INTERVAL = 0.5
+
+# 同时保持的 SSE 事件流上限；事件流在独立线程中推送，不占用处理请求的连接数
+MAX_EVENT_STREAMS = 100
+
+# 传输速率的指数平滑系数（每个进度间隔采样一次）
+RATE_SMOOTHING = 0.3
+
+# 每次查询历史记录最多返回的条数
+MAX_HISTORY_PAGE = 1000
+
+# JSON 请求体或表单字段的最大长度
+MAX_JSON_BODY_SIZE = 1024 * 1024
+
+# 下载时带 compress=1 才压缩（压缩后没有 Content-Length，客户端无法显示进度或续传），每次读取压缩的块大小
+COMPRESS_CHUNK_SIZE = 1024 * 1024
+
+# 管理接口（调整限速）只接受本机访问；设置了 LOCALSEND_ADMIN_TOKEN 时也接受带 Bearer 令牌的请求
+ADMIN_TOKEN = os.environ.get('LOCALSEND_ADMIN_TOKEN')
+
+# 解析带参数的请求头（如 Content-Type、Content-Disposition）
+def parse_header_params(header_name, value):
+    """解析请求头，返回 (主值, 参数字典)"""
+    msg = Message()
+    msg[header_name] = value
+    params = msg.get_params(header=header_name) or []
+    if not params:
+        return '', {}
+    main_value = params[0][0].lower()
+    options = {}
+    for key, _ in params[1:]:
+        # collapse_rfc2231_value 同时处理普通参数和 filename*=UTF-8''... 形式
+        options[key.lower()] = collapse_rfc2231_value(msg.get_param(key, header=header_name))
+    return main_value, options
+
+class MultipartError(ValueError):
+    """multipart 请求体格式错误"""
+
+class MultipartPart:
+    """multipart 请求体中的一个分段"""
+    def __init__(self, headers):
+        self.headers = headers
+        _, options = parse_header_params('content-disposition', headers.get('content-disposition', ''))
+        self.name = options.get('name')
+        self.filename = options.get('filename')
+
+transfer_scheduler = TransferScheduler()
+
+metrics.define('localsend_upload_sessions', 'gauge', '进行中的分块上传会话数',
+               collect=lambda: len(upload_sessions.sessions))
+
+# 指标中的路由标签：带参数的路径归并为模板，未知路径归为 other
+ROUTE_TEMPLATES = (
+    (re.compile(r'/api/upload/session/[^/]+/chunk/[^/]+'), '/api/upload/session/{id}/chunk/{index}'),
+    (re.compile(r'/api/upload/session/[^/]+/complete'), '/api/upload/session/{id}/complete'),
+    (re.compile(r'/api/upload/session/[^/]+'), '/api/upload/session/{id}'),
+    (re.compile(r'/api/download/.+'), '/api/download/{filename}'),
+    (re.compile(r'/history/\d+'), '/history/{id}'),
+)
+KNOWN_ROUTES = frozenset((
+    '/', '/upload', '/api/upload/archive', '/api/upload/session', '/api/preflight', '/api/server-info',
+    '/api/events', '/api/files', '/api/peers', '/api/transfers', '/api/admin/limits', '/history', '/metrics',
+))
+
+def route_label(path):
+    path = urllib.parse.urlsplit(path).path
+    if path in KNOWN_ROUTES:
+        return path
+    for pattern, template in ROUTE_TEMPLATES:
+        if pattern.fullmatch(path):
+            return template
+    return 'other'
+
+class RequestBody:
+    """按 Content-Length 读取请求体，带 Content-Encoding（gzip/zstd）时边读边解压
+
+    read(n) 返回最多 n 字节（解压后的）数据，读完或连接提前关闭时返回 b''；
+    指定 flow 时每次从连接读取前先向带宽调度器申请令牌
+    """
+    def __init__(self, fp, length, encoding=None, flow=None):
+        self.fp = fp
+        self.flow = flow
+        self.length = length
+        self.remaining = length
+        self.decoder = None
+        self.pending = None
+        self.buffer = bytearray()
+        if encoding and encoding != 'identity':
+            self.decoder = new_decoder(encoding)
+            if self.decoder is None:
+                raise UploadSessionError(415, f'不支持的 Content-Encoding: {encoding}')
+
+    @property
+    def encoded(self):
+        return self.decoder is not None
+
+    def consumed(self):
+        """返回已从连接中读取的（压缩后的）字节数"""
+        return self.length - self.remaining
+
+    def _read_raw(self, size):
+        if self.remaining <= 0:
+            return b''
+        size = min(size, self.remaining)
+        if self.flow is None or not self.flow.scheduler.limited():
+            data = self.fp.read(size)
+        else:
+            parts = []
+            while size > 0:
+                quantum = min(size, BANDWIDTH_QUANTUM)
+                self.flow.acquire(quantum)
+                part = self.fp.read(quantum)
+                if not part:
+                    break
+                parts.append(part)
+                size -= len(part)
+            data = b''.join(parts)
+        # 连接提前关闭时不再继续读取
+        self.remaining = self.remaining - len(data) if data else 0
+        return data
+
+    def read(self, size):
+        if self.decoder is None:
+            return self._read_raw(size)
+        while len(self.buffer) < size:
+            if self.pending is None:
+                raw = self._read_raw(CHUNK_SIZE)
+                if not raw:
+                    # 请求体读完了但压缩流没有结束，说明数据被截断
+                    if not self.decoder.eof:
+                        raise UploadSessionError(400, '请求体压缩数据不完整')
+                    break
+                # 每次最多解压出 CHUNK_SIZE 字节，缓冲区不会超过 size + CHUNK_SIZE
+                self.pending = iter_decompressed(self.decoder, raw, CHUNK_SIZE)
+            try:
+                self.buffer += next(self.pending)
+            except StopIteration:
+                self.pending = None
+            except Exception as e:
+                raise UploadSessionError(400, f'请求体解压失败: {e}')
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+class MultipartReader:
+    """流式解析 multipart/form-data，内存占用只与块大小有关，与文件大小无关
+
+    fp 为 RequestBody 之类的对象，read 在请求体结束时返回 b''
+    """
+    def __init__(self, fp, boundary, chunk_size=CHUNK_SIZE):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.delimiter = b'\r\n--' + boundary
+        # 在开头补上 CRLF，使第一个边界与后续边界格式一致
+        self.buffer = bytearray(b'\r\n')
+        self.finished = False
+        self.part_open = False
+
+    def _fill(self):
+        """从请求体中再读取一块数据，没有更多数据时返回 False"""
+        data = self.fp.read(self.chunk_size)
+        if not data:
+            return False
+        self.buffer += data
+        return True
+
+    def _find(self, needle, limit=None):
+        """在缓冲区中查找 needle，必要时继续读取；limit 限制可缓冲的长度"""
+        start = 0
+        while True:
+            index = self.buffer.find(needle, start)
+            if index >= 0:
+                return index
+            start = max(0, len(self.buffer) - len(needle) + 1)
+            if limit is not None and len(self.buffer) > limit:
+                raise MultipartError('分段头部过长')
+            if not self._fill():
+                raise MultipartError('请求体不完整')
+
+    def next_part(self):
+        """前进到下一个分段并返回它，没有更多分段时返回 None"""
+        if self.finished:
+            return None
+        if self.part_open:
+            # 丢弃上一个分段未读取的内容
+            for _ in self.iter_chunks():
+                pass
+        # 跳过前导内容，找到边界
+        while True:
+            index = self.buffer.find(self.delimiter)
+            if index >= 0:
+                del self.buffer[:index + len(self.delimiter)]
+                break
+            keep = len(self.delimiter) - 1
+            if len(self.buffer) > keep:
+                del self.buffer[:len(self.buffer) - keep]
+            if not self._fill():
+                raise MultipartError('找不到 multipart 边界')
+        while len(self.buffer) < 2:
+            if not self._fill():
+                raise MultipartError('请求体不完整')
+        if self.buffer[:2] == b'--':
+            # 结束边界，丢弃剩余的尾部内容
+            self.finished = True
+            self.buffer.clear()
+            while self._fill():
+                self.buffer.clear()
+            return None
+        end = self._find(b'\r\n\r\n', limit=MAX_PART_HEADER_SIZE)
+        raw_headers = bytes(self.buffer[:end]).decode('utf-8', 'replace')
+        del self.buffer[:end + 4]
+        headers = {}
+        for line in raw_headers.split('\r\n'):
+            if ':' in line:
+                key, value = line.split(':', 1)
+                headers[key.strip().lower()] = value.strip()
+        self.part_open = True
+        return MultipartPart(headers)
+
+    def iter_chunks(self):
+        """逐块产出当前分段的内容，直到遇到下一个边界"""
+        if not self.part_open:
+            return
+        keep = len(self.delimiter) - 1
+        while True:
+            index = self.buffer.find(self.delimiter)
+            if index >= 0:
+                if index:
+                    yield bytes(self.buffer[:index])
+                # 保留边界本身，交给 next_part 处理
+                del self.buffer[:index]
+                self.part_open = False
+                return
+            if len(self.buffer) >= max(self.chunk_size, keep + 1):
+                safe = len(self.buffer) - keep
+                yield bytes(self.buffer[:safe])
+                del self.buffer[:safe]
+            if not self._fill():
+                raise MultipartError('请求体不完整')
+
+class EventBus:
+    """最近事件的环形缓冲区，SSE 订阅者按事件 id 断点续传"""
+    def __init__(self, capacity=EVENT_BUFFER_SIZE):
+        self.events = deque(maxlen=capacity)
+        self.next_id = 1
+        self.closed = False
+        self.condition = threading.Condition()
+
+    def publish(self, event_type, data):
+        """发布一个事件，唤醒所有等待中的订阅者"""
+        with self.condition:
+            self.events.append((self.next_id, event_type, json.dumps(data, ensure_ascii=False)))
+            self.next_id += 1
+            self.condition.notify_all()
+
+    def _since(self, last_id):
+        latest = self.next_id - 1
+        if last_id is None or last_id > latest or (self.events and last_id < self.events[0][0] - 1):
+            # 新订阅者、服务器重启过或缓冲区已覆盖断开期间的事件：让客户端重新获取完整数据
+            return [(latest, 'reset', '{}')]
+        return [event for event in self.events if event[0] > last_id]
+
+    def wait(self, last_id, timeout):
+        """返回 last_id 之后的事件，没有新事件时最多等待 timeout 秒"""
+        with self.condition:
+            events = self._since(last_id)
+            if not events and not self.closed:
+                self.condition.wait(timeout)
+                events = self._since(last_id)
+            return events
+
+    def close(self):
+        """服务器关闭时让所有订阅者退出"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+class ProgressReporter:
+    """在写入循环中节流地发布上传进度事件，并登记到 transfers 供 /api/transfers 查询
+
+    每个块只记录字节数；速率只在发布进度时按 PROGRESS_INTERVAL 采样平滑一次
+    """
+    def __init__(self, filename, total, client_ip):
+        self.transfer_id = uuid.uuid4().hex
+        self.filename = filename
+        self.total = total
+        self.client_ip = client_ip
+        self.received = 0
+        self.last_report = 0
+        self.started = time.time()
+        self.sample_time = time.monotonic()
+        self.sample_received = 0
+        self.rate = None
+        transfers.add(self)
+
+    def current_rate(self, now):
+        """平滑后的速率（字节/秒）；超过一个间隔没有采样时按停顿期间的平均速率衰减"""
+        elapsed = now - self.sample_time
+        if elapsed <= PROGRESS_INTERVAL:
+            return self.rate
+        recent = (self.received - self.sample_received) / elapsed
+        return recent if self.rate is None else min(self.rate, recent)
+
+    def event(self, **extra):
+        rate = self.current_rate(time.monotonic())
+        eta = None
+        if rate and self.total is not None:
+            eta = round(max(self.total - self.received, 0) / rate, 1)
+        return dict(transfer_id=self.transfer_id, filename=self.filename, client_ip=self.client_ip,
+                    received=self.received, total=self.total, started=self.started,
+                    rate=round(rate) if rate is not None else None, eta=eta, **extra)
+
+    def update(self, received):
+        """更新已接收的字节数，距上次发布超过 PROGRESS_INTERVAL 秒时采样速率并发布进度"""
+        self.received = received
+        now = time.monotonic()
+        if now - self.last_report >= PROGRESS_INTERVAL:
+            self.last_report = now
+            elapsed = now - self.sample_time
+            if elapsed >= PROGRESS_INTERVAL:
+                sample = (received - self.sample_received) / elapsed
+                self.rate = sample if self.rate is None else \
+                    RATE_SMOOTHING * sample + (1 - RATE_SMOOTHING) * self.rate
+                self.sample_time = now
+                self.sample_received = received
+            event_bus.publish('progress', self.event())
+
+    def finish(self, success):
+        transfers.remove(self)
+        event_bus.publish('progress', self.event(done=True, success=success))
+
+class TransferRegistry:
+    """进行中的上传：transfer_id -> ProgressReporter，查询时才生成快照"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active = {}
+
+    def add(self, progress):
+        with self.lock:
+            self.active[progress.transfer_id] = progress
+
+    def remove(self, progress):
+        with self.lock:
+            self.active.pop(progress.transfer_id, None)
+
+    def __len__(self):
+        return len(self.active)
+
+    def snapshot(self):
+        with self.lock:
+            active = list(self.active.values())
+        return sorted((progress.event() for progress in active), key=lambda item: item['started'])
+
+transfers = TransferRegistry()
+event_bus = EventBus()
+
+class UploadSessionError(Exception):
+    """上传请求（分块会话、预检、请求体解压）的错误，携带 HTTP 状态码"""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class UploadSession:
+    """一次可续传的分块上传：各分块/字节区间用 pwrite 写入保存目录中预分配的临时文件"""
+    def __init__(self, session_id, directory, filename, size, chunk_size, client_ip, expected_digest=None):
+        self.session_id = session_id
+        self.directory = directory
+        self.filename = filename
+        self.size = size
+        self.chunk_size = chunk_size
+        self.client_ip = client_ip
+        self.total_chunks = (size + chunk_size - 1) // chunk_size
+        # 已写入的字节区间，按起点排序且互不相邻
+        self.received = []
+        self.lock = threading.Lock()
+        self.updated_at = time.time()
+        # 正在写入的请求数；开始完成会话后不再接受写入，有写入进行中时也不能完成
+        self.writers = 0
+        self.finalizing = False
+        # 摘要已覆盖到的位置：按顺序到达的数据在写入时直接计算，乱序的部分补齐后从文件读取
+        self.expected_digest = expected_digest
+        self.hasher = new_hasher(expected_digest)
+        self.hashed_upto = 0
+        self.hash_lock = threading.Lock()
+        self.partial_path = staging_path(directory, session_id)
+        # 预分配文件空间，多个连接可以并发写入各自的位置；失败时不留下临时文件，也不登记传输
+        try:
+            preallocate_file(self.partial_path, size)
+        except OSError:
+            remove_quietly(self.partial_path)
+            raise
+        self.progress = ProgressReporter(filename, size, client_ip)
+
+    def chunk_length(self, index):
+        """返回第 index 个分块应有的字节数"""
+        if index < 0 or index >= self.total_chunks:
+            raise UploadSessionError(416, f'分块编号超出范围: {index}')
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def write_chunk(self, index, body):
+        """从请求体读取第 index 个分块"""
+        expected = self.chunk_length(index)
+        if not body.encoded and body.length != expected:
+            raise UploadSessionError(400, f'分块 {index} 的长度应为 {expected} 字节')
+        self.write_range(index * self.chunk_size, body, expected)
+
+    def write_range(self, start, fp, length):
+        """从 fp 读取 length 字节写入 [start, start + length)，可与其他区间并发写入；数据多于 length 时报错"""
+        end = start + length
+        if start < 0 or end > self.size:
+            raise UploadSessionError(416, f'区间超出文件大小: {start}-{end}')
+        with self.lock:
+            if self.finalizing:
+                raise UploadSessionError(409, '上传会话正在完成，不再接受数据')
+            self.writers += 1
+            # 重传的区间在写完之前视为缺失
+            remove_range(self.received, start, end)
+        try:
+            self._write_range(start, fp, length)
+        finally:
+            with self.lock:
+                self.writers -= 1
+
+    def _write_range(self, start, fp, length):
+        end = start + length
+        if self.hasher and start < self.hashed_upto:
+            # 已计入摘要的数据被重写，只能重新计算
+            with self.hash_lock:
+                self.hasher = new_hasher(self.expected_digest)
+                self.hashed_upto = 0
+        try:
+            fd = os.open(self.partial_path, os.O_WRONLY)
+        except FileNotFoundError:
+            raise UploadSessionError(404, '上传会话已结束')
+        offset = start
+        trace = current_trace()
+        try:
+            while offset < end:
+                t = time.perf_counter()
+                data = fp.read(min(CHUNK_SIZE, end - offset))
+                t = trace.add('parse', t)
+                if not data:
+                    raise UploadSessionError(400, '分块数据不完整')
+                os.pwrite(fd, data, offset)
+                t = trace.add('write', t)
+                if self.hasher and self.hashed_upto == offset:
+                    with self.hash_lock:
+                        if self.hashed_upto == offset:
+                            self.hasher.update(data)
+                            self.hashed_upto += len(data)
+                    trace.add('hash', t)
+                offset += len(data)
+            if fp.read(1):
+                raise UploadSessionError(400, f'请求体长度应为 {length} 字节')
+            release_written(fd, start, length)
+        finally:
+            os.close(fd)
+        with self.lock:
+            add_range(self.received, start, end)
+            self.updated_at = time.time()
+        self.progress.update(self.received_bytes())
+        self.advance_hash()
+
+    def advance_hash(self):
+        """把摘要推进到连续已写入数据的末尾，乱序到达的数据此时通常还在页缓存中"""
+        if not self.hasher:
+            return
+        with self.hash_lock:
+            with self.lock:
+                end = covered_end(self.received, self.hashed_upto)
+            if end <= self.hashed_upto:
+                return
+            t = time.perf_counter()
+            with open(self.partial_path, 'rb') as f:
+                f.seek(self.hashed_upto)
+                while self.hashed_upto < end:
+                    data = f.read(min(CHUNK_SIZE, end - self.hashed_upto))
+                    if not data:
+                        break
+                    self.hasher.update(data)
+                    self.hashed_upto += len(data)
+            current_trace().add('hash', t)
+
+    def received_bytes(self):
+        """返回已写入的字节数"""
+        with self.lock:
+            return sum(end - start for start, end in self.received)
+
+    def received_ranges(self):
+        """返回已保存的字节区间列表 [[start, end), ...]"""
+        with self.lock:
+            return [list(r) for r in self.received]
+
+    def missing_chunks(self):
+        """返回尚未完整收到的分块编号"""
+        with self.lock:
+            ranges = [list(r) for r in self.received]
+        return [i for i in range(self.total_chunks)
+                if not range_covered(ranges, i * self.chunk_size, i * self.chunk_size + self.chunk_length(i))]
+
+    def is_complete(self):
+        """整个文件是否都已写入"""
+        with self.lock:
+            return range_covered(self.received, 0, self.size)
+
+    def to_dict(self):
+        return {
+            'session_id': self.session_id,
+            'filename': self.filename,
+            'size': self.size,
+            'chunk_size': self.chunk_size,
+            'total_chunks': self.total_chunks,
+            'received_ranges': self.received_ranges(),
+            'missing_chunks': self.missing_chunks(),
+        }
+
+    def begin_finalize(self):
+        """数据已全部到齐且没有进行中的写入时把会话标记为正在完成，之后到达的写入会被拒绝"""
+        with self.lock:
+            if self.writers:
+                raise UploadSessionError(409, '还有分块正在写入')
+            if not range_covered(self.received, 0, self.size):
+                raise UploadSessionError(409, '还有分块尚未上传')
+            self.finalizing = True
+
+    def finalize(self):
+        """校验摘要后把拼装完成的临时文件重命名为最终文件，返回最终路径（需先调用 begin_finalize）"""
+        self.advance_hash()
+        if self.expected_digest and self.hasher.hexdigest() != self.expected_digest[1]:
+            self.discard()
+            raise UploadSessionError(422, '文件校验失败，摘要不一致')
+        try:
+            sync_path(self.partial_path)
+            target_path = commit_file(self.directory, self.filename, self.partial_path)
+        except BaseException:
+            # 会话已结束，发布失败时同样结束进度并删除临时文件
+            self.discard()
+            raise
+        self.progress.finish(True)
+        return target_path
+
+    def discard(self):
+        """放弃会话并删除临时文件"""
+        self.progress.finish(False)
+        try:
+            os.remove(self.partial_path)
+        except FileNotFoundError:
+            pass
+
+class UploadSessionManager:
+    """管理进行中的分块上传会话；start 之后由后台线程定期清理过期会话"""
+    def __init__(self, ttl=SESSION_TTL):
+        self.ttl = ttl
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def create(self, directory, filename, size, chunk_size, client_ip, expected_digest=None):
+        if filename is not None and not isinstance(filename, str):
+            raise UploadSessionError(400, '文件名无效')
+        safe_filename = os.path.basename(filename or '')
+        if not safe_filename:
+            raise UploadSessionError(400, '文件名不能为空')
+        if size < 0:
+            raise UploadSessionError(400, '文件大小无效')
+        if chunk_size <= 0 or chunk_size > MAX_SESSION_CHUNK_SIZE:
+            raise UploadSessionError(400, f'分块大小必须在 1 到 {MAX_SESSION_CHUNK_SIZE} 字节之间')
+        session = UploadSession(uuid.uuid4().hex, directory, safe_filename, size, chunk_size, client_ip,
+                                expected_digest)
+        with self.lock:
+            self.sessions[session.session_id] = session
+        return session
+
+    def get(self, session_id):
+        with self.lock:
+            session = self.sessions.get(session_id)
+        if session is None:
+            raise UploadSessionError(404, '上传会话不存在或已过期')
+        return session
+
+    def pop(self, session_id):
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            raise UploadSessionError(404, '上传会话不存在或已过期')
+        return session
+
+    def complete(self, session_id):
+        """所有分块到齐且没有进行中的写入时结束会话并返回它，之后到达的分块会被拒绝"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                raise UploadSessionError(404, '上传会话不存在或已过期')
+            session.begin_finalize()
+            del self.sessions[session_id]
+        return session
+
+    def sweep(self, directory):
+        """删除过期的会话，以及不属于任何会话、超过 ttl 没有修改的临时文件"""
+        now = time.time()
+        with self.lock:
+            expired = [s for s in self.sessions.values() if now - s.updated_at > self.ttl and not s.writers]
+            for session in expired:
+                del self.sessions[session.session_id]
+            active = {s.partial_path for s in self.sessions.values()}
+        for session in expired:
+            session.discard()
+        remove_stale_parts(directory, active, self.ttl)
+
+    def start(self, directory):
+        """清理之前的进程遗留的临时文件，然后启动定期清理的后台线程"""
+        remove_stale_parts(directory, set(), ORPHAN_PART_AGE)
+        self.thread = threading.Thread(target=self.run, args=(directory,), name='session-sweep', daemon=True)
+        self.thread.start()
+
+    def run(self, directory):
+        while not self.stop_event.wait(SESSION_SWEEP_INTERVAL):
+            self.sweep(directory)
+
+    def close(self):
+        self.stop_event.set()
+
+class TransferHistory(HistoryStore):
+    """main.py 的历史记录格式：本地时间字符串和来源 IP（from_ip）"""
+    def to_record(self, row):
+        item_id, filename, size, client_ip, created, digest = row
+        record = {
+            'id': item_id,
+            'filename': filename,
+            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created)),
+            'from_ip': client_ip,
+            'size': size
+        }
+        if digest:
+            record['digest'] = digest
+        return record
+
+upload_sessions = UploadSessionManager()
 # 全局变量存储传输历史
-transfer_history = []
+transfer_history = TransferHistory(os.path.join(STATE_DIR, 'history.db'))
+hash_index = HashIndex(os.path.join(STATE_DIR, 'hash_index.db'))
 
-class FileTransferHandler(BaseHTTPRequestHandler):
-    def log_message(self, format, *args):
-        """重写日志方法，减少控制台输出"""
-        pass
-    
-    def do_GET(self):
-        """处理GET请求"""
-        if self.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html; charset=utf-8')
-            self.end_headers()
-            
-            # 获取客户端IP
-            client_ip = self.client_address[0]
-            
-            html_content = f"""
-<!DOCTYPE html>
+# 网页界面：启动时渲染一次并预先压缩，设备信息和客户端 IP 由页面通过 /api/server-info 获取
+INDEX_HTML = """<!DOCTYPE html>
 <html lang="zh-CN">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>文件传输服务</title>
     <style>
-        * {{
+        * {
             margin: 0;
             padding: 0;
             box-sizing: border-box;
-        }}
+        }
         
-        body {{
+        body {
             font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
             background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
             min-height: 100vh;
             padding: 20px;
-        }}
+        }
         
-        .container {{
+        .container {
             max-width: 800px;
             margin: 0 auto;
             background: white;
             border-radius: 15px;
             box-shadow: 0 20px 40px rgba(0,0,0,0.1);
             overflow: hidden;
-        }}
+        }
         
-        .header {{
+        .header {
             background: linear-gradient(135deg, #4facfe 0%, #00f2fe 100%);
             color: white;
             padding: 30px;
             text-align: center;
-        }}
+        }
         
-        .header h1 {{
+        .header h1 {
             font-size: 2.5em;
             margin-bottom: 10px;
-        }}
+        }
         
-        .device-info {{
+        .device-info {
             background: rgba(255,255,255,0.2);
             padding: 15px;
             border-radius: 10px;
             margin-top: 20px;
-        }}
+        }
         
-        .drop-zone {{
+        .drop-zone {
             border: 3px dashed #4facfe;
             border-radius: 15px;
             padding: 60px 20px;
@@ -143,51 +991,58 @@ class FileTransferHandler(BaseHTTPRequestHandler):
             margin: 30px;
             transition: all 0.3s ease;
             cursor: pointer;
-        }}
+        }
         
-        .drop-zone:hover, .drop-zone.dragover {{
+        .drop-zone:hover, .drop-zone.dragover {
             border-color: #00f2fe;
             background: rgba(79, 172, 254, 0.1);
             transform: scale(1.02);
-        }}
+        }
+        
+        .icon {
+            width: 1em;
+            height: 1em;
+            vertical-align: -0.125em;
+            fill: currentColor;
+        }
         
-        .drop-zone i {{
+        .drop-zone .icon {
             font-size: 4em;
             color: #4facfe;
             margin-bottom: 20px;
-        }}
+        }
         
-        .drop-zone h3 {{
+        .drop-zone h3 {
             color: #333;
             margin-bottom: 10px;
             font-size: 1.5em;
-        }}
+        }
         
-        .drop-zone p {{
+        .drop-zone p {
             color: #666;
             font-size: 1.1em;
-        }}
+        }
         
-        .history {{
+        .history {
             padding: 30px;
             border-top: 1px solid #eee;
-        }}
+        }
         
-        .history h3 {{
+        .history h3 {
             color: #333;
             margin-bottom: 20px;
             font-size: 1.3em;
-        }}
+        }
         
-        .history-item {{
+        .history-item {
             background: #f8f9fa;
             padding: 15px;
             border-radius: 8px;
             margin-bottom: 10px;
             border-left: 4px solid #4facfe;
-        }}
+        }
         
-        .progress-bar {{
+        .progress-bar {
             width: 100%;
             height: 6px;
             background: #eee;
@@ -195,58 +1050,77 @@ class FileTransferHandler(BaseHTTPRequestHandler):
             margin: 20px 0;
             overflow: hidden;
             display: none;
-        }}
+        }
         
-        .progress-fill {{
+        .progress-fill {
             height: 100%;
             background: linear-gradient(90deg, #4facfe, #00f2fe);
             width: 0%;
             transition: width 0.3s ease;
-        }}
+        }
         
-        .status {{
+        .transfers {
+            margin: 0 30px;
+        }
+        
+        .transfer-item {
+            background: #d1ecf1;
+            color: #0c5460;
+            padding: 10px 15px;
+            border-radius: 8px;
+            margin-bottom: 10px;
+        }
+        
+        .status {
             text-align: center;
             padding: 15px;
             margin: 20px 30px;
             border-radius: 8px;
             display: none;
-        }}
+        }
         
-        .status.success {{
+        .status.success {
             background: #d4edda;
             color: #155724;
             border: 1px solid #c3e6cb;
-        }}
+        }
         
-        .status.error {{
+        .status.error {
             background: #f8d7da;
             color: #721c24;
             border: 1px solid #f5c6cb;
-        }}
+        }
         
-        .status.info {{
+        .status.info {
             background: #d1ecf1;
             color: #0c5460;
             border: 1px solid #bee5eb;
-        }}
+        }
     </style>
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css">
 </head>
 <body>
+    <svg style="display: none">
+        <symbol id="icon-upload" viewBox="0 0 24 24">
+            <path d="M19.35 10.04A7.49 7.49 0 0 0 12 4C9.11 4 6.6 5.64 5.35 8.04A5.994 5.994 0 0 0 0 14c0 3.31 2.69 6 6 6h13c2.76 0 5-2.24 5-5 0-2.64-2.05-4.78-4.65-4.96zM14 13v4h-4v-4H7l5-5 5 5h-3z"/>
+        </symbol>
+        <symbol id="icon-history" viewBox="0 0 24 24">
+            <path d="M13 3a9 9 0 0 0-9 9H1l3.89 3.89.07.14L9 12H6c0-3.87 3.13-7 7-7s7 3.13 7 7-3.13 7-7 7c-1.93 0-3.68-.79-4.94-2.06l-1.42 1.42A8.954 8.954 0 0 0 13 21a9 9 0 0 0 0-18zm-1 5v5l4.28 2.54.72-1.21-3.5-2.08V8H12z"/>
+        </symbol>
+    </svg>
     <div class="container">
         <div class="header">
-            <h1><i class="fas fa-cloud-upload-alt"></i> 文件传输服务</h1>
+            <h1><svg class="icon"><use href="#icon-upload"/></svg> 文件传输服务</h1>
             <div class="device-info">
-                <p><strong>设备名称:</strong> {get_device_name()}</p>
-                <p><strong>您的IP:</strong> {client_ip}</p>
-                <p><strong>服务器IP:</strong> {get_local_ip()}</p>
+                <p><strong>设备名称:</strong> <span id="deviceName">-</span></p>
+                <p><strong>您的IP:</strong> <span id="clientIp">-</span></p>
+                <p><strong>服务器IP:</strong> <span id="serverIps">-</span></p>
             </div>
         </div>
         
         <div class="drop-zone" id="dropZone">
-            <i class="fas fa-cloud-upload-alt"></i>
+            <svg class="icon"><use href="#icon-upload"/></svg>
             <h3>拖拽文件到这里上传</h3>
-            <p>支持多文件同时传输，文件将自动保存到服务器桌面</p>
+            <p>支持多文件和文件夹同时传输，文件将自动保存到服务器桌面</p>
         </div>
         
         <div class="progress-bar" id="progressBar">
@@ -255,8 +1129,10 @@ class FileTransferHandler(BaseHTTPRequestHandler):
         
         <div class="status" id="status"></div>
         
+        <div class="transfers" id="transferList"></div>
+        
         <div class="history">
-            <h3><i class="fas fa-history"></i> 传输历史</h3>
+            <h3><svg class="icon"><use href="#icon-history"/></svg> 传输历史</h3>
             <div id="historyList">
                 <p style="color: #666; text-align: center;">暂无传输记录</p>
             </div>
@@ -269,244 +1145,1191 @@ class FileTransferHandler(BaseHTTPRequestHandler):
         const progressFill = document.getElementById('progressFill');
         const status = document.getElementById('status');
         const historyList = document.getElementById('historyList');
+        const transferList = document.getElementById('transferList');
 
         // 防止默认拖拽行为
-        ['dragenter', 'dragover', 'dragleave', 'drop'].forEach(eventName => {{
+        ['dragenter', 'dragover', 'dragleave', 'drop'].forEach(eventName => {
             dropZone.addEventListener(eventName, preventDefaults, false);
             document.body.addEventListener(eventName, preventDefaults, false);
-        }});
+        });
 
-        function preventDefaults(e) {{
+        function preventDefaults(e) {
             e.preventDefault();
             e.stopPropagation();
-        }}
+        }
 
         // 拖拽效果
-        ['dragenter', 'dragover'].forEach(eventName => {{
+        ['dragenter', 'dragover'].forEach(eventName => {
             dropZone.addEventListener(eventName, highlight, false);
-        }});
+        });
 
-        ['dragleave', 'drop'].forEach(eventName => {{
+        ['dragleave', 'drop'].forEach(eventName => {
             dropZone.addEventListener(eventName, unhighlight, false);
-        }});
+        });
 
-        function highlight(e) {{
+        function highlight(e) {
             dropZone.classList.add('dragover');
-        }}
+        }
 
-        function unhighlight(e) {{
+        function unhighlight(e) {
             dropZone.classList.remove('dragover');
-        }}
+        }
 
         // 处理文件拖拽
         dropZone.addEventListener('drop', handleDrop, false);
 
-        function handleDrop(e) {{
+        async function handleDrop(e) {
             const dt = e.dataTransfer;
-            const files = dt.files;
+            // 条目只能在 drop 事件中同步取出
+            const entries = Array.from(dt.items || [], item => item.webkitGetAsEntry ? item.webkitGetAsEntry() : null);
+            if (!entries.some(entry => entry && entry.isDirectory)) {
+                handleFiles(dt.files);
+                return;
+            }
+            // 文件夹打包成 tar 流上传，保留目录结构；其他文件照常上传
+            const files = [];
+            for (const entry of entries) {
+                if (entry && entry.isDirectory) {
+                    await uploadFolder(entry);
+                } else if (entry) {
+                    files.push(await entryFile(entry));
+                }
+            }
             handleFiles(files);
-        }}
+        }
 
-        function handleFiles(files) {{
+        function entryFile(entry) {
+            return new Promise((resolve, reject) => entry.file(resolve, reject));
+        }
+
+        // readEntries 每次只返回一批，读到空为止
+        async function readAllEntries(dirEntry) {
+            const reader = dirEntry.createReader();
+            const all = [];
+            for (;;) {
+                const batch = await new Promise((resolve, reject) => reader.readEntries(resolve, reject));
+                if (batch.length === 0) return all;
+                all.push(...batch);
+            }
+        }
+
+        // tar 成员头（ustar）；路径过长、含非 ASCII 字符或文件超过 8 GiB 时前置 PAX 扩展头
+        const encoder = new TextEncoder();
+
+        function tarHeader(name, size, mtime, type) {
+            const block = new Uint8Array(512);
+            const put = (offset, text, length) => block.set(encoder.encode(text).subarray(0, length), offset);
+            const octal = (value, length) => value.toString(8).padStart(length - 1, '0');
+            put(0, name, 100);
+            put(100, octal(type === '5' ? 0o755 : 0o644, 8), 8);
+            put(108, octal(0, 8), 8);
+            put(116, octal(0, 8), 8);
+            put(124, octal(size < 8 ** 11 ? size : 0, 12), 12);
+            put(136, octal(mtime, 12), 12);
+            put(148, '        ', 8);
+            put(156, type, 1);
+            put(257, 'ustar', 6);
+            put(263, '00', 2);
+            const sum = block.reduce((total, byte) => total + byte, 0);
+            put(148, octal(sum, 7), 6);
+            block[154] = 0;
+            return block;
+        }
+
+        function paxRecord(key, value) {
+            const body = ' ' + key + '=' + value + String.fromCharCode(10);
+            const bodyLength = encoder.encode(body).length;
+            let length = bodyLength + 1;
+            while (String(length).length + bodyLength !== length) length = String(length).length + bodyLength;
+            return length + body;
+        }
+
+        function padding(size) {
+            return new Uint8Array((512 - size % 512) % 512);
+        }
+
+        // 一个成员的各部分；文件内容直接引用 File，拼成 Blob 时不会读入内存
+        function tarEntry(path, file) {
+            const parts = [];
+            const type = file ? '0' : '5';
+            const size = file ? file.size : 0;
+            const mtime = Math.floor((file ? file.lastModified : Date.now()) / 1000);
+            let name = file ? path : path + '/';
+            if (!/^[ -~]*$/.test(name) || encoder.encode(name).length > 100 || size >= 8 ** 11) {
+                const records = encoder.encode(paxRecord('path', name) + (size >= 8 ** 11 ? paxRecord('size', size) : ''));
+                parts.push(tarHeader('PaxHeader', records.length, mtime, 'x'), records, padding(records.length));
+                name = name.replace(/[^ -~]/g, '_');
+            }
+            parts.push(tarHeader(name, size, mtime, type));
+            if (file) parts.push(file, padding(size));
+            return parts;
+        }
+
+        async function uploadFolder(dirEntry) {
+            showStatus(`正在读取文件夹 ${dirEntry.name}...`, 'info');
+            const parts = [];
+            let count = 0;
+            const walk = async (entry, path) => {
+                if (entry.isDirectory) {
+                    parts.push(...tarEntry(path, null));
+                    for (const child of await readAllEntries(entry)) await walk(child, path + '/' + child.name);
+                } else {
+                    parts.push(...tarEntry(path, await entryFile(entry)));
+                    count++;
+                }
+            };
+            for (const child of await readAllEntries(dirEntry)) await walk(child, child.name);
+            // 两个全零块表示归档结束
+            parts.push(new Uint8Array(1024));
+            const archive = new Blob(parts, { type: 'application/x-tar' });
+
+            showStatus(`正在上传文件夹 ${dirEntry.name}（${count} 个文件）...`, 'info');
+            progressBar.style.display = 'block';
+            await new Promise(resolve => {
+                const xhr = new XMLHttpRequest();
+                xhr.upload.addEventListener('progress', (e) => {
+                    if (e.lengthComputable) progressFill.style.width = (e.loaded / e.total) * 100 + '%';
+                });
+                xhr.addEventListener('load', () => {
+                    progressBar.style.display = 'none';
+                    if (xhr.status === 200) {
+                        showStatus(`文件夹 ${dirEntry.name} 上传成功！`, 'success');
+                        if (!window.EventSource) updateHistory();
+                    } else {
+                        showStatus('文件夹上传失败，请重试', 'error');
+                    }
+                    resolve();
+                });
+                xhr.addEventListener('error', () => {
+                    progressBar.style.display = 'none';
+                    showStatus('上传出错，请检查网络连接', 'error');
+                    resolve();
+                });
+                xhr.open('POST', '/api/upload/archive?name=' + encodeURIComponent(dirEntry.name));
+                xhr.send(archive);
+            });
+        }
+
+        function handleFiles(files) {
             if (files.length === 0) return;
             
             showStatus('正在上传文件...', 'info');
             progressBar.style.display = 'block';
             
             const formData = new FormData();
-            for (let i = 0; i < files.length; i++) {{
+            for (let i = 0; i < files.length; i++) {
                 formData.append('files', files[i]);
-            }}
+            }
 
             const xhr = new XMLHttpRequest();
             
-            xhr.upload.addEventListener('progress', (e) => {{
-                if (e.lengthComputable) {{
+            xhr.upload.addEventListener('progress', (e) => {
+                if (e.lengthComputable) {
                     const percentComplete = (e.loaded / e.total) * 100;
                     progressFill.style.width = percentComplete + '%';
-                }}
-            }});
+                }
+            });
 
-            xhr.addEventListener('load', () => {{
+            xhr.addEventListener('load', () => {
                 progressBar.style.display = 'none';
-                if (xhr.status === 200) {{
+                if (xhr.status === 200) {
                     showStatus('文件上传成功！', 'success');
-                    updateHistory();
-                }} else {{
+                    if (!window.EventSource) updateHistory();
+                } else {
                     showStatus('上传失败，请重试', 'error');
-                }}
-            }});
+                }
+            });
 
-            xhr.addEventListener('error', () => {{
+            xhr.addEventListener('error', () => {
                 progressBar.style.display = 'none';
                 showStatus('上传出错，请检查网络连接', 'error');
-            }});
+            });
 
             xhr.open('POST', '/upload');
             xhr.send(formData);
-        }}
+        }
 
-        function showStatus(message, type) {{
+        function showStatus(message, type) {
             status.textContent = message;
             status.className = 'status ' + type;
             status.style.display = 'block';
             
-            setTimeout(() => {{
+            setTimeout(() => {
                 status.style.display = 'none';
-            }}, 3000);
-        }}
+            }, 3000);
+        }
 
-        function updateHistory() {{
+        function renderHistoryItem(item) {
+            const div = document.createElement('div');
+            div.className = 'history-item';
+            div.dataset.id = item.id;
+            const name = document.createElement('strong');
+            name.textContent = item.filename;
+            const from = document.createElement('span');
+            from.style.color = '#666';
+            from.textContent = ` (来自: ${item.from_ip})`;
+            const time = document.createElement('span');
+            time.style.cssText = 'color: #666; float: right;';
+            time.textContent = item.timestamp;
+            div.append(name, from, time);
+            return div;
+        }
+
+        function showEmptyHistory() {
+            historyList.innerHTML = '<p style="color: #666; text-align: center;">暂无传输记录</p>';
+        }
+
+        // 已同步到的历史版本，之后只拉取增量；历史没有变化时服务器返回 304
+        let historyVersion = null;
+
+        function updateHistory() {
+            if (historyVersion !== null) {
+                fetch('/history?since=' + historyVersion)
+                    .then(response => response.json())
+                    .then(delta => {
+                        if (delta.reset) {
+                            historyVersion = null;
+                            updateHistory();
+                            return;
+                        }
+                        if (delta.cleared) showEmptyHistory();
+                        delta.removed.forEach(removeHistoryItem);
+                        delta.added.forEach(addHistoryItem);
+                        historyVersion = delta.version;
+                    });
+                return;
+            }
             fetch('/history')
-                .then(response => response.json())
-                .then(data => {{
-                    if (data.length === 0) {{
-                        historyList.innerHTML = '<p style="color: #666; text-align: center;">暂无传输记录</p>';
-                    }} else {{
-                        historyList.innerHTML = data.map(item => 
-                            `<div class="history-item">
-                                <strong>${{item.filename}}</strong> 
-                                <span style="color: #666;">(来自: ${{item.from_ip}})</span>
-                                <span style="color: #666; float: right;">${{item.timestamp}}</span>
-                            </div>`
-                        ).join('');
-                    }}
-                }});
-        }}
-
-        // 页面加载时更新历史记录
-        updateHistory();
-        
-        // 每5秒更新一次历史记录
-        setInterval(updateHistory, 5000);
+                .then(response => {
+                    historyVersion = Number(response.headers.get('X-History-Version'));
+                    return response.json();
+                })
+                .then(data => {
+                    if (data.length === 0) {
+                        showEmptyHistory();
+                    } else {
+                        historyList.replaceChildren(...data.map(renderHistoryItem));
+                    }
+                });
+        }
+
+        function addHistoryItem(item) {
+            if (historyList.querySelector(`[data-id="${item.id}"]`)) return;
+            if (!historyList.querySelector('.history-item')) historyList.innerHTML = '';
+            historyList.appendChild(renderHistoryItem(item));
+        }
+
+        function removeHistoryItem(id) {
+            const element = historyList.querySelector(`[data-id="${id}"]`);
+            if (element) element.remove();
+            if (!historyList.querySelector('.history-item')) showEmptyHistory();
+        }
+
+        // 显示服务器正在接收的传输（包括其他设备发起的）
+        function showTransfer(progress) {
+            let element = document.getElementById('transfer-' + progress.transfer_id);
+            if (progress.done) {
+                if (element) element.remove();
+                return;
+            }
+            if (!element) {
+                element = document.createElement('div');
+                element.id = 'transfer-' + progress.transfer_id;
+                element.className = 'transfer-item';
+                transferList.appendChild(element);
+            }
+            const percent = progress.total ? Math.floor(progress.received / progress.total * 100) + '%' : '';
+            const rate = progress.rate ? (progress.rate / 1048576).toFixed(1) + ' MB/s' : '';
+            const eta = progress.eta != null && progress.rate ? `剩余 ${Math.ceil(progress.eta)} 秒` : '';
+            element.textContent = `正在接收 ${progress.filename || ''} (来自: ${progress.client_ip}) ${percent} ${rate} ${eta}`;
+        }
+
+        // 打开页面前已经开始的传输
+        fetch('/api/transfers')
+            .then(response => response.json())
+            .then(data => data.transfers.forEach(showTransfer));
+
+        // 设备信息和客户端 IP 通过一次小的 JSON 请求获取，页面本身是静态的
+        fetch('/api/server-info')
+            .then(response => response.json())
+            .then(info => {
+                document.getElementById('deviceName').textContent = info.name;
+                document.getElementById('clientIp').textContent = info.client_ip;
+                document.getElementById('serverIps').textContent = info.addresses.join(', ');
+            });
+
+        // 通过 SSE 接收历史记录和传输进度的推送，不支持时退回到定时轮询
+        if (window.EventSource) {
+            const events = new EventSource('/api/events');
+            events.addEventListener('reset', updateHistory);
+            events.addEventListener('history', e => addHistoryItem(JSON.parse(e.data)));
+            events.addEventListener('history-deleted', e => removeHistoryItem(JSON.parse(e.data).id));
+            events.addEventListener('history-cleared', showEmptyHistory);
+            events.addEventListener('progress', e => showTransfer(JSON.parse(e.data)));
+        } else {
+            updateHistory();
+            setInterval(updateHistory, 5000);
+        }
     </script>
 </body>
 </html>
-            """
+"""
+INDEX_PAGE = INDEX_HTML.encode('utf-8')
+INDEX_PAGE_GZIP = gzip.compress(INDEX_PAGE, compresslevel=9, mtime=0)
+INDEX_PAGE_ETAG = hashlib.blake2b(INDEX_PAGE, digest_size=8).hexdigest()
+
+class FileTransferHandler(BaseHTTPRequestHandler):
+    # 空闲连接的超时时间，避免慢速客户端长期占用连接名额
+    timeout = 120
+
+    def log_message(self, format, *args):
+        """重写日志方法，减少控制台输出"""
+        pass
+
+    def log_request(self, code='-', size='-'):
+        """记下响应状态码，供请求结束时计入指标"""
+        self.status_code = int(code) if str(code).isdigit() else None
+
+    def handle_one_request(self):
+        """处理一个请求，结束后记录请求数、耗时、接收的字节数和上传的分阶段耗时"""
+        self.command = None
+        self.status_code = None
+        self.body = None
+        trace = RequestTrace()
+        token = request_trace.set(trace)
+        try:
+            super().handle_one_request()
+        finally:
+            request_trace.reset(token)
+            if self.body is not None:
+                metrics.inc('localsend_active_transfers', -1)
+                metrics.inc('localsend_received_bytes_total', self.body.consumed())
+            if self.command:
+                route = route_label(self.path)
+                status = self.status_code or 0
+                metrics.inc('localsend_http_requests_total', method=self.command, route=route, status=status)
+                metrics.observe('localsend_http_request_duration_seconds', time.perf_counter() - trace.started,
+                                route=route)
+                is_upload = self.command in ('POST', 'PUT') and route.startswith(('/upload', '/api/upload'))
+                if is_upload and not 200 <= status < 400:
+                    metrics.inc('localsend_upload_errors_total', route=route, status=status)
+                if trace.stages:
+                    trace.finish(f'{self.command} {route}', status, self.client_address[0])
+    
+    def do_GET(self):
+        """处理GET请求"""
+        if self.path == '/':
+            self.send_index_page()
             
-            self.wfile.write(html_content.encode('utf-8'))
+        elif self.path == '/api/server-info':
+            self.send_json(200, {**server_identity.get(), 'client_ip': self.client_address[0],
+                                 'encodings': list(CONTENT_ENCODINGS)})
             
-        elif self.path == '/history':
+        elif self.session_route() is not None:
+            self.handle_session('GET', self.session_route())
+            
+        elif urllib.parse.urlsplit(self.path).path == '/api/events':
+            self.handle_events()
+            
+        elif self.path == '/api/files':
+            self.send_json(200, {'files': list_shared_files(get_desktop_path())})
+            
+        elif self.path == '/api/peers':
+            self.send_json(200, {'enabled': peer_discovery is not None,
+                                 'peers': peer_discovery.snapshot() if peer_discovery else []})
+            
+        elif self.path == '/api/transfers':
+            self.send_json(200, {'transfers': transfers.snapshot()})
+            
+        elif self.path.startswith('/api/download/'):
+            self.handle_download()
+            
+        elif self.path == '/api/admin/limits':
+            self.handle_admin_limits('GET')
+            
+        elif self.path == '/metrics':
+            body = metrics.render().encode('utf-8')
             self.send_response(200)
-            self.send_header('Content-type', 'application/json; charset=utf-8')
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
             self.end_headers()
-            self.wfile.write(json.dumps(transfer_history, ensure_ascii=False).encode('utf-8'))
+            self.wfile.write(body)
+            
+        elif urllib.parse.urlsplit(self.path).path == '/history':
+            # 可选参数：limit、before_id（翻页）、start/end（时间范围）、client（来源 IP）、since（增量）
+            query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+            version = transfer_history.version
+            etag = transfer_history.etag(version)
+            if etag in parse_etags(self.headers.get('If-None-Match')):
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+            try:
+                if 'since' in query:
+                    records = transfer_history.changes_since(
+                        int(query['since']),
+                        start=parse_time_param(query['start']) if 'start' in query else None,
+                        end=parse_time_param(query['end']) if 'end' in query else None,
+                        client_ip=query.get('client'))
+                else:
+                    records = transfer_history.query(
+                        limit=max(1, min(int(query.get('limit', 50)), MAX_HISTORY_PAGE)),
+                        before_id=int(query['before_id']) if 'before_id' in query else None,
+                        start=parse_time_param(query['start']) if 'start' in query else None,
+                        end=parse_time_param(query['end']) if 'end' in query else None,
+                        client_ip=query.get('client'))
+            except ValueError:
+                self.send_json(400, {'status': 'error', 'message': '查询参数无效'})
+                return
+            self.send_json(200, records, {'ETag': etag, 'Cache-Control': 'no-cache', 'X-History-Version': str(version)})
             
         else:
             self.send_response(404)
             self.end_headers()
 
+    def handle_events(self):
+        """SSE 事件流：推送历史记录的增删和进行中的上传进度，支持 Last-Event-ID 续传"""
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+        last_id = self.headers.get('Last-Event-ID') or query.get('last_event_id')
+        try:
+            last_id = int(last_id) if last_id else None
+        except ValueError:
+            last_id = None
+        self.close_connection = True
+        if not self.server.event_slots.acquire(blocking=False):
+            self.send_response(503)
+            self.send_header('Retry-After', '10')
+            self.end_headers()
+            return
+        try:
+            self.send_response(200)
+            self.send_header('Content-type', 'text/event-stream; charset=utf-8')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            self.wfile.write(b'retry: 3000\n\n')
+        except OSError:
+            self.server.event_slots.release()
+            return
+        # 之后的推送交给独立线程，本请求随即结束并归还连接数
+        self.server.detach(self.connection)
+        threading.Thread(target=self.server.stream_events, args=(self.connection, last_id),
+                         name='events', daemon=True).start()
+
+    def do_HEAD(self):
+        """处理HEAD请求（只返回网页和下载文件的响应头）"""
+        if self.path == '/':
+            self.send_index_page(head_only=True)
+        elif self.path.startswith('/api/download/'):
+            self.handle_download(head_only=True)
+        else:
+            self.send_response(405)
+            self.end_headers()
+
+    def send_index_page(self, head_only=False):
+        """发送预先渲染的网页，客户端支持时发送 gzip 压缩版本，ETag 未变时返回 304"""
+        compressed = accepts_encoding(self.headers.get('Accept-Encoding'), 'gzip')
+        etag = f'"{INDEX_PAGE_ETAG}-gzip"' if compressed else f'"{INDEX_PAGE_ETAG}"'
+        body = INDEX_PAGE_GZIP if compressed else INDEX_PAGE
+        not_modified = etag in parse_etags(self.headers.get('If-None-Match'))
+        self.send_response(304 if not_modified else 200)
+        if not not_modified:
+            self.send_header('Content-type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            if compressed:
+                self.send_header('Content-Encoding', 'gzip')
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        if not (head_only or not_modified):
+            self.wfile.write(body)
+
+    def handle_download(self, head_only=False):
+        """从保存目录发送文件，支持 Range 断点续传，优先用 sendfile 零拷贝发送；compress=1 时边读边压缩"""
+        url = urllib.parse.urlsplit(self.path)
+        filename = urllib.parse.unquote(url.path[len('/api/download/'):])
+        compress = dict(urllib.parse.parse_qsl(url.query)).get('compress', '').lower() in ('1', 'true', 'yes', 'on')
+        path = resolve_shared_file(get_desktop_path(), filename)
+        if path is None:
+            self.send_json(404, {'status': 'error', 'message': '文件不存在'})
+            return
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            size = st.st_size
+            etag = file_etag(st)
+            # If-Range 与当前文件不一致时文件已经变化，忽略 Range 发送完整文件
+            range_header = self.headers.get('Range')
+            if not if_range_matches(self.headers.get('If-Range'), etag, st.st_mtime):
+                range_header = None
+            try:
+                byte_range = parse_range_header(range_header, size)
+            except ValueError:
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            start, end = byte_range or (0, size)
+            # 客户端要求压缩、请求整个文件且内容可压缩时，按客户端接受的编码边读边压缩
+            encoding = None
+            if compress and not byte_range and size >= MIN_COMPRESS_SIZE and is_compressible(filename):
+                encoding = choose_encoding(self.headers.get('Accept-Encoding'))
+            if encoding:
+                self.send_compressed(f, filename, encoding, head_only)
+                return
+            self.send_response(206 if byte_range else 200)
+            self.send_header('Content-type', 'application/octet-stream')
+            self.send_header('Content-Disposition', f"attachment; filename*=UTF-8''{urllib.parse.quote(filename)}")
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', format_http_date(st.st_mtime))
+            self.send_header('Content-Length', str(end - start))
+            if byte_range:
+                self.send_header('Content-Range', f'bytes {start}-{end - 1}/{size}')
+            self.end_headers()
+            if head_only or end == start:
+                return
+            # socket.sendfile 在支持的平台上调用 os.sendfile，否则退回到分块 send
+            self.wfile.flush()
+            self.connection.sendfile(f, start, end - start)
+
+    def send_compressed(self, f, filename, encoding, head_only=False):
+        """压缩后的长度事先未知，不发送 Content-Length，发送完毕后关闭连接"""
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-type', 'application/octet-stream')
+        self.send_header('Content-Disposition', f"attachment; filename*=UTF-8''{urllib.parse.quote(filename)}")
+        self.send_header('Content-Encoding', encoding)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        if head_only:
+            return
+        encoder = new_encoder(encoding)
+        while True:
+            data = f.read(COMPRESS_CHUNK_SIZE)
+            if not data:
+                break
+            compressed = encoder.compress(data)
+            if compressed:
+                self.wfile.write(compressed)
+        self.wfile.write(encoder.flush())
+
     def do_POST(self):
         """处理POST请求（文件上传）"""
-        if self.path == '/upload':
+        if self.session_route() is not None:
+            self.handle_session('POST', self.session_route())
+        elif self.path == '/api/preflight':
+            self.handle_preflight()
+        elif self.path == '/upload' or urllib.parse.urlsplit(self.path).path == '/api/upload/archive':
+            # 限制同时进行的上传数量，超出时排队等待
+            if not self.server.upload_slots.acquire(timeout=UPLOAD_SLOT_TIMEOUT):
+                # 请求体没有读取，连接不能再复用
+                self.close_connection = True
+                self.send_response(503)
+                self.send_header('Retry-After', '5')
+                self.end_headers()
+                return
             try:
-                # 解析multipart/form-data
-                content_type = self.headers.get('Content-Type')
-                if not content_type or not content_type.startswith('multipart/form-data'):
-                    self.send_response(400)
+                if self.path == '/upload':
+                    self.handle_upload()
+                else:
+                    self.handle_archive_upload()
+            finally:
+                self.server.upload_slots.release()
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+    def do_PUT(self):
+        """处理PUT请求（上传分块）"""
+        if self.session_route() is not None:
+            self.handle_session('PUT', self.session_route())
+        elif self.path == '/api/admin/limits':
+            self.handle_admin_limits('PUT')
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+    def do_DELETE(self):
+        """处理DELETE请求（取消分块上传、删除历史记录）"""
+        if self.session_route() is not None:
+            self.handle_session('DELETE', self.session_route())
+        elif self.path == '/history':
+            transfer_history.clear()
+            event_bus.publish('history-cleared', {})
+            self.send_json(200, {'status': 'success', 'message': '历史记录已清空'})
+        elif re.fullmatch(r'/history/\d+', self.path):
+            item_id = int(self.path.rsplit('/', 1)[1])
+            if transfer_history.delete(item_id):
+                event_bus.publish('history-deleted', {'id': item_id})
+                self.send_json(200, {'status': 'success', 'message': '历史记录已删除'})
+            else:
+                self.send_json(404, {'status': 'error', 'message': '历史记录不存在'})
+        else:
+            self.send_response(404)
+            self.end_headers()
+
+    def send_json(self, status, data, headers=None):
+        """发送 JSON 响应"""
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def request_body(self, transfer_key=None, transfer_size=None):
+        """按 Content-Length 和 Content-Encoding 包装请求体，读取时受带宽调度器限速
+
+        transfer_key 和 transfer_size 标识请求所属的传输（如上传会话及其文件大小），默认为这个请求本身
+        """
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            raise UploadSessionError(400, 'Content-Length 无效')
+        if length < 0:
+            raise UploadSessionError(400, 'Content-Length 无效')
+        flow = transfer_scheduler.flow(transfer_key or uuid.uuid4().hex, self.client_address[0],
+                                       length if transfer_size is None else transfer_size)
+        body = RequestBody(self.rfile, length, self.headers.get('Content-Encoding'), flow)
+        if self.body is None:
+            metrics.inc('localsend_active_transfers')
+        self.body = body
+        return body
+
+    def read_json(self):
+        """读取 JSON 请求体，必须是对象"""
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            raise UploadSessionError(400, 'Content-Length 无效')
+        if length < 0:
+            raise UploadSessionError(400, 'Content-Length 无效')
+        if length > MAX_JSON_BODY_SIZE:
+            raise UploadSessionError(413, '请求体过大')
+        try:
+            data = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            raise UploadSessionError(400, '请求体不是有效的 JSON')
+        if not isinstance(data, dict):
+            raise UploadSessionError(400, '请求体必须是 JSON 对象')
+        return data
+
+    def is_admin(self):
+        """管理接口只接受本机访问，或者带有 LOCALSEND_ADMIN_TOKEN 令牌的请求"""
+        if ipaddress.ip_address(self.client_address[0]).is_loopback:
+            return True
+        authorization = self.headers.get('Authorization') or ''
+        return bool(ADMIN_TOKEN) and hmac.compare_digest(authorization.encode(), f'Bearer {ADMIN_TOKEN}'.encode())
+
+    def handle_admin_limits(self, method):
+        """查看或调整上传限速
+
+        PUT 请求体 {rate, client_rate, clients: {IP: 速率}}，字段均可省略（或为 null）；速率为字节/秒，
+        可写成 "10M" 之类的字符串，0 表示不限速；clients 中速率为 null 时删除该客户端的单独设置
+        """
+        try:
+            if not self.is_admin():
+                raise UploadSessionError(403, '只允许本机访问管理接口')
+            if method == 'PUT':
+                data = self.read_json()
+                clients = data.get('clients') or {}
+                if not isinstance(clients, dict):
+                    raise UploadSessionError(400, 'clients 必须是对象')
+                try:
+                    for client_ip in clients:
+                        ipaddress.ip_address(client_ip)
+                    transfer_scheduler.configure(
+                        rate=None if data.get('rate') is None else parse_rate(data['rate']),
+                        client_rate=None if data.get('client_rate') is None else parse_rate(data['client_rate']),
+                        clients={ip: None if rate is None else parse_rate(rate) for ip, rate in clients.items()})
+                except ValueError as e:
+                    raise UploadSessionError(400, str(e))
+            self.send_json(200, transfer_scheduler.limits())
+        except UploadSessionError as e:
+            self.send_json(e.status, {'status': 'error', 'message': str(e)})
+
+    def handle_preflight(self):
+        """上传前查询接收方已有哪些文件
+
+        请求体 {files: [{filename, size, digest}], materialize: bool}。已有内容相同的文件时返回 exists，
+        客户端可以跳过上传；materialize 为 true 且已有文件名字不同时，用硬链接（或复制）生成同名文件
+        """
+        try:
+            data = self.read_json()
+            files = data.get('files')
+            if not isinstance(files, list):
+                raise UploadSessionError(400, 'files 必须是列表')
+            desktop_path = get_desktop_path()
+            results = []
+            for item in files:
+                try:
+                    filename = os.path.basename(item.get('filename') or '')
+                    size = int(item['size'])
+                    algorithm, hexdigest = parse_digest(item['digest'])
+                except (AttributeError, KeyError, TypeError, ValueError) as e:
+                    raise UploadSessionError(400, f'文件信息无效: {e}')
+                existing = hash_index.lookup(desktop_path, size, algorithm, hexdigest, prefer=filename)
+                result = {'filename': filename, 'exists': existing is not None, 'existing': existing}
+                if existing and data.get('materialize') and filename and existing != filename:
+                    # 先在临时文件上生成硬链接（或副本），再原子地发布
+                    source_path = os.path.join(desktop_path, existing)
+                    temp_path = staging_path(desktop_path)
+                    try:
+                        try:
+                            os.link(source_path, temp_path)
+                        except OSError:
+                            shutil.copyfile(source_path, temp_path)
+                        target_path = commit_file(desktop_path, filename, temp_path)
+                    except OSError as e:
+                        # 已有文件可能刚被删除或无法复制，让客户端照常上传这一个文件
+                        remove_quietly(temp_path)
+                        result.update(exists=False, error=f'生成同名文件失败: {e}')
+                        results.append(result)
+                        continue
+                    digest = f'{algorithm}:{hexdigest}'
+                    hash_index.record(target_path, digest)
+                    add_to_history(os.path.basename(target_path), self.client_address[0], size, digest)
+                    result['saved_as'] = os.path.basename(target_path)
+                results.append(result)
+            self.send_json(200, {'results': results})
+        except UploadSessionError as e:
+            self.close_connection = True
+            self.send_json(e.status, {'status': 'error', 'message': str(e)})
+
+    def session_route(self):
+        """解析 /api/upload/session[/<id>[/...]]，不是会话接口时返回 None"""
+        parts = urllib.parse.urlsplit(self.path).path.strip('/').split('/')
+        if parts[:3] != ['api', 'upload', 'session']:
+            return None
+        return parts[3:]
+
+    def handle_session(self, method, route):
+        """处理分块上传会话接口
+
+        POST   /api/upload/session                      创建会话 {filename, size, chunk_size, digest}
+        PUT    /api/upload/session/<id>/chunk/<index>   上传一个分块（请求体为原始数据）
+        PUT    /api/upload/session/<id>                 按 Content-Range 上传任意字节区间
+        GET    /api/upload/session/<id>                 查询已保存的区间和缺失的分块
+        POST   /api/upload/session/<id>/complete        所有分块到齐后生成最终文件
+        DELETE /api/upload/session/<id>                 取消会话
+        """
+        try:
+            if method == 'POST' and not route:
+                data = self.read_json()
+                try:
+                    size = int(data.get('size', -1))
+                    chunk_size = int(data.get('chunk_size') or DEFAULT_SESSION_CHUNK_SIZE)
+                except (TypeError, ValueError):
+                    raise UploadSessionError(400, '文件大小或分块大小无效')
+                try:
+                    expected_digest = parse_digest(data['digest']) if data.get('digest') else None
+                except ValueError as e:
+                    raise UploadSessionError(400, str(e))
+                session = upload_sessions.create(get_desktop_path(), data.get('filename'), size,
+                                                 chunk_size, self.client_address[0], expected_digest)
+                self.send_json(201, session.to_dict())
+            elif method == 'GET' and len(route) == 1:
+                self.send_json(200, upload_sessions.get(route[0]).to_dict())
+            elif method == 'PUT' and len(route) == 3 and route[1] == 'chunk':
+                session = upload_sessions.get(route[0])
+                try:
+                    index = int(route[2])
+                except ValueError:
+                    raise UploadSessionError(400, '分块编号无效')
+                if self.headers.get('Content-Length') is None:
+                    raise UploadSessionError(411, '缺少 Content-Length')
+                body = self.request_body(session.session_id, session.size)
+                if not self.server.upload_slots.acquire(timeout=UPLOAD_SLOT_TIMEOUT):
+                    # 请求体没有读取，连接不能再复用
+                    self.close_connection = True
+                    self.send_response(503)
+                    self.send_header('Retry-After', '5')
+                    self.end_headers()
+                    return
+                try:
+                    session.write_chunk(index, body)
+                finally:
+                    self.server.upload_slots.release()
+                self.send_json(200, {'index': index, 'received_bytes': session.received_bytes()})
+            elif method == 'PUT' and len(route) == 1:
+                # 按 Content-Range 写入任意字节区间，多个连接可并发写入同一个文件
+                session = upload_sessions.get(route[0])
+                content_range = parse_content_range(self.headers.get('Content-Range'))
+                if content_range is None:
+                    raise UploadSessionError(400, '缺少或无效的 Content-Range')
+                start, end, total = content_range
+                if total is not None and total != session.size:
+                    raise UploadSessionError(416, f'文件总大小应为 {session.size} 字节')
+                body = self.request_body(session.session_id, session.size)
+                # 压缩的请求体长度与区间长度无关，由 write_range 检查解压后的长度
+                if not body.encoded and body.length != end - start:
+                    raise UploadSessionError(400, 'Content-Length 与 Content-Range 不一致')
+                if not self.server.upload_slots.acquire(timeout=UPLOAD_SLOT_TIMEOUT):
+                    # 请求体没有读取，连接不能再复用
+                    self.close_connection = True
+                    self.send_response(503)
+                    self.send_header('Retry-After', '5')
                     self.end_headers()
                     return
+                try:
+                    session.write_range(start, body, end - start)
+                finally:
+                    self.server.upload_slots.release()
+                self.send_json(200, {'start': start, 'end': end, 'received_bytes': session.received_bytes()})
+            elif method == 'POST' and len(route) == 2 and route[1] == 'complete':
+                session = upload_sessions.complete(route[0])
+                target_path = session.finalize()
+                filename = os.path.basename(target_path)
+                digest = format_digest(session.hasher)
+                hash_index.record(target_path, digest)
+                add_to_history(filename, session.client_ip, session.size, digest)
+                self.send_json(200, {
+                    'status': 'success',
+                    'message': f'文件 {filename} 已保存',
+                    'filename': filename,
+                    'size': session.size,
+                    'digest': digest
+                })
+            elif method == 'DELETE' and len(route) == 1:
+                upload_sessions.pop(route[0]).discard()
+                self.send_json(200, {'status': 'success', 'message': '上传会话已取消'})
+            else:
+                self.send_json(404, {'status': 'error', 'message': '接口不存在'})
+        except UploadSessionError as e:
+            # 出错时请求体可能没有读完，关闭连接避免残留数据被当作下一个请求
+            self.close_connection = True
+            self.send_json(e.status, {'status': 'error', 'message': str(e)})
+        except Exception as e:
+            print(f"上传错误: {e}")
+            self.close_connection = True
+            self.send_json(500, {'status': 'error', 'message': f'上传失败: {str(e)}'})
 
-                # 解析上传的文件
-                form = cgi.FieldStorage(
-                    fp=self.rfile,
-                    headers=self.headers,
-                    environ={
-                        'REQUEST_METHOD': 'POST',
-                        'CONTENT_TYPE': content_type,
-                    }
-                )
+    def handle_upload(self):
+        """处理 /upload 的 multipart 文件上传"""
+        progress = None
+        try:
+            # 解析multipart/form-data
+            content_type, options = parse_header_params('content-type', self.headers.get('Content-Type', ''))
+            boundary = options.get('boundary')
+            if content_type != 'multipart/form-data' or not boundary:
+                self.send_response(400)
+                self.end_headers()
+                return
 
-                desktop_path = get_desktop_path()
-                client_ip = self.client_address[0]
-                
-                uploaded_files = []
-                
-                if 'files' in form:
-                    files = form['files']
-                    if not isinstance(files, list):
-                        files = [files]
-                    
-                    for file_item in files:
-                        if file_item.filename:
-                            # 安全的文件名处理
-                            safe_filename = os.path.basename(file_item.filename)
-                            if not safe_filename:
-                                continue
-                            
-                            # 目标文件路径
-                            target_path = os.path.join(desktop_path, safe_filename)
-                            
-                            # 如果文件已存在，添加数字后缀
-                            counter = 1
-                            original_target = target_path
-                            while os.path.exists(target_path):
-                                name, ext = os.path.splitext(original_target)
-                                target_path = f"{name}({counter}){ext}"
-                                counter += 1
-                            
-                            # 保存文件
-                            with open(target_path, 'wb') as f:
-                                f.write(file_item.file.read())
-                            
-                            uploaded_files.append(safe_filename)
-                            
-                            # 添加到传输历史
-                            transfer_history.append({
-                                'filename': safe_filename,
-                                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
-                                'from_ip': client_ip,
-                                'size': os.path.getsize(target_path)
-                            })
-                
-                # 保持历史记录在合理数量内
-                if len(transfer_history) > 50:
-                    transfer_history[:] = transfer_history[-50:]
-                
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json; charset=utf-8')
+            content_length = self.headers.get('Content-Length')
+            if content_length is None:
+                self.send_response(411)
                 self.end_headers()
+                return
+
+            # 边读边解析（请求体压缩时边读边解压），文件内容直接分块写入目标位置
+            body = self.request_body()
+            reader = MultipartReader(body, boundary.encode('latin-1'))
+
+            desktop_path = get_desktop_path()
+            client_ip = self.client_address[0]
+            progress = ProgressReporter(None, int(content_length), client_ip)
+            
+            uploaded_files = []
+            digests = {}
+            failed_files = []
+            # 可选的 digests 字段（JSON：文件名 -> "算法:摘要"），需放在文件之前
+            expected_digests = {}
+            trace = current_trace()
+            
+            while True:
+                t = time.perf_counter()
+                part = reader.next_part()
+                trace.add('parse', t)
+                if part is None:
+                    break
+                if part.name == 'digests' and not part.filename:
+                    raw = b''
+                    for chunk in reader.iter_chunks():
+                        raw += chunk
+                        if len(raw) > MAX_JSON_BODY_SIZE:
+                            raise MultipartError('digests 字段过长')
+                    try:
+                        expected_digests = {name: parse_digest(value) for name, value in json.loads(raw).items()}
+                    except (ValueError, AttributeError) as e:
+                        raise MultipartError(f'digests 字段无效: {e}')
+                    continue
+                if part.name != 'files' or not part.filename:
+                    continue
+
+                # 安全的文件名处理
+                safe_filename = os.path.basename(part.filename)
+                if not safe_filename:
+                    continue
                 
-                response = {
-                    'status': 'success',
-                    'message': f'成功上传 {len(uploaded_files)} 个文件',
-                    'files': uploaded_files
-                }
-                self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8'))
+                # 保存到隐藏的临时文件，同时增量计算摘要；出错时删除临时文件
+                expected = expected_digests.get(part.filename) or expected_digests.get(safe_filename)
+                hasher = new_hasher(expected)
+                size = 0
+                progress.filename = safe_filename
+                f, temp_path = create_staging_file(desktop_path)
+                try:
+                    with f:
+                        t = time.perf_counter()
+                        for chunk in reader.iter_chunks():
+                            t = trace.add('parse', t)
+                            f.write(chunk)
+                            t = trace.add('write', t)
+                            if hasher:
+                                hasher.update(chunk)
+                                t = trace.add('hash', t)
+                            size += len(chunk)
+                            progress.update(body.consumed())
+                        trace.add('parse', t)
+                        f.finish()
+                except BaseException:
+                    remove_quietly(temp_path)
+                    raise
+                digest = format_digest(hasher)
                 
-            except Exception as e:
-                print(f"上传错误: {e}")
-                self.send_response(500)
-                self.send_header('Content-type', 'application/json; charset=utf-8')
-                self.end_headers()
+                # 摘要不一致说明传输出错，删除文件
+                if expected and hasher.hexdigest() != expected[1]:
+                    os.remove(temp_path)
+                    failed_files.append(safe_filename)
+                    continue
                 
-                response = {
+                # 写完后再以不重名的最终名字发布，重名时自动添加数字后缀
+                target_path = commit_file(desktop_path, safe_filename, temp_path)
+                saved_name = os.path.basename(target_path)
+                uploaded_files.append(saved_name)
+                if digest:
+                    digests[saved_name] = digest
+                hash_index.record(target_path, digest)
+                
+                # 添加到传输历史
+                add_to_history(saved_name, client_ip, size, digest)
+            
+            progress.finish(not failed_files)
+            if failed_files:
+                self.send_json(422, {
                     'status': 'error',
-                    'message': f'上传失败: {str(e)}'
-                }
-                self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8'))
+                    'message': f'{len(failed_files)} 个文件校验失败',
+                    'files': uploaded_files,
+                    'failed': failed_files,
+                    'digests': digests
+                })
+                return
+            
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json; charset=utf-8')
+            self.end_headers()
+            
+            response = {
+                'status': 'success',
+                'message': f'成功上传 {len(uploaded_files)} 个文件',
+                'files': uploaded_files,
+                'digests': digests
+            }
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8'))
+            
+        except UploadSessionError as e:
+            # 不支持或损坏的 Content-Encoding
+            if progress:
+                progress.finish(False)
+            self.close_connection = True
+            self.send_json(e.status, {'status': 'error', 'message': f'上传失败: {e}'})
+            
+        except MultipartError as e:
+            print(f"上传错误: {e}")
+            if progress:
+                progress.finish(False)
+            self.send_response(400)
+            self.send_header('Content-type', 'application/json; charset=utf-8')
+            self.end_headers()
+            
+            response = {
+                'status': 'error',
+                'message': f'上传失败: {str(e)}'
+            }
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8'))
+            
+        except Exception as e:
+            print(f"上传错误: {e}")
+            if progress:
+                progress.finish(False)
+            self.send_response(500)
+            self.send_header('Content-type', 'application/json; charset=utf-8')
+            self.end_headers()
+            
+            response = {
+                'status': 'error',
+                'message': f'上传失败: {str(e)}'
+            }
+            self.wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8'))
+
+    def handle_archive_upload(self):
+        """处理 /api/upload/archive?name=文件夹名 的文件夹上传
+
+        请求体是 tar 流（可以是 .tar.gz 等，也可以带 Content-Encoding），边接收边解压到桌面上的同名文件夹，
+        保留目录结构；成千上万个小文件只需要一个请求
+        """
+        progress = None
+        try:
+            query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+            folder_name = os.path.basename(query.get('name', '').replace('\\', '/').rstrip('/'))
+            if folder_name in ('', '.', '..'):
+                raise UploadSessionError(400, '缺少文件夹名称 name')
+            if self.headers.get('Content-Length') is None:
+                raise UploadSessionError(411, '缺少 Content-Length')
+            body = self.request_body()
+            client_ip = self.client_address[0]
+            progress = ProgressReporter(folder_name, body.length, client_ip)
+            target_path, files, size, skipped = extract_archive(
+                body, get_desktop_path(), folder_name, lambda: progress.update(body.consumed()))
+            saved_name = os.path.basename(target_path)
+            add_to_history(saved_name, client_ip, size, count_file=False)
+            progress.finish(True)
+            self.send_json(200, {
+                'status': 'success',
+                'message': f'成功接收文件夹 {saved_name}（{files} 个文件）',
+                'folder': saved_name,
+                'files': files,
+                'size': size,
+                'skipped': skipped
+            })
+        except (UploadSessionError, ArchiveError) as e:
+            if progress:
+                progress.finish(False)
+            # 请求体可能没有读完
+            self.close_connection = True
+            status = e.status if isinstance(e, UploadSessionError) else 400
+            self.send_json(status, {'status': 'error', 'message': f'上传失败: {e}'})
+        except Exception as e:
+            print(f"上传错误: {e}")
+            if progress:
+                progress.finish(False)
+            self.close_connection = True
+            self.send_json(500, {'status': 'error', 'message': f'上传失败: {e}'})
+
+class PooledHTTPServer(ThreadingHTTPServer):
+    """使用有界线程池并发处理请求的 HTTP 服务器"""
+    daemon_threads = True
+
+    def __init__(self, server_address, handler_class, max_connections=DEFAULT_MAX_CONNECTIONS,
+                 max_uploads=DEFAULT_MAX_UPLOADS):
+        super().__init__(server_address, handler_class)
+        # 连接数达到上限时暂停 accept，由内核 backlog 缓冲新连接，等待过久的连接回复 503
+        self.connection_slots = threading.BoundedSemaphore(max_connections)
+        self.upload_slots = threading.BoundedSemaphore(max_uploads)
+        self.event_slots = threading.BoundedSemaphore(MAX_EVENT_STREAMS)
+        self.executor = ThreadPoolExecutor(max_workers=max_connections, thread_name_prefix='transfer')
+        # 交给独立线程继续使用的连接，请求处理完后不关闭
+        self.detached = set()
+        self.detached_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        """把请求交给线程池处理；CONNECTION_SLOT_TIMEOUT 秒内没有空闲名额时回复 503"""
+        if not self.connection_slots.acquire(timeout=CONNECTION_SLOT_TIMEOUT):
+            self.reject_request(request)
+            return
+        try:
+            self.executor.submit(self._process_pooled, request, client_address)
+        except RuntimeError:
+            # 线程池已关闭
+            self.connection_slots.release()
+            self.shutdown_request(request)
+
+    def reject_request(self, request):
+        """不读取请求，直接回复 503 并关闭连接（在 accept 线程中执行，发送超时很短）"""
+        try:
+            request.settimeout(1)
+            request.sendall(BUSY_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def _process_pooled(self, request, client_address):
+        try:
+            self.process_request_thread(request, client_address)
+        finally:
+            self.connection_slots.release()
+
+    def detach(self, request):
+        """请求处理完后保留连接，由调用方负责关闭"""
+        with self.detached_lock:
+            self.detached.add(request)
+
+    def shutdown_request(self, request):
+        with self.detached_lock:
+            if request in self.detached:
+                return
+        super().shutdown_request(request)
+
+    def stream_events(self, sock, last_id):
+        """在独立线程中向已发送响应头的连接推送 SSE 事件，直到客户端断开或服务关闭"""
+        try:
+            while not event_bus.closed:
+                events = event_bus.wait(last_id, SSE_KEEPALIVE)
+                if events:
+                    last_id = events[-1][0]
+                    payload = ''.join(f'id: {event_id}\nevent: {event_type}\ndata: {data}\n\n'
+                                      for event_id, event_type, data in events)
+                else:
+                    payload = ': keepalive\n\n'
+                sock.sendall(payload.encode('utf-8'))
+        except OSError:
+            # 客户端断开连接
+            pass
+        finally:
+            with self.detached_lock:
+                self.detached.discard(sock)
+            super().shutdown_request(sock)
+            self.event_slots.release()
+
+    def server_close(self):
+        event_bus.close()
+        server_identity.close()
+        super().server_close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
-def start_server(preferred_port=8888):
+def start_server(preferred_port=8888, max_connections=DEFAULT_MAX_CONNECTIONS, max_uploads=DEFAULT_MAX_UPLOADS,
+                 discovery=True, host=''):
     """启动文件传输服务器"""
+    global peer_discovery
     # 查找可用端口
     port = find_available_port(preferred_port)
     if port is None:
         print("❌ 无法找到可用端口，请检查网络设置")
         return
     
-    server_address = ('', port)
-    httpd = HTTPServer(server_address, FileTransferHandler)
+    server_address = (host, port)
+    httpd = PooledHTTPServer(server_address, FileTransferHandler, max_connections, max_uploads)
     
-    local_ip = get_local_ip()
-    device_name = get_device_name()
+    identity = server_identity.get()
     desktop_path = get_desktop_path()
+    upload_sessions.start(desktop_path)
+    if discovery:
+        try:
+            peer_discovery = PeerDiscovery(port, server_identity, 'main', DISCOVERY_CAPABILITIES).start()
+        except OSError as e:
+            print(f"⚠️ 局域网发现未启用: {e}")
     
     print("=" * 60)
     print("🚀 文件传输服务已启动!")
     print("=" * 60)
-    print(f"📱 设备名称: {device_name}")
-    print(f"🌐 服务器地址: http://{local_ip}:{port}")
+    print(f"📱 设备名称: {identity['name']}")
+    # 服务器只监听 IPv4
+    for address in identity['addresses']:
+        if ':' not in address:
+            print(f"🌐 服务器地址: http://{address}:{port}")
     print(f"📁 文件保存位置: {desktop_path}")
+    print(f"🔀 并发限制: {max_connections} 个连接 / {max_uploads} 个上传")
+    limits = transfer_scheduler.limits()
+    if limits['rate'] or limits['client_rate']:
+        print(f"🚦 上传限速: 合计 {format_rate(limits['rate'])} / 每个客户端 {format_rate(limits['client_rate'])}"
+              f"（可通过 /api/admin/limits 调整）")
+    if peer_discovery:
+        print(f"📡 局域网发现: {DISCOVERY_GROUP}:{DISCOVERY_PORT}（其他设备见 /api/peers）")
     print("=" * 60)
     print("📋 使用说明:")
     print("1. 在其他设备的浏览器中打开上述地址")
@@ -519,7 +2342,33 @@ def start_server(preferred_port=8888):
         httpd.serve_forever()
     except KeyboardInterrupt:
         print("\n\n🛑 服务已停止")
+        if peer_discovery:
+            peer_discovery.close()
+        upload_sessions.close()
         httpd.server_close()
 
 # 启动服务
-start_server()
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="局域网文件传输服务")
+    parser.add_argument('--host', default='', help='监听地址（默认所有网卡，127.0.0.1 表示只允许本机访问）')
+    parser.add_argument('--port', type=int, default=8888, help='首选端口（被占用时自动顺延）')
+    parser.add_argument('--max-connections', type=int, default=DEFAULT_MAX_CONNECTIONS, help='同时处理的最大连接数')
+    parser.add_argument('--max-uploads', type=int, default=DEFAULT_MAX_UPLOADS, help='同时进行的最大上传数')
+    parser.add_argument('--hash', choices=HASH_ALGORITHMS + ('none',), default=hash_algorithm,
+                        help='写入时计算的内容摘要算法（客户端提供期望摘要时使用其算法）')
+    parser.add_argument('--no-discovery', action='store_true', help='不通过组播公告本机、不发现其他设备')
+    parser.add_argument('--rate-limit', type=parse_rate, default=0,
+                        help='所有上传合计的速率上限（字节/秒，可写成 10M 等，默认不限速）')
+    parser.add_argument('--client-rate-limit', type=parse_rate, default=0,
+                        help='每个客户端的上传速率上限（字节/秒，可写成 10M 等，默认不限速）')
+    parser.add_argument('--write-mode', choices=WRITE_MODES,
+                        default=os.environ.get('LOCALSEND_WRITE_MODE', 'fast'),
+                        help='写入模式：fast 不 fsync；safe 发布前 fsync；bulk 预分配、对齐大块写入并丢弃页缓存'
+                             '（默认取环境变量 LOCALSEND_WRITE_MODE，否则为 fast）')
+    args = parser.parse_args()
+    if args.write_mode not in WRITE_MODES:
+        parser.error(f'无效的写入模式: {args.write_mode}')
+    hash_algorithm = None if args.hash == 'none' else args.hash
+    set_write_mode(args.write_mode)
+    transfer_scheduler.configure(rate=args.rate_limit, client_rate=args.client_rate_limit)
+    start_server(args.port, args.max_connections, args.max_uploads, not args.no_discovery, args.host)
@@ -0,0 +1,563 @@
+# 命令行发送端：把文件或文件夹发送到运行中的 main.py / backend/main.py，或通过组播发现的设备
+import os
+import sys
+import json
+import time
+import gzip
+import uuid
+import socket
+import hashlib
+import tarfile
+import argparse
+import threading
+import http.client
+import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# 只给出主机名时使用的端口（main.py 的默认端口）
+DEFAULT_PORT = 8888
+
+# 分块上传：分块大小、并行连接数，以及每个分块的最多尝试次数
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+DEFAULT_STREAMS = 4
+CHUNK_RETRIES = 4
+
+# 单个请求的超时时间（秒）
+REQUEST_TIMEOUT = 60
+
+# 发送文件夹和计算摘要时每次读取的块大小
+READ_BLOCK_SIZE = 1024 * 1024
+
+# 断点续传记录的保存位置（与服务器状态目录相同）
+STATE_DIR = os.environ.get('LOCALSEND_STATE_DIR') or os.path.join(os.path.expanduser('~'), '.localsend')
+STATE_PATH = os.path.join(STATE_DIR, 'send-state.json')
+
+# 局域网发现（与 main.py 的协议相同）
+DISCOVERY_GROUP = os.environ.get('LOCALSEND_DISCOVERY_GROUP', '224.0.0.167')
+DISCOVERY_PORT = int(os.environ.get('LOCALSEND_DISCOVERY_PORT', 53317))
+DISCOVERY_PROTOCOL = 'localsend-lite/1'
+MAX_ANNOUNCE_SIZE = 4096
+
+# 压缩分块：已压缩的格式直接发送，压缩后不小于原大小的这个比例时停止压缩该文件
+COMPRESSED_EXTENSIONS = frozenset((
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.heif', '.avif',
+    '.mp4', '.mov', '.mkv', '.avi', '.webm', '.m4v', '.mp3', '.aac', '.m4a', '.ogg', '.opus', '.flac',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar', '.apk', '.jar',
+    '.docx', '.xlsx', '.pptx', '.pdf', '.woff', '.woff2',
+))
+MIN_COMPRESS_RATIO = 0.9
+
+# 进度的刷新间隔，以及计算速度时使用的时间窗口（秒）
+PROGRESS_INTERVAL = 0.5
+SPEED_WINDOW = 5
+
+# 退出码：2 由 argparse 用于参数错误
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_INTEGRITY = 3
+
+class TransferError(Exception):
+    """接收端返回错误或连接失败"""
+
+class IntegrityError(TransferError):
+    """接收端收到的内容与本地不一致"""
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f'{size:.1f} {unit}' if unit != 'B' else f'{size:.0f} B'
+        size /= 1024
+    return f'{size:.1f} TB'
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    return f'{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+class Progress:
+    """汇总所有连接的发送字节数，定时在终端的同一行显示进度、速度和剩余时间"""
+    def __init__(self, total, stream=sys.stderr):
+        self.total = total
+        self.sent = 0
+        self.started = time.monotonic()
+        self.samples = deque([(self.started, 0)])
+        self.lock = threading.Lock()
+        self.stream = stream
+        self.enabled = stream.isatty()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='progress', daemon=True)
+        if self.enabled:
+            self.thread.start()
+
+    def add(self, size):
+        with self.lock:
+            self.sent += size
+
+    def speed(self):
+        """最近 SPEED_WINDOW 秒内的平均速度"""
+        now = time.monotonic()
+        with self.lock:
+            self.samples.append((now, self.sent))
+            while len(self.samples) > 2 and now - self.samples[0][0] > SPEED_WINDOW:
+                self.samples.popleft()
+            (first_time, first_sent), (last_time, last_sent) = self.samples[0], self.samples[-1]
+        return (last_sent - first_sent) / (last_time - first_time) if last_time > first_time else 0.0
+
+    def render(self):
+        speed = self.speed()
+        percent = self.sent / self.total * 100 if self.total else 100.0
+        eta = format_duration((self.total - self.sent) / speed) if speed > 0 and self.total >= self.sent else '--:--:--'
+        return (f'{percent:5.1f}%  {format_size(self.sent)} / {format_size(self.total)}  '
+                f'{format_size(speed)}/s  ETA {eta}')
+
+    def write_line(self, line):
+        """在进度行上方输出一行"""
+        if self.enabled:
+            self.stream.write('\r\033[K')
+        print(line, flush=True)
+
+    def run(self):
+        while not self.stop_event.wait(PROGRESS_INTERVAL):
+            self.stream.write('\r\033[K' + self.render())
+            self.stream.flush()
+
+    def close(self):
+        self.stop_event.set()
+        if self.enabled:
+            self.thread.join()
+            self.stream.write('\r\033[K')
+        elapsed = time.monotonic() - self.started
+        average = self.sent / elapsed if elapsed > 0 else 0.0
+        print(f'共发送 {format_size(self.sent)}，用时 {elapsed:.1f} 秒，平均 {format_size(average)}/s', file=self.stream)
+
+class Client:
+    """与接收端通信；每个线程使用各自的 HTTP 连接（接收端关闭连接后下次请求自动重连）"""
+    def __init__(self, base_url, timeout=REQUEST_TIMEOUT):
+        parts = urllib.parse.urlsplit(base_url)
+        self.base_url = base_url
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connection(self):
+        if getattr(self.local, 'conn', None) is None:
+            self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self.local.conn
+
+    def reset(self):
+        conn, self.local.conn = getattr(self.local, 'conn', None), None
+        if conn:
+            conn.close()
+
+    def request(self, method, path, body=None, headers=None):
+        """发送请求，返回 (状态码, JSON 响应)；连接出错时重连重试一次"""
+        for attempt in (1, 2):
+            try:
+                conn = self.connection()
+                conn.request(method, path, body=body, headers=headers or {})
+                response = conn.getresponse()
+                raw = response.read()
+                if response.will_close:
+                    self.reset()
+                break
+            except (http.client.HTTPException, OSError) as e:
+                self.reset()
+                if attempt == 2:
+                    raise TransferError(f'无法连接 {self.base_url}: {e}')
+        try:
+            data = json.loads(raw) if raw else {}
+        except ValueError:
+            data = {}
+        return response.status, data
+
+    def json(self, method, path, payload):
+        return self.request(method, path, json.dumps(payload).encode('utf-8'), {'Content-Type': 'application/json'})
+
+def error_message(data):
+    """接收端的错误信息：main.py 使用 message，backend 使用 detail"""
+    if isinstance(data, dict):
+        return data.get('message') or data.get('detail') or str(data)
+    return str(data)
+
+# 解析目标地址
+def parse_target(target):
+    """接受 http://host:port、host:port、[IPv6]:port 或 host（使用 DEFAULT_PORT），返回基础 URL"""
+    if '://' not in target:
+        target = 'http://' + target
+    parts = urllib.parse.urlsplit(target)
+    if parts.scheme != 'http' or not parts.hostname:
+        raise ValueError(f'无效的目标地址: {target}')
+    host = f'[{parts.hostname}]' if ':' in parts.hostname else parts.hostname
+    return f'http://{host}:{parts.port or DEFAULT_PORT}'
+
+# 通过组播发现局域网中的接收端
+def discover_peers(timeout=3.0, interface=None, group=DISCOVERY_GROUP, port=DISCOVERY_PORT):
+    """向组播组发送查询并收集 timeout 秒内收到的回复，返回按名称排序的设备列表
+
+    接收端直接单播回复到本机的临时端口，因此不需要加入组播组，也不会与同机的接收端争抢发现端口；
+    interface 指定发送查询使用的本机地址（如 127.0.0.1）
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+    peers = {}
+    try:
+        sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 1)
+        if interface:
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+        sock.bind((interface or '', 0))
+        query = json.dumps({'protocol': DISCOVERY_PROTOCOL, 'id': uuid.uuid4().hex, 'query': True}).encode('utf-8')
+        started = time.monotonic()
+        deadline = started + timeout
+        # 中途再查询一次，以防第一次查询的数据包丢失
+        queries = [started, started + timeout / 2]
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if queries and now >= queries[0]:
+                queries.pop(0)
+                sock.sendto(query, (group, port))
+            sock.settimeout(max(0.01, min([deadline] + queries[:1]) - now))
+            try:
+                data, sender = sock.recvfrom(MAX_ANNOUNCE_SIZE)
+            except socket.timeout:
+                continue
+            try:
+                message = json.loads(data)
+            except ValueError:
+                continue
+            if (not isinstance(message, dict) or message.get('protocol') != DISCOVERY_PROTOCOL
+                    or message.get('bye') or not isinstance(message.get('port'), int)):
+                continue
+            peers[str(message.get('id'))] = {
+                'id': str(message.get('id')),
+                'name': str(message.get('name') or sender[0]),
+                'url': f'http://{sender[0]}:{message["port"]}',
+                'server': message.get('server'),
+            }
+    finally:
+        sock.close()
+    return sorted(peers.values(), key=lambda peer: (peer['name'], peer['url']))
+
+def resolve_target(args):
+    """--to 为地址时直接使用；为 @名称 或省略时通过组播发现（省略时要求只发现一台设备）"""
+    if args.to and not args.to.startswith('@'):
+        return parse_target(args.to)
+    peers = discover_peers(args.discover_timeout, args.interface)
+    if args.to:
+        name = args.to[1:]
+        matches = [peer for peer in peers if peer['name'] == name or peer['id'].startswith(name)]
+    else:
+        matches = peers
+    if len(matches) == 1:
+        return matches[0]['url']
+    if not matches:
+        raise TransferError('没有发现可用的接收端，请用 --to 指定地址')
+    names = ', '.join(f'{peer["name"]} ({peer["url"]})' for peer in matches)
+    raise TransferError(f'发现多台设备，请用 --to @名称 指定其中一台: {names}')
+
+def file_digest(path):
+    hasher = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(READ_BLOCK_SIZE)
+            if not data:
+                break
+            hasher.update(data)
+    return f'blake2b:{hasher.hexdigest()}'
+
+class ResumeState:
+    """断点续传记录：(目标, 绝对路径, 大小, 修改时间, 摘要) -> 会话 id
+
+    中断后再次发送同一个文件时查询该会话，只上传接收端缺失的分块
+    """
+    def __init__(self, path=STATE_PATH, enabled=True):
+        self.path = path
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.sessions = {}
+        if enabled:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    self.sessions = json.load(f)
+            except (OSError, ValueError):
+                self.sessions = {}
+
+    @staticmethod
+    def key(base_url, path, stat, digest):
+        return f'{base_url}|{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{digest}'
+
+    def get(self, key):
+        return self.sessions.get(key)
+
+    def set(self, key, session_id):
+        with self.lock:
+            if session_id is None:
+                self.sessions.pop(key, None)
+            else:
+                self.sessions[key] = session_id
+            self.save()
+
+    def save(self):
+        if not self.enabled:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.sessions, f)
+        os.replace(temp_path, self.path)
+
+class FileSender:
+    """用分块上传会话发送单个文件：多个连接并行上传分块，失败的分块重试，支持断点续传"""
+    def __init__(self, client, pool, progress, state, chunk_size=DEFAULT_CHUNK_SIZE, compress=False):
+        self.client = client
+        self.pool = pool
+        self.progress = progress
+        self.state = state
+        self.chunk_size = chunk_size
+        self.compress = compress
+
+    def open_session(self, path, size, digest, key):
+        """继续之前的会话（仍存在且大小一致时），否则创建新会话"""
+        session_id = self.state.get(key)
+        if session_id:
+            status, data = self.client.request('GET', f'/api/upload/session/{session_id}')
+            if status == 200 and data.get('size') == size:
+                return data
+        status, data = self.client.json('POST', '/api/upload/session', {
+            'filename': os.path.basename(path), 'size': size, 'chunk_size': self.chunk_size, 'digest': digest})
+        if status != 201:
+            raise TransferError(f'创建上传会话失败: {error_message(data)}')
+        self.state.set(key, data['session_id'])
+        return data
+
+    def upload_chunk(self, path, session, index, compress):
+        start = index * session['chunk_size']
+        with open(path, 'rb') as f:
+            f.seek(start)
+            data = f.read(min(session['chunk_size'], session['size'] - start))
+        body, headers = data, {}
+        if compress['enabled']:
+            compressed = gzip.compress(data, 1)
+            if len(compressed) < len(data) * MIN_COMPRESS_RATIO:
+                body, headers = compressed, {'Content-Encoding': 'gzip'}
+            else:
+                # 压缩效果不佳，该文件的后续分块不再压缩
+                compress['enabled'] = False
+        url = f'/api/upload/session/{session["session_id"]}/chunk/{index}'
+        for attempt in range(1, CHUNK_RETRIES + 1):
+            try:
+                status, response = self.client.request('PUT', url, body, headers)
+            except TransferError:
+                if attempt == CHUNK_RETRIES:
+                    raise
+                time.sleep(attempt)
+                continue
+            if status == 200:
+                self.progress.add(len(data))
+                return
+            if status == 404:
+                raise TransferError('上传会话已过期')
+            if attempt == CHUNK_RETRIES:
+                raise TransferError(f'分块 {index} 上传失败: {error_message(response)}')
+            # 503 表示接收端上传名额已满，稍后重试
+            time.sleep(attempt)
+
+    def send(self, path):
+        """发送文件，返回接收端的结果；内容不一致时抛出 IntegrityError"""
+        stat = os.stat(path)
+        digest = file_digest(path)
+        key = self.state.key(self.client.base_url, path, stat, digest)
+        compress = {'enabled': self.compress and os.path.splitext(path)[1].lower() not in COMPRESSED_EXTENSIONS}
+        for _ in range(3):
+            session = self.open_session(path, stat.st_size, digest, key)
+            missing = session['missing_chunks']
+            self.progress.add(stat.st_size - sum(min(session['chunk_size'], session['size'] - index * session['chunk_size'])
+                                                 for index in missing))
+            futures = [self.pool.submit(self.upload_chunk, path, session, index, compress) for index in missing]
+            for future in futures:
+                future.result()
+            status, data = self.client.request('POST', f'/api/upload/session/{session["session_id"]}/complete')
+            if status == 409:
+                # 还有分块未到齐（例如接收端重启过），重新查询缺失的分块
+                self.progress.add(-stat.st_size)
+                continue
+            self.state.set(key, None)
+            if status == 422:
+                raise IntegrityError(f'接收端校验失败: {error_message(data)}')
+            if status != 200:
+                raise TransferError(f'完成上传失败: {error_message(data)}')
+            if data.get('digest') != digest:
+                raise IntegrityError(f'摘要不一致: 本地 {digest}，接收端 {data.get("digest")}')
+            return data
+        raise TransferError('多次尝试后仍有分块缺失')
+
+def preflight(client, entries):
+    """询问接收端已有哪些文件，返回 {路径: 结果}；接收端不支持时返回空字典"""
+    payload = {'files': [{'filename': os.path.basename(path), 'size': os.path.getsize(path), 'digest': digest}
+                         for path, digest in entries], 'materialize': True}
+    try:
+        status, data = client.json('POST', '/api/preflight', payload)
+    except TransferError:
+        return {}
+    if status != 200:
+        return {}
+    return {path: result for (path, _), result in zip(entries, data.get('results', []))}
+
+def tar_members(root):
+    """按目录顺序列出文件夹中的目录和普通文件，返回 [(TarInfo, 本地路径)]；符号链接等不发送"""
+    members = []
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in dirnames + sorted(filenames):
+            path = os.path.join(directory, name)
+            stat = os.lstat(path)
+            info = tarfile.TarInfo(os.path.relpath(path, root).replace(os.sep, '/'))
+            info.mtime = int(stat.st_mtime)
+            if os.path.isdir(path) and not os.path.islink(path):
+                info.type, info.mode = tarfile.DIRTYPE, 0o755
+            elif os.path.isfile(path) and not os.path.islink(path):
+                info.type, info.mode, info.size = tarfile.REGTYPE, 0o644, stat.st_size
+            else:
+                continue
+            members.append((info, path))
+    return members
+
+def tar_header(info):
+    return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+def tar_padding(size):
+    return b'\0' * (-size % tarfile.BLOCKSIZE)
+
+def send_directory(client, root, progress):
+    """把文件夹作为一个 tar 流发送到 /api/upload/archive，接收端边收边解压
+
+    事先算出归档的准确长度，因此可以带 Content-Length 流式发送，不生成临时文件
+    """
+    members = tar_members(root)
+    total = sum(len(tar_header(info)) + info.size + len(tar_padding(info.size)) for info, _ in members)
+    total += 2 * tarfile.BLOCKSIZE
+    files = sum(1 for info, _ in members if info.isfile())
+    size = sum(info.size for info, _ in members)
+    name = os.path.basename(os.path.abspath(root))
+
+    conn = http.client.HTTPConnection(client.host, client.port, timeout=client.timeout)
+    try:
+        try:
+            conn.putrequest('POST', '/api/upload/archive?name=' + urllib.parse.quote(name))
+            conn.putheader('Content-Type', 'application/x-tar')
+            conn.putheader('Content-Length', str(total))
+            conn.endheaders()
+            for info, path in members:
+                conn.send(tar_header(info))
+                if info.isfile():
+                    sent = 0
+                    with open(path, 'rb') as f:
+                        while sent < info.size:
+                            data = f.read(min(READ_BLOCK_SIZE, info.size - sent))
+                            if not data:
+                                break
+                            conn.send(data)
+                            sent += len(data)
+                            progress.add(len(data))
+                    if sent != info.size:
+                        raise TransferError(f'{path} 在发送过程中被修改')
+                    conn.send(tar_padding(info.size))
+            conn.send(b'\0' * (2 * tarfile.BLOCKSIZE))
+        except OSError:
+            # 接收端提前拒绝时连接会被关闭，尽量读取它返回的错误
+            pass
+        try:
+            response = conn.getresponse()
+            data = json.loads(response.read() or b'{}')
+        except (http.client.HTTPException, OSError, ValueError) as e:
+            raise TransferError(f'发送文件夹失败: {e}')
+    finally:
+        conn.close()
+    if response.status != 200:
+        raise TransferError(f'发送文件夹失败: {error_message(data)}')
+    if data.get('files') != files or data.get('size') != size:
+        raise IntegrityError(f'接收端收到 {data.get("files")} 个文件 / {data.get("size")} 字节，'
+                             f'应为 {files} 个文件 / {size} 字节')
+    return data
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='把文件或文件夹发送到局域网中的文件传输服务')
+    parser.add_argument('paths', nargs='*', help='要发送的文件或文件夹')
+    parser.add_argument('--to', help='接收端：http://host:port、host:port、host，或 @设备名称（通过局域网发现）；'
+                                     '省略时使用唯一发现的设备')
+    parser.add_argument('--peers', action='store_true', help='列出局域网中发现的设备后退出')
+    parser.add_argument('--streams', type=int, default=DEFAULT_STREAMS, help='并行上传的连接数')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE // (1024 * 1024), help='分块大小（MB）')
+    parser.add_argument('--compress', action='store_true', help='用 gzip 压缩分块（对已压缩的格式自动跳过）')
+    parser.add_argument('--no-resume', action='store_true', help='不使用也不保存断点续传记录')
+    parser.add_argument('--discover-timeout', type=float, default=3.0, help='局域网发现的等待时间（秒）')
+    parser.add_argument('--interface', help='局域网发现使用的本机地址（例如 127.0.0.1）')
+    args = parser.parse_args(argv)
+
+    if args.peers:
+        for peer in discover_peers(args.discover_timeout, args.interface):
+            print(f'{peer["name"]}\t{peer["url"]}\t{peer["server"] or ""}')
+        return EXIT_OK
+    if not args.paths:
+        parser.error('请指定要发送的文件或文件夹')
+    if args.streams < 1 or not 0 < args.chunk_size <= 64:
+        parser.error('--streams 至少为 1，--chunk-size 应在 1 到 64 MB 之间')
+    missing = [path for path in args.paths if not os.path.exists(path)]
+    if missing:
+        parser.error(f'文件不存在: {", ".join(missing)}')
+
+    try:
+        base_url = resolve_target(args)
+        client = Client(base_url)
+        status, info = client.request('GET', '/api/server-info')
+    except TransferError as e:
+        print(f'❌ {e}', file=sys.stderr)
+        return EXIT_FAILED
+    if status != 200:
+        print(f'❌ {base_url} 不是文件传输服务', file=sys.stderr)
+        return EXIT_FAILED
+    print(f'📡 发送到 {info.get("name") or info.get("hostname")} ({base_url})')
+
+    files = [path for path in args.paths if os.path.isfile(path)]
+    directories = [path for path in args.paths if os.path.isdir(path)]
+    digests = {path: file_digest(path) for path in files}
+    existing = preflight(client, [(path, digests[path]) for path in files])
+    total = sum(os.path.getsize(path) for path in files if not existing.get(path, {}).get('exists'))
+    total += sum(os.path.getsize(path) for directory in directories for _, path in tar_members(directory)
+                 if os.path.isfile(path))
+
+    progress = Progress(total)
+    state = ResumeState(enabled=not args.no_resume)
+    failures = integrity_failures = 0
+    with ThreadPoolExecutor(max_workers=args.streams) as pool:
+        sender = FileSender(client, pool, progress, state, args.chunk_size * 1024 * 1024, args.compress)
+        for path in args.paths:
+            try:
+                if path in directories:
+                    result = send_directory(client, path, progress)
+                    progress.write_line(f'✅ {path}/ -> {result["folder"]}（{result["files"]} 个文件，'
+                                        f'{format_size(result["size"])}）')
+                elif existing.get(path, {}).get('exists'):
+                    saved = existing[path].get('saved_as') or existing[path].get('existing')
+                    progress.write_line(f'⏭️ {path} -> {saved}（接收端已有相同内容）')
+                else:
+                    result = sender.send(path)
+                    progress.write_line(f'✅ {path} -> {result["filename"]}（{format_size(result["size"])}）')
+            except IntegrityError as e:
+                integrity_failures += 1
+                progress.write_line(f'❌ {path}: {e}')
+            except (TransferError, OSError) as e:
+                failures += 1
+                progress.write_line(f'❌ {path}: {e}')
+    progress.close()
+    if integrity_failures:
+        return EXIT_INTEGRITY
+    return EXIT_FAILED if failures else EXIT_OK
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        print('\n🛑 已取消，再次发送相同的文件会从中断处继续', file=sys.stderr)
+        sys.exit(130)
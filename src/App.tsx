@@ -1,4 +1,4 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import { Upload, History, Monitor, Wifi, Check, X, Trash2, RefreshCw } from 'lucide-react';
 
 interface ServerInfo {
@@ -7,6 +7,8 @@ interface ServerInfo {
   machine: string;
   processor: string;
   ip: string;
+  addresses?: string[];
+  encodings?: string[];
 }
 
 interface TransferHistoryItem {
@@ -15,6 +17,7 @@ interface TransferHistoryItem {
   size: number;
   client_ip: string;
   timestamp: string;
+  digest?: string;
 }
 
 interface UploadResult {
@@ -22,8 +25,150 @@ interface UploadResult {
   filename: string;
   size?: number;
   error?: string;
+  speed?: number;
+  digest?: string;
+  skipped?: boolean;
 }
 
+// 文件夹上传：成员的相对路径，file 为 null 表示目录
+interface FolderEntry {
+  path: string;
+  file: File | null;
+}
+
+interface FolderUpload {
+  name: string;
+  entries: FolderEntry[];
+}
+
+interface HistoryDelta {
+  version: number;
+  reset: boolean;
+  cleared?: boolean;
+  added?: TransferHistoryItem[];
+  removed?: number[];
+}
+
+interface UploadSession {
+  session_id: string;
+  chunk_size: number;
+  total_chunks: number;
+  missing_chunks: number[];
+}
+
+// 超过此大小的文件拆分成分块，通过多个并行连接上传
+const PARALLEL_THRESHOLD = 16 * 1024 * 1024;
+const PARALLEL_CHUNK_SIZE = 8 * 1024 * 1024;
+const PARALLEL_STREAMS = 4;
+const CHUNK_RETRIES = 3;
+
+// 不超过此大小的文件先计算摘要，询问服务器是否已有相同内容
+const PREFLIGHT_MAX_SIZE = 32 * 1024 * 1024;
+
+// 已压缩格式的文件再压缩几乎没有收益，直接上传
+const COMPRESSED_EXTENSIONS = /\.(jpe?g|png|gif|webp|heic|heif|avif|mp4|mov|mkv|avi|webm|m4v|mp3|aac|m4a|ogg|opus|flac|zip|gz|tgz|bz2|xz|zst|7z|rar|apk|jar|docx|xlsx|pptx|pdf|woff2?)$/i;
+// 压缩后不小于原大小的这个比例时，停止压缩该文件的后续分块
+const MIN_COMPRESS_RATIO = 0.9;
+
+const isCompressible = (file: File) =>
+  typeof CompressionStream !== 'undefined' && !COMPRESSED_EXTENSIONS.test(file.name);
+
+// 用浏览器内置的 CompressionStream 对分块做 gzip 压缩
+const gzipBlob = (blob: Blob): Promise<Blob> =>
+  new Response(blob.stream().pipeThrough(new CompressionStream('gzip'))).blob();
+
+// tar 成员头（ustar）；路径过长、含非 ASCII 字符或文件超过 8 GiB 时前置 PAX 扩展头
+const encoder = new TextEncoder();
+const TAR_MAX_OCTAL_SIZE = 8 ** 11;
+
+const tarHeader = (name: string, size: number, mtime: number, type: string): Uint8Array => {
+  const block = new Uint8Array(512);
+  const put = (offset: number, text: string, length: number) =>
+    block.set(encoder.encode(text).subarray(0, length), offset);
+  const octal = (value: number, length: number) => value.toString(8).padStart(length - 1, '0');
+  put(0, name, 100);
+  put(100, octal(type === '5' ? 0o755 : 0o644, 8), 8);
+  put(108, octal(0, 8), 8);
+  put(116, octal(0, 8), 8);
+  put(124, octal(size < TAR_MAX_OCTAL_SIZE ? size : 0, 12), 12);
+  put(136, octal(mtime, 12), 12);
+  put(148, '        ', 8);
+  put(156, type, 1);
+  put(257, 'ustar', 6);
+  put(263, '00', 2);
+  const sum = block.reduce((total, byte) => total + byte, 0);
+  put(148, octal(sum, 7), 6);
+  block[154] = 0;
+  return block;
+};
+
+const paxRecord = (key: string, value: string | number): string => {
+  const body = ` ${key}=${value}\n`;
+  const bodyLength = encoder.encode(body).length;
+  let length = bodyLength + 1;
+  while (String(length).length + bodyLength !== length) length = String(length).length + bodyLength;
+  return `${length}${body}`;
+};
+
+const tarPadding = (size: number) => new Uint8Array((512 - (size % 512)) % 512);
+
+// 把文件夹打包成 tar；文件内容直接引用 File，拼成 Blob 时不会读入内存
+const buildTar = (entries: FolderEntry[]): Blob => {
+  const parts: BlobPart[] = [];
+  for (const { path, file } of entries) {
+    const size = file ? file.size : 0;
+    const mtime = Math.floor((file ? file.lastModified : Date.now()) / 1000);
+    let name = file ? path : `${path}/`;
+    if (!/^[ -~]*$/.test(name) || encoder.encode(name).length > 100 || size >= TAR_MAX_OCTAL_SIZE) {
+      const records = encoder.encode(paxRecord('path', name) + (size >= TAR_MAX_OCTAL_SIZE ? paxRecord('size', size) : ''));
+      parts.push(tarHeader('PaxHeader', records.length, mtime, 'x'), records, tarPadding(records.length));
+      name = name.replace(/[^ -~]/g, '_');
+    }
+    parts.push(tarHeader(name, size, mtime, file ? '0' : '5'));
+    if (file) parts.push(file, tarPadding(size));
+  }
+  // 两个全零块表示归档结束
+  parts.push(new Uint8Array(1024));
+  return new Blob(parts, { type: 'application/x-tar' });
+};
+
+const entryFile = (entry: FileSystemFileEntry) =>
+  new Promise<File>((resolve, reject) => entry.file(resolve, reject));
+
+// readEntries 每次只返回一批，读到空为止
+const readAllEntries = async (directory: FileSystemDirectoryEntry): Promise<FileSystemEntry[]> => {
+  const reader = directory.createReader();
+  const all: FileSystemEntry[] = [];
+  for (;;) {
+    const batch = await new Promise<FileSystemEntry[]>((resolve, reject) => reader.readEntries(resolve, reject));
+    if (batch.length === 0) return all;
+    all.push(...batch);
+  }
+};
+
+// 递归列出拖入的文件夹中的所有文件和子目录（路径相对于该文件夹）
+const walkDirectory = async (directory: FileSystemDirectoryEntry, prefix = ''): Promise<FolderEntry[]> => {
+  const entries: FolderEntry[] = [];
+  for (const child of await readAllEntries(directory)) {
+    const path = prefix + child.name;
+    if (child.isDirectory) {
+      entries.push({ path, file: null });
+      entries.push(...(await walkDirectory(child as FileSystemDirectoryEntry, `${path}/`)));
+    } else {
+      entries.push({ path, file: await entryFile(child as FileSystemFileEntry) });
+    }
+  }
+  return entries;
+};
+
+// 计算文件的 SHA-256 摘要（WebCrypto 只在安全上下文中可用）
+const sha256Digest = async (file: File): Promise<string | null> => {
+  if (!globalThis.crypto?.subtle || file.size > PREFLIGHT_MAX_SIZE) return null;
+  const hash = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+  const hex = Array.from(new Uint8Array(hash), (b) => b.toString(16).padStart(2, '0')).join('');
+  return `sha256:${hex}`;
+};
+
 function App() {
   const [serverInfo, setServerInfo] = useState<ServerInfo | null>(null);
   const [history, setHistory] = useState<TransferHistoryItem[]>([]);
@@ -52,13 +197,33 @@ function App() {
     }
   }, []);
 
+  // 已同步到的历史版本，之后只拉取增量
+  const historyVersion = useRef<number | null>(null);
+
   // 获取传输历史
   const fetchHistory = useCallback(async () => {
     try {
+      if (historyVersion.current !== null) {
+        const response = await fetch(`${API_BASE}/api/history?since=${historyVersion.current}`);
+        if (response.ok) {
+          const delta: HistoryDelta = await response.json();
+          if (!delta.reset) {
+            const removed = new Set(delta.removed);
+            setHistory((prev) => {
+              const kept = (delta.cleared ? [] : prev).filter((h) => !removed.has(h.id));
+              const known = new Set(kept.map((h) => h.id));
+              return [...kept, ...(delta.added || []).filter((h) => !known.has(h.id))];
+            });
+            historyVersion.current = delta.version;
+            return;
+          }
+        }
+      }
       const response = await fetch(`${API_BASE}/api/history`);
       if (response.ok) {
         const data = await response.json();
         setHistory(data.history);
+        historyVersion.current = data.version;
       }
     } catch (error) {
       console.error('获取历史记录失败:', error);
@@ -69,11 +234,29 @@ function App() {
   useEffect(() => {
     checkServerStatus();
     fetchHistory();
-    
-    // 定时检查服务器状态
-    const interval = setInterval(checkServerStatus, 5000);
-    
-    return () => clearInterval(interval);
+
+    // 订阅服务器推送的事件，代替定时轮询
+    const events = new EventSource(`${API_BASE}/api/events`);
+    events.onopen = () => setIsOnline(true);
+    // 连接断开时 EventSource 会自动重连，并通过 Last-Event-ID 补发错过的事件
+    events.onerror = () => setIsOnline(false);
+
+    // 新连接或无法补发时，重新拉取完整状态
+    events.addEventListener('reset', () => {
+      checkServerStatus();
+      fetchHistory();
+    });
+    events.addEventListener('history', (e) => {
+      const item: TransferHistoryItem = JSON.parse((e as MessageEvent).data);
+      setHistory((prev) => (prev.some((h) => h.id === item.id) ? prev : [...prev, item]));
+    });
+    events.addEventListener('history-deleted', (e) => {
+      const { id } = JSON.parse((e as MessageEvent).data);
+      setHistory((prev) => prev.filter((h) => h.id !== id));
+    });
+    events.addEventListener('history-cleared', () => setHistory([]));
+
+    return () => events.close();
   }, [checkServerStatus, fetchHistory]);
 
   // 文件大小格式化
@@ -111,54 +294,198 @@ function App() {
       return;
     }
 
-    const files = Array.from(e.dataTransfer.files);
-    if (files.length === 0) return;
+    // 条目只能在 drop 事件中同步取出；文件夹打包成 tar 上传，保留目录结构
+    const items = Array.from(e.dataTransfer.items, (item) => item.webkitGetAsEntry?.() ?? null);
+    if (!items.some((entry) => entry?.isDirectory)) {
+      const files = Array.from(e.dataTransfer.files);
+      if (files.length === 0) return;
+      await uploadFiles(files);
+      return;
+    }
+    const files: File[] = [];
+    const folders: FolderUpload[] = [];
+    for (const entry of items) {
+      if (entry?.isDirectory) {
+        folders.push({ name: entry.name, entries: await walkDirectory(entry as FileSystemDirectoryEntry) });
+      } else if (entry) {
+        files.push(await entryFile(entry as FileSystemFileEntry));
+      }
+    }
+    await uploadFiles(files, folders);
+  };
+
+  // 文件夹上传：整个文件夹作为一个 tar 流发送，服务器边接收边解压
+  const uploadFolder = async (folder: FolderUpload): Promise<UploadResult> => {
+    const startedAt = performance.now();
+    const archive = buildTar(folder.entries);
+    try {
+      const response = await fetch(`${API_BASE}/api/upload/archive?name=${encodeURIComponent(folder.name)}`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/x-tar' },
+        body: archive,
+      });
+      if (!response.ok) {
+        return { success: false, filename: folder.name, error: '文件夹上传失败' };
+      }
+      const data = await response.json();
+      const seconds = (performance.now() - startedAt) / 1000;
+      return { success: true, filename: `${data.folder}/（${data.files} 个文件）`, size: data.size, speed: archive.size / seconds };
+    } catch (error) {
+      return { success: false, filename: folder.name, error: '网络错误' };
+    }
+  };
+
+  // 大文件上传：创建会话后用多个并行连接上传分块
+  const uploadLargeFile = async (file: File): Promise<UploadResult> => {
+    const startedAt = performance.now();
+    try {
+      const response = await fetch(`${API_BASE}/api/upload/session`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, size: file.size, chunk_size: PARALLEL_CHUNK_SIZE }),
+      });
+      if (!response.ok) {
+        return { success: false, filename: file.name, error: '创建上传会话失败' };
+      }
+      const session: UploadSession = await response.json();
+      const sessionUrl = `${API_BASE}/api/upload/session/${session.session_id}`;
+      const queue = [...session.missing_chunks];
+      // 服务器支持 gzip 时压缩分块，某个分块压缩效果不佳就不再压缩后续分块
+      let compress = !!serverInfo?.encodings?.includes('gzip') && isCompressible(file);
+
+      // 每个连接不断从队列中取出下一个分块，失败的分块重试几次
+      const worker = async () => {
+        for (let index = queue.shift(); index !== undefined; index = queue.shift()) {
+          const start = index * session.chunk_size;
+          const chunk = file.slice(start, Math.min(start + session.chunk_size, file.size));
+          let body: Blob = chunk;
+          const headers: Record<string, string> = {};
+          if (compress) {
+            const compressed = await gzipBlob(chunk);
+            if (compressed.size < chunk.size * MIN_COMPRESS_RATIO) {
+              body = compressed;
+              headers['Content-Encoding'] = 'gzip';
+            } else {
+              compress = false;
+            }
+          }
+          for (let attempt = 1; ; attempt++) {
+            try {
+              const chunkResponse = await fetch(`${sessionUrl}/chunk/${index}`, { method: 'PUT', body, headers });
+              if (chunkResponse.ok) break;
+              if (attempt >= CHUNK_RETRIES) throw new Error(`分块 ${index} 上传失败`);
+            } catch (error) {
+              if (attempt >= CHUNK_RETRIES) throw error;
+            }
+          }
+        }
+      };
+      const streams = Math.min(PARALLEL_STREAMS, Math.max(queue.length, 1));
+      await Promise.all(Array.from({ length: streams }, worker));
+
+      const completeResponse = await fetch(`${sessionUrl}/complete`, { method: 'POST' });
+      if (!completeResponse.ok) {
+        return { success: false, filename: file.name, error: '合并文件失败' };
+      }
+      const data = await completeResponse.json();
+      const seconds = (performance.now() - startedAt) / 1000;
+      return { success: true, filename: data.filename, size: data.size, speed: file.size / seconds, digest: data.digest };
+    } catch (error) {
+      return { success: false, filename: file.name, error: '网络错误' };
+    }
+  };
+
+  // 上传前询问服务器已有哪些文件，返回无需上传的结果
+  const preflightFiles = async (files: File[]): Promise<Map<File, UploadResult>> => {
+    const skipped = new Map<File, UploadResult>();
+    try {
+      const entries: { file: File; digest: string }[] = [];
+      for (const file of files) {
+        const digest = await sha256Digest(file);
+        if (digest) entries.push({ file, digest });
+      }
+      if (entries.length === 0) return skipped;
 
-    await uploadFiles(files);
+      const response = await fetch(`${API_BASE}/api/preflight`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+          files: entries.map(({ file, digest }) => ({ filename: file.name, size: file.size, digest })),
+          materialize: true,
+        }),
+      });
+      if (!response.ok) return skipped;
+      const data = await response.json();
+      data.results.forEach((result: { exists: boolean; existing: string; saved_as?: string }, index: number) => {
+        const { file, digest } = entries[index];
+        if (result.exists) {
+          skipped.set(file, { success: true, filename: result.saved_as ?? result.existing, size: file.size, digest, skipped: true });
+        }
+      });
+    } catch (error) {
+      console.error('查询已有文件失败:', error);
+    }
+    return skipped;
   };
 
   // 文件上传
-  const uploadFiles = async (files: File[]) => {
+  const uploadFiles = async (allFiles: File[], folders: FolderUpload[] = []) => {
     setIsUploading(true);
     setShowResults(false);
     const results: UploadResult[] = [];
 
-    try {
-      const formData = new FormData();
-      files.forEach((file) => {
-        formData.append('files', file);
-      });
+    for (const folder of folders) {
+      results.push(await uploadFolder(folder));
+    }
 
-      const response = await fetch(`${API_BASE}/api/upload-multiple`, {
-        method: 'POST',
-        body: formData,
-      });
+    // 服务器已有相同内容的文件直接跳过
+    const skipped = await preflightFiles(allFiles);
+    results.push(...skipped.values());
+    const files = allFiles.filter((file) => !skipped.has(file));
 
-      if (response.ok) {
-        const data = await response.json();
-        results.push(...data.results);
-      } else {
+    // 大文件逐个走并行分块上传
+    const largeFiles = files.filter((file) => file.size > PARALLEL_THRESHOLD);
+    for (const file of largeFiles) {
+      results.push(await uploadLargeFile(file));
+    }
+    const smallFiles = files.filter((file) => file.size <= PARALLEL_THRESHOLD);
+
+    if (smallFiles.length > 0) {
+      try {
+        const formData = new FormData();
+        smallFiles.forEach((file) => {
+          formData.append('files', file);
+        });
+
+        // 流式上传：服务器边接收边写入保存目录，不经过临时目录中转
+        const response = await fetch(`${API_BASE}/api/upload/stream`, {
+          method: 'POST',
+          body: formData,
+        });
+
+        if (response.ok) {
+          const data = await response.json();
+          results.push(...data.results);
+        } else {
+          results.push({
+            success: false,
+            filename: `${smallFiles.length}个文件`,
+            error: '上传失败'
+          });
+        }
+      } catch (error) {
         results.push({
           success: false,
-          filename: `${files.length}个文件`,
-          error: '上传失败'
+          filename: `${smallFiles.length}个文件`,
+          error: '网络错误'
         });
       }
-    } catch (error) {
-      results.push({
-        success: false,
-        filename: `${files.length}个文件`,
-        error: '网络错误'
-      });
     }
 
     setUploadResults(results);
     setShowResults(true);
     setIsUploading(false);
     
-    // 刷新历史记录
-    fetchHistory();
-    
     // 3秒后自动隐藏结果
     setTimeout(() => {
       setShowResults(false);
@@ -173,6 +500,19 @@ function App() {
     }
   };
 
+  // 文件夹选择上传：按 webkitRelativePath 的第一级分组
+  const handleFolderSelect = (e: React.ChangeEvent<HTMLInputElement>) => {
+    const folders = new Map<string, FolderEntry[]>();
+    for (const file of Array.from(e.target.files || [])) {
+      const [name, ...rest] = file.webkitRelativePath.split('/');
+      if (!folders.has(name)) folders.set(name, []);
+      folders.get(name)!.push({ path: rest.join('/'), file });
+    }
+    if (folders.size > 0) {
+      uploadFiles([], Array.from(folders, ([name, entries]) => ({ name, entries })));
+    }
+  };
+
   // 清空历史记录
   const clearHistory = async () => {
     try {
@@ -233,7 +573,7 @@ function App() {
               </div>
               <div>
                 <p className="text-sm text-gray-600">IP地址</p>
-                <p className="text-lg font-medium text-blue-600">{serverInfo.ip}</p>
+                <p className="text-lg font-medium text-blue-600">{serverInfo.addresses?.join(', ') ?? serverInfo.ip}</p>
               </div>
               <div>
                 <p className="text-sm text-gray-600">系统</p>
@@ -273,7 +613,7 @@ function App() {
               <div className="flex flex-col items-center">
                 <Upload className="w-12 h-12 text-gray-400 mb-4" />
                 <p className="text-lg text-gray-600 mb-2">
-                  拖拽文件到这里或点击选择文件
+                  拖拽文件或文件夹到这里，或点击选择
                 </p>
                 <p className="text-sm text-gray-500 mb-4">
                   文件将自动保存到桌面
@@ -285,12 +625,28 @@ function App() {
                   className="hidden"
                   id="file-input"
                 />
-                <label
-                  htmlFor="file-input"
-                  className="px-6 py-2 bg-blue-600 text-white rounded-lg hover:bg-blue-700 transition-colors cursor-pointer"
-                >
-                  选择文件
-                </label>
+                <input
+                  type="file"
+                  // webkitdirectory 不在 React 的类型定义中，直接设置属性
+                  ref={(input) => input?.setAttribute('webkitdirectory', '')}
+                  onChange={handleFolderSelect}
+                  className="hidden"
+                  id="folder-input"
+                />
+                <div className="flex space-x-3">
+                  <label
+                    htmlFor="file-input"
+                    className="px-6 py-2 bg-blue-600 text-white rounded-lg hover:bg-blue-700 transition-colors cursor-pointer"
+                  >
+                    选择文件
+                  </label>
+                  <label
+                    htmlFor="folder-input"
+                    className="px-6 py-2 bg-white text-blue-600 border border-blue-600 rounded-lg hover:bg-blue-50 transition-colors cursor-pointer"
+                  >
+                    选择文件夹
+                  </label>
+                </div>
               </div>
             )}
           </div>
@@ -311,7 +667,11 @@ function App() {
                       <span className="text-sm text-gray-700">{result.filename}</span>
                     </div>
                     {result.success && result.size && (
-                      <span className="text-sm text-gray-500">{formatFileSize(result.size)}</span>
+                      <span className="text-sm text-gray-500">
+                        {formatFileSize(result.size)}
+                        {result.speed && ` · ${formatFileSize(result.speed)}/s`}
+                        {result.skipped && ' · 已存在，跳过上传'}
+                      </span>
                     )}
                     {!result.success && (
                       <span className="text-sm text-red-600">{result.error}</span>
@@ -351,7 +711,7 @@ function App() {
               {history.slice().reverse().map((item) => (
                 <div key={item.id} className="flex items-center justify-between p-3 bg-gray-50 rounded-lg">
                   <div className="flex-1">
-                    <p className="font-medium text-gray-900">{item.filename}</p>
+                    <p className="font-medium text-gray-900" title={item.digest}>{item.filename}</p>
                     <p className="text-sm text-gray-500">{formatTime(item.timestamp)}</p>
                   </div>
                   <div className="text-right">
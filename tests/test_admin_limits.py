@@ -0,0 +1,73 @@
+# 管理接口 /api/admin/limits 的请求体校验：运行 python -m unittest discover tests
+import os
+import sys
+import json
+import shutil
+import tempfile
+import threading
+import unittest
+import http.client
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_main(home):
+    """在临时的 HOME 和状态目录中加载 main.py（导入时会打开历史记录等数据库）"""
+    os.environ['HOME'] = home
+    os.environ['LOCALSEND_STATE_DIR'] = os.path.join(home, '.localsend')
+    os.makedirs(os.path.join(home, 'Desktop'), exist_ok=True)
+    spec = importlib.util.spec_from_file_location('localsend_main', os.path.join(ROOT, 'main.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+class AdminLimitsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.environ = dict(os.environ)
+        cls.home = tempfile.mkdtemp(prefix='localsend-test-')
+        cls.main = load_main(cls.home)
+        cls.server = cls.main.PooledHTTPServer(('127.0.0.1', 0), cls.main.FileTransferHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        os.environ.clear()
+        os.environ.update(cls.environ)
+        shutil.rmtree(cls.home, ignore_errors=True)
+
+    def put_limits(self, body):
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=5)
+        try:
+            connection.request('PUT', '/api/admin/limits', body, {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    def test_non_object_body_is_rejected(self):
+        for body in (b'[1]', b'"10M"', b'null', b'1'):
+            with self.subTest(body=body):
+                status, data = self.put_limits(body)
+                self.assertEqual(status, 400)
+                self.assertEqual(data['status'], 'error')
+
+    def test_invalid_fields_are_rejected(self):
+        for body in ({'clients': [1]}, {'rate': 'fast'}, {'clients': {'not-an-ip': '1M'}}):
+            with self.subTest(body=body):
+                status, _ = self.put_limits(json.dumps(body))
+                self.assertEqual(status, 400)
+
+    def test_valid_update_is_applied(self):
+        status, data = self.put_limits(json.dumps({'rate': '10M', 'clients': {'127.0.0.2': '1M'}}))
+        self.assertEqual(status, 200)
+        self.assertEqual(data['rate'], 10 * 1024 * 1024)
+        status, data = self.put_limits(json.dumps({'rate': 0, 'clients': {'127.0.0.2': None}}))
+        self.assertEqual(status, 200)
+        self.assertEqual(data['rate'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+# 归档上传的解压：不安全的成员路径、符号链接、截断的归档和重名的文件夹：运行 python -m unittest discover tests
+import io
+import os
+import sys
+import shutil
+import tarfile
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from localsend_core import ArchiveError, archive_member_path, extract_archive, timestamped_names
+
+def make_tar(entries, mode='w'):
+    """entries 为 (成员名, 内容) 列表：内容为 bytes 时是普通文件，None 是目录，('link', 目标) 是符号链接"""
+    buf = io.BytesIO()
+    with tarfile.open(fileobj=buf, mode=mode) as tar:
+        for name, data in entries:
+            info = tarfile.TarInfo(name)
+            if data is None:
+                info.type = tarfile.DIRTYPE
+                tar.addfile(info)
+            elif isinstance(data, tuple):
+                info.type = tarfile.SYMTYPE
+                info.linkname = data[1]
+                tar.addfile(info)
+            else:
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+    return buf.getvalue()
+
+def list_tree(root):
+    """root 下所有文件和目录的相对路径"""
+    paths = set()
+    for directory, dirs, files in os.walk(root):
+        for name in dirs + files:
+            paths.add(os.path.relpath(os.path.join(directory, name), root))
+    return paths
+
+class ArchiveMemberPathTest(unittest.TestCase):
+    def test_safe_names(self):
+        root = os.path.join(os.sep, 'srv', 'staging')
+        cases = [
+            ('a.txt', os.path.join(root, 'a.txt')),
+            ('dir/sub/b.txt', os.path.join(root, 'dir', 'sub', 'b.txt')),
+            ('./dir//c.txt', os.path.join(root, 'dir', 'c.txt')),
+            ('dir\\d.txt', os.path.join(root, 'dir', 'd.txt')),
+            ('./', None),
+            ('.', None),
+        ]
+        for name, expected in cases:
+            with self.subTest(name=name):
+                self.assertEqual(archive_member_path(root, name), expected)
+
+    def test_unsafe_names(self):
+        root = os.path.join(os.sep, 'srv', 'staging')
+        for name in ('../x', 'a/../../x', 'a/..', '/etc/x', '\\etc\\x', '..\\x'):
+            with self.subTest(name=name):
+                with self.assertRaises(ArchiveError):
+                    archive_member_path(root, name)
+
+class ExtractArchiveTest(unittest.TestCase):
+    def setUp(self):
+        # 保存目录放在一层外部目录之中，用来检查没有文件被写到保存目录之外
+        self.outer = tempfile.mkdtemp(prefix='localsend-test-')
+        self.directory = os.path.join(self.outer, 'Desktop')
+        os.mkdir(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.outer, ignore_errors=True)
+
+    def extract(self, data, folder_name='proj', **kwargs):
+        return extract_archive(io.BytesIO(data), self.directory, folder_name, **kwargs)
+
+    def assert_rejected(self, data, message=None):
+        before = list_tree(self.outer)
+        with self.assertRaises(ArchiveError) as cm:
+            self.extract(data)
+        if message:
+            self.assertIn(message, str(cm.exception))
+        # 失败时临时目录被删除，外部目录和保存目录都没有新文件
+        self.assertEqual(list_tree(self.outer), before)
+
+    def test_extracts_files_and_directories(self):
+        data = make_tar([('src', None), ('src/a.txt', b'hello'), ('深/文件.txt', b'x' * 3000), ('empty', None)])
+        path, files, size, skipped = self.extract(data)
+        self.assertEqual(path, os.path.join(self.directory, 'proj'))
+        self.assertEqual((files, size, skipped), (2, 3005, 0))
+        self.assertEqual(list_tree(path), {'src', 'src/a.txt', '深', '深/文件.txt', 'empty'})
+        with open(os.path.join(path, 'src', 'a.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'hello')
+
+    def test_compressed_archive(self):
+        path, files, _, _ = self.extract(make_tar([('a.txt', b'hello')], 'w:gz'))
+        self.assertEqual(files, 1)
+        self.assertTrue(os.path.isfile(os.path.join(path, 'a.txt')))
+
+    def test_parent_path_is_rejected(self):
+        self.assert_rejected(make_tar([('ok.txt', b'1'), ('../x', b'2')]), '不安全的路径')
+        self.assertFalse(os.path.exists(os.path.join(self.outer, 'x')))
+
+    def test_absolute_path_is_rejected(self):
+        target = os.path.join(self.outer, 'absolute.txt')
+        self.assert_rejected(make_tar([(target, b'2')]), '不安全的路径')
+        self.assertFalse(os.path.exists(target))
+
+    def test_symlinks_are_skipped(self):
+        # 先放一个指向外部目录的链接，再放一个经过这个链接的文件
+        data = make_tar([('link', ('link', self.outer)), ('link/escaped.txt', b'2'), ('a.txt', b'1')])
+        path, files, _, skipped = self.extract(data)
+        self.assertEqual((files, skipped), (2, 1))
+        self.assertFalse(os.path.islink(os.path.join(path, 'link')))
+        self.assertTrue(os.path.isfile(os.path.join(path, 'link', 'escaped.txt')))
+        self.assertFalse(os.path.exists(os.path.join(self.outer, 'escaped.txt')))
+
+    def test_truncated_member_data_is_rejected(self):
+        data = make_tar([('a.txt', b'x' * 100000)])
+        self.assert_rejected(data[:50000])
+
+    def test_truncated_at_member_boundary_is_rejected(self):
+        # 截在第二个成员的头之前：只有完整的第一个成员，没有结束块
+        first = make_tar([('a.txt', b'x' * 1000)])
+        data = make_tar([('a.txt', b'x' * 1000), ('b.txt', b'y' * 1000)])
+        boundary = tarfile.BLOCKSIZE + 2 * tarfile.BLOCKSIZE
+        self.assertEqual(data[:boundary], first[:boundary])
+        self.assert_rejected(data[:boundary], '归档不完整')
+
+    def test_garbage_is_rejected(self):
+        self.assert_rejected(b'not a tar archive' * 100)
+
+    def test_name_collision_keeps_existing_folder(self):
+        existing = os.path.join(self.directory, 'proj')
+        os.mkdir(existing)
+        with open(os.path.join(existing, 'keep.txt'), 'wb') as f:
+            f.write(b'old')
+        path, _, _, _ = self.extract(make_tar([('keep.txt', b'new')]))
+        self.assertEqual(path, os.path.join(self.directory, 'proj(1)'))
+        with open(os.path.join(existing, 'keep.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'old')
+        path, _, _, _ = self.extract(make_tar([('keep.txt', b'new')]))
+        self.assertEqual(path, os.path.join(self.directory, 'proj(2)'))
+
+    def test_name_collision_with_file_and_timestamped_names(self):
+        with open(os.path.join(self.directory, 'proj.v1'), 'wb') as f:
+            f.write(b'old')
+        path, _, _, _ = self.extract(make_tar([('a.txt', b'1')]), 'proj.v1', names=timestamped_names)
+        # 文件夹名不拆分扩展名
+        self.assertRegex(os.path.basename(path), r'^proj\.v1_\d{8}_\d{6}$')
+        self.assertTrue(os.path.isfile(os.path.join(self.directory, 'proj.v1')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+# backend/main.py 的上传限速：令牌桶、公平排队、小文件优先和管理接口：运行 python -m unittest discover tests
+import os
+import sys
+import time
+import shutil
+import asyncio
+import tempfile
+import unittest
+import importlib.util
+
+try:
+    from fastapi.testclient import TestClient
+except ImportError:  # 没有安装 backend 的依赖
+    TestClient = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from localsend_core import BANDWIDTH_QUANTUM, AsyncTransferScheduler, FairScheduler, TokenBucket
+
+def load_backend(home):
+    """在临时的 HOME 和状态目录中加载 backend/main.py"""
+    os.environ['HOME'] = home
+    os.environ['LOCALSEND_STATE_DIR'] = os.path.join(home, '.localsend')
+    os.environ['LOCALSEND_DISCOVERY'] = '0'
+    os.makedirs(os.path.join(home, 'Desktop'), exist_ok=True)
+    spec = importlib.util.spec_from_file_location('localsend_backend', os.path.join(ROOT, 'backend', 'main.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+class TokenBucketTest(unittest.TestCase):
+    def test_overdraft_waits_at_the_average_rate(self):
+        bucket = TokenBucket(1000000)
+        now = bucket.updated
+        self.assertEqual(bucket.delay(now), 0.0)
+        # 容量为 0.25 秒的令牌，透支 0.1 秒的量后需要等 0.1 秒
+        bucket.take(350000)
+        self.assertAlmostEqual(bucket.delay(now), 0.1)
+        self.assertEqual(bucket.delay(now + 0.1), 0.0)
+
+    def test_refill_is_capped_at_capacity(self):
+        bucket = TokenBucket(1000000)
+        bucket.refill(bucket.updated + 60)
+        self.assertEqual(bucket.tokens, bucket.capacity())
+        self.assertTrue(bucket.full(bucket.updated))
+
+    def test_unlimited_bucket_never_waits(self):
+        bucket = TokenBucket(0)
+        bucket.take(1 << 40)
+        self.assertEqual(bucket.delay(bucket.updated), 0.0)
+
+class FairQueueTest(unittest.TestCase):
+    def order(self, scheduler, requests):
+        """按排队标签的顺序返回 requests（(传输, 字节数) 列表）中各次申请所属的传输"""
+        for flow, size in requests:
+            scheduler.enqueue(flow, size)
+        return [waiter[2].key for waiter in sorted(scheduler.waiters)]
+
+    def test_equal_flows_alternate(self):
+        scheduler = FairScheduler(rate=1000000)
+        a = scheduler.get_flow('a', '10.0.0.1', -1)
+        b = scheduler.get_flow('b', '10.0.0.2', -1)
+        requests = [(a, BANDWIDTH_QUANTUM)] * 3 + [(b, BANDWIDTH_QUANTUM)] * 3
+        self.assertEqual(self.order(scheduler, requests), ['a', 'b', 'a', 'b', 'a', 'b'])
+
+    def test_small_transfer_is_served_first(self):
+        scheduler = FairScheduler(rate=1000000)
+        big = scheduler.get_flow('big', '10.0.0.1', 1 << 30)
+        small = scheduler.get_flow('small', '10.0.0.2', 1 << 20)
+        requests = [(big, BANDWIDTH_QUANTUM)] * 3 + [(small, BANDWIDTH_QUANTUM)] * 3
+        self.assertEqual(self.order(scheduler, requests), ['big', 'small', 'small', 'small', 'big', 'big'])
+
+    def test_same_key_shares_one_flow(self):
+        scheduler = FairScheduler(rate=1000000)
+        self.assertIs(scheduler.get_flow('session', '10.0.0.1', 100),
+                      scheduler.get_flow('session', '10.0.0.1', 100))
+
+    def test_async_scheduler_finishes_small_transfer_first(self):
+        async def transfer(scheduler, key, size, finished):
+            flow = scheduler.flow(key, '10.0.0.1', size)
+            for _ in range(0, size, BANDWIDTH_QUANTUM):
+                await flow.acquire(BANDWIDTH_QUANTUM)
+            finished.append(key)
+
+        async def run():
+            scheduler = AsyncTransferScheduler(rate=4 * 1024 * 1024)
+            finished = []
+            await asyncio.gather(transfer(scheduler, 'big', 2 * 1024 * 1024, finished),
+                                 transfer(scheduler, 'small', 256 * 1024, finished))
+            return finished
+
+        started = time.monotonic()
+        self.assertEqual(asyncio.run(run()), ['small', 'big'])
+        # 合计 2.25 MB，按 4 MB/s 限速（首个 0.25 秒的突发额度不计）
+        self.assertGreater(time.monotonic() - started, 0.25)
+
+@unittest.skipIf(TestClient is None, '没有安装 fastapi')
+class AdminLimitsTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.environ = dict(os.environ)
+        cls.home = tempfile.mkdtemp(prefix='localsend-test-')
+        cls.backend = load_backend(cls.home)
+        cls.local = TestClient(cls.backend.app, client=('127.0.0.1', 50000))
+        cls.remote = TestClient(cls.backend.app, client=('192.168.1.20', 50000))
+
+    @classmethod
+    def tearDownClass(cls):
+        os.environ.clear()
+        os.environ.update(cls.environ)
+        shutil.rmtree(cls.home, ignore_errors=True)
+
+    def tearDown(self):
+        self.backend.ADMIN_TOKEN = None
+        self.local.put('/api/admin/limits', json={'rate': 0, 'client_rate': 0, 'clients': {'10.0.0.9': None}})
+
+    def test_non_ip_client_is_not_local(self):
+        client = TestClient(self.backend.app)
+        self.assertEqual(client.get('/api/admin/limits').status_code, 403)
+
+    def test_remote_client_needs_token(self):
+        self.assertEqual(self.remote.get('/api/admin/limits').status_code, 403)
+        self.backend.ADMIN_TOKEN = 'secret'
+        self.assertEqual(self.remote.get('/api/admin/limits', headers={'Authorization': 'Bearer wrong'}).status_code,
+                         403)
+        self.assertEqual(self.remote.get('/api/admin/limits', headers={'Authorization': 'Bearer secret'}).status_code,
+                         200)
+
+    def test_update_is_applied(self):
+        response = self.local.put('/api/admin/limits',
+                                  json={'rate': '10M', 'client_rate': 1024, 'clients': {'10.0.0.9': '1M'}})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['rate'], 10 * 1024 * 1024)
+        self.assertEqual(data['client_rate'], 1024)
+        self.assertEqual(data['clients'], {'10.0.0.9': 1024 * 1024})
+        self.assertEqual(self.local.get('/api/admin/limits').json()['rate'], 10 * 1024 * 1024)
+
+    def test_invalid_update_is_rejected(self):
+        for body in ({'rate': 'fast'}, {'clients': {'not-an-ip': '1M'}}):
+            with self.subTest(body=body):
+                self.assertEqual(self.local.put('/api/admin/limits', json=body).status_code, 400)
+        self.assertEqual(self.local.put('/api/admin/limits', json=[1]).status_code, 422)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+# 并发发布同名文件：名字不重复、不覆盖已有文件，文件系统不支持硬链接时的 O_EXCL 回退：运行 python -m unittest discover tests
+import os
+import sys
+import errno
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+import localsend_core
+from localsend_core import commit_file, numbered_names, timestamped_names
+
+THREADS = 16
+
+class CommitFileTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='localsend-test-')
+        self.staging = os.path.join(self.directory, '.staging')
+        os.mkdir(self.staging)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def temp_file(self, content):
+        fd, path = tempfile.mkstemp(dir=self.staging, suffix='.part')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(content)
+        return path
+
+    def publish_concurrently(self, filename, names=numbered_names):
+        """THREADS 个线程同时以 filename 发布内容各不相同的文件，返回 {内容: 最终路径}"""
+        temps = {f'upload {i}'.encode(): None for i in range(THREADS)}
+        for content in temps:
+            temps[content] = self.temp_file(content)
+        barrier = threading.Barrier(THREADS)
+        results = {}
+        errors = []
+
+        def publish(content, temp_path):
+            barrier.wait()
+            try:
+                results[content] = commit_file(self.directory, filename, temp_path, names)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=publish, args=item) for item in temps.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return results
+
+    def assert_published(self, results, existing=()):
+        # 每个线程拿到不同的名字，内容对应各自的临时文件，临时文件都已移走
+        self.assertEqual(len(set(results.values())), THREADS)
+        for content, path in results.items():
+            self.assertEqual(os.path.dirname(path), self.directory)
+            self.assertNotIn(os.path.basename(path), existing)
+            with open(path, 'rb') as f:
+                self.assertEqual(f.read(), content)
+        self.assertEqual(os.listdir(self.staging), [])
+
+    def test_concurrent_same_name(self):
+        with open(os.path.join(self.directory, 'a.txt'), 'wb') as f:
+            f.write(b'old')
+        results = self.publish_concurrently('a.txt')
+        self.assert_published(results, existing=('a.txt',))
+        expected = {f'a({i}).txt' for i in range(1, THREADS + 1)}
+        self.assertEqual({os.path.basename(path) for path in results.values()}, expected)
+        with open(os.path.join(self.directory, 'a.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'old')
+
+    def test_concurrent_timestamped_names(self):
+        results = self.publish_concurrently('b.txt', timestamped_names)
+        self.assert_published(results)
+        for path in results.values():
+            self.assertRegex(os.path.basename(path), r'^b(_\d{8}_\d{6}(_\d+)?)?\.txt$')
+
+    def test_fallback_without_hard_links(self):
+        with open(os.path.join(self.directory, 'c.txt'), 'wb') as f:
+            f.write(b'old')
+        unsupported = OSError(errno.EPERM, 'Operation not permitted')
+        with mock.patch.object(localsend_core.os, 'link', side_effect=unsupported) as link:
+            results = self.publish_concurrently('c.txt')
+        self.assertTrue(link.called)
+        self.assert_published(results, existing=('c.txt',))
+        with open(os.path.join(self.directory, 'c.txt'), 'rb') as f:
+            self.assertEqual(f.read(), b'old')
+
+    def test_fallback_skips_existing_placeholder(self):
+        # 另一个上传已用 O_EXCL 占住 d.txt 但还没替换：不能覆盖它的占位文件
+        open(os.path.join(self.directory, 'd.txt'), 'wb').close()
+        temp_path = self.temp_file(b'new')
+        with mock.patch.object(localsend_core.os, 'link', side_effect=OSError(errno.EXDEV, 'cross-device')):
+            path = commit_file(self.directory, 'd.txt', temp_path)
+        self.assertEqual(path, os.path.join(self.directory, 'd(1).txt'))
+        self.assertEqual(os.path.getsize(os.path.join(self.directory, 'd.txt')), 0)
+        self.assertFalse(os.path.exists(temp_path))
+
+if __name__ == '__main__':
+    unittest.main()
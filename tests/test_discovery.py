@@ -0,0 +1,86 @@
+# 局域网发现：两个 PeerDiscovery 在回环网卡上互相发现、bye 和过期：运行 python -m unittest discover tests
+import os
+import sys
+import json
+import time
+import socket
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from localsend_core import PEER_TTL, PeerDiscovery
+
+class FakeIdentity:
+    def __init__(self, name):
+        self.info = {'name': name, 'addresses': ['127.0.0.1']}
+
+    def get(self):
+        return self.info
+
+def free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+class PeerDiscoveryTest(unittest.TestCase):
+    def setUp(self):
+        discovery_port = free_udp_port()
+        self.a = self.start(8001, 'alpha', discovery_port)
+        self.b = self.start(8002, 'beta', discovery_port)
+        if not (self.a.joined and self.b.joined):
+            self.skipTest('回环网卡不支持组播')
+
+    def tearDown(self):
+        self.a.close()
+        self.b.close()
+
+    def start(self, port, name, discovery_port):
+        discovery = PeerDiscovery(port, FakeIdentity(name), 'test', ('upload',), interface='127.0.0.1',
+                                  discovery_port=discovery_port).start()
+        # join 在后台线程中执行
+        wait_for(lambda: discovery.joined, timeout=1)
+        return discovery
+
+    def peer(self, discovery, other):
+        return discovery.peers.get(other.instance_id)
+
+    def test_instances_discover_each_other(self):
+        self.assertTrue(wait_for(lambda: self.peer(self.a, self.b) and self.peer(self.b, self.a)))
+        peer = self.peer(self.a, self.b)
+        self.assertEqual(peer['name'], 'beta')
+        self.assertEqual(peer['port'], 8002)
+        self.assertEqual(peer['url'], 'http://127.0.0.1:8002')
+        self.assertEqual(peer['capabilities'], ['upload'])
+        self.assertEqual([p['name'] for p in self.a.snapshot()], ['beta'])
+
+    def test_bye_removes_peer(self):
+        self.assertTrue(wait_for(lambda: self.peer(self.a, self.b)))
+        self.b.close()
+        self.assertTrue(wait_for(lambda: self.peer(self.a, self.b) is None))
+
+    def test_peer_expires_after_ttl(self):
+        self.assertTrue(wait_for(lambda: self.peer(self.a, self.b)))
+        with self.a.lock:
+            self.peer(self.a, self.b)['last_seen'] -= PEER_TTL + 1
+        self.assertEqual(self.a.snapshot(), [])
+        self.assertIsNone(self.peer(self.a, self.b))
+
+    def test_own_and_invalid_messages_are_ignored(self):
+        sender = ('127.0.0.1', 9)
+        self.assertFalse(self.a.handle(b'not json', sender))
+        self.assertFalse(self.a.handle(b'[]', sender))
+        self.assertFalse(self.a.handle(json.dumps(self.a.message()).encode(), sender))
+        self.assertFalse(self.a.handle(json.dumps(dict(self.b.message(), port=0)).encode(), sender))
+        self.assertNotIn(self.a.instance_id, self.a.peers)
+
+if __name__ == '__main__':
+    unittest.main()
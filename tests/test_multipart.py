@@ -0,0 +1,138 @@
+# main.py 的流式 multipart 解析：跨块的边界、前导和尾部内容、多个文件、截断和文件名编码：运行 python -m unittest discover tests
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+BOUNDARY = b'----localsend-test-boundary'
+
+def load_main(home):
+    """在临时的 HOME 和状态目录中加载 main.py"""
+    os.environ['HOME'] = home
+    os.environ['LOCALSEND_STATE_DIR'] = os.path.join(home, '.localsend')
+    os.environ['LOCALSEND_DISCOVERY'] = '0'
+    os.makedirs(os.path.join(home, 'Desktop'), exist_ok=True)
+    spec = importlib.util.spec_from_file_location('localsend_main_multipart', os.path.join(ROOT, 'main.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def make_body(parts, preamble=b'', epilogue=b'', close=True):
+    """parts 为 (Content-Disposition 参数, 内容) 列表"""
+    body = preamble
+    for disposition, data in parts:
+        body += b'--' + BOUNDARY + b'\r\n'
+        body += b'Content-Disposition: form-data; ' + disposition + b'\r\n'
+        body += b'Content-Type: application/octet-stream\r\n\r\n'
+        body += data + b'\r\n'
+    if close:
+        body += b'--' + BOUNDARY + b'--\r\n' + epilogue
+    return body
+
+class MultipartReaderTest(unittest.TestCase):
+    # 块大小小于、接近和大于边界长度，让边界落在两次读取之间
+    CHUNK_SIZES = (1, 7, len(BOUNDARY) + 3, len(BOUNDARY) + 4, 64, 65536)
+
+    @classmethod
+    def setUpClass(cls):
+        cls.environ = dict(os.environ)
+        cls.home = tempfile.mkdtemp(prefix='localsend-test-')
+        cls.main = load_main(cls.home)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.environ.clear()
+        os.environ.update(cls.environ)
+        shutil.rmtree(cls.home, ignore_errors=True)
+
+    def parse(self, body, chunk_size):
+        """返回 [(name, filename, 内容)]"""
+        reader = self.main.MultipartReader(io.BytesIO(body), BOUNDARY, chunk_size=chunk_size)
+        parts = []
+        while True:
+            part = reader.next_part()
+            if part is None:
+                return parts
+            parts.append((part.name, part.filename, b''.join(reader.iter_chunks())))
+
+    def assert_parts(self, body, expected):
+        for chunk_size in self.CHUNK_SIZES:
+            with self.subTest(chunk_size=chunk_size):
+                self.assertEqual(self.parse(body, chunk_size), expected)
+
+    def test_boundary_split_across_chunks(self):
+        # 内容中夹着与边界相似的字节序列
+        data = b'\r\n--' + BOUNDARY[:-1] + b'x' + bytes(range(256)) * 3 + b'\r\n-'
+        body = make_body([(b'name="file"; filename="a.bin"', data)])
+        self.assert_parts(body, [('file', 'a.bin', data)])
+
+    def test_preamble_and_epilogue_are_ignored(self):
+        body = make_body([(b'name="file"; filename="a.txt"', b'hello')],
+                         preamble=b'This is a multi-part message.\r\n',
+                         epilogue=b'trailing junk --' + BOUNDARY + b'\r\n')
+        self.assert_parts(body, [('file', 'a.txt', b'hello')])
+
+    def test_multiple_files(self):
+        body = make_body([
+            (b'name="note"', b'text field'),
+            (b'name="file"; filename="a.txt"', b'first'),
+            (b'name="file"; filename="empty.txt"', b''),
+            (b'name="file"; filename="b.bin"', b'\x00' * 5000),
+        ])
+        self.assert_parts(body, [
+            ('note', None, b'text field'),
+            ('file', 'a.txt', b'first'),
+            ('file', 'empty.txt', b''),
+            ('file', 'b.bin', b'\x00' * 5000),
+        ])
+
+    def test_unread_part_is_skipped(self):
+        body = make_body([(b'name="file"; filename="a.txt"', b'x' * 1000),
+                          (b'name="file"; filename="b.txt"', b'second')])
+        reader = self.main.MultipartReader(io.BytesIO(body), BOUNDARY, chunk_size=16)
+        self.assertEqual(reader.next_part().filename, 'a.txt')
+        part = reader.next_part()
+        self.assertEqual(part.filename, 'b.txt')
+        self.assertEqual(b''.join(reader.iter_chunks()), b'second')
+        self.assertIsNone(reader.next_part())
+
+    def test_truncated_body_is_rejected(self):
+        full = make_body([(b'name="file"; filename="a.txt"', b'x' * 1000)], close=False)
+        cases = [
+            ('没有结束边界', full),
+            ('截在内容中间', full[:500]),
+            ('截在分段头部中间', full[:60]),
+            ('截在边界之后', b'--' + BOUNDARY),
+            ('没有边界', b'no boundary here' * 10),
+        ]
+        for label, body in cases:
+            for chunk_size in (7, 65536):
+                with self.subTest(case=label, chunk_size=chunk_size):
+                    with self.assertRaises(self.main.MultipartError):
+                        self.parse(body, chunk_size)
+
+    def test_filename_encodings(self):
+        cases = [
+            (b'filename="plain.txt"', 'plain.txt'),
+            (b'filename="with space.txt"', 'with space.txt'),
+            (b'filename="say \\"hi\\".txt"', 'say "hi".txt'),
+            (b'filename="semi;colon.txt"', 'semi;colon.txt'),
+            # 浏览器直接以 UTF-8 发送的文件名
+            ('filename="中文 名.txt"'.encode('utf-8'), '中文 名.txt'),
+            (b"filename*=UTF-8''%E4%B8%AD%E6%96%87.txt", '中文.txt'),
+            (b"filename*=utf-8''%22quoted%22%20name.txt", '"quoted" name.txt'),
+        ]
+        for disposition, expected in cases:
+            with self.subTest(disposition=disposition):
+                body = make_body([(b'name="file"; ' + disposition, b'data')])
+                self.assertEqual(self.parse(body, 64), [('file', expected, b'data')])
+
+if __name__ == '__main__':
+    unittest.main()
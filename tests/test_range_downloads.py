@@ -0,0 +1,175 @@
+# 两个服务的下载接口对 Range / If-Range 的处理：运行 python -m unittest discover tests
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+import http.client
+import urllib.parse
+import importlib.util
+
+try:
+    from fastapi.testclient import TestClient
+except ImportError:  # 没有安装 backend 的依赖
+    TestClient = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from localsend_core import parse_range_header
+
+FILENAME = '断点 续传.bin'
+CONTENT = bytes(range(256)) * 40
+
+def load_module(name, path, home):
+    """在临时的 HOME 和状态目录中加载服务的模块"""
+    os.environ['HOME'] = home
+    os.environ['LOCALSEND_STATE_DIR'] = os.path.join(home, '.localsend')
+    os.environ['LOCALSEND_DISCOVERY'] = '0'
+    os.makedirs(os.path.join(home, 'Desktop'), exist_ok=True)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+class ParseRangeHeaderTest(unittest.TestCase):
+    def test_table(self):
+        cases = [
+            (None, None),
+            ('bytes=0-9', (0, 10)),
+            ('bytes=10-', (10, 100)),
+            ('bytes=-10', (90, 100)),
+            ('bytes=-1000', (0, 100)),
+            ('bytes=90-1000', (90, 100)),
+            # 多个区间、其他单位和无法解析的区间都按没有 Range 处理
+            ('bytes=0-1,5-6', None),
+            ('items=0-9', None),
+            ('bytes=a-b', None),
+        ]
+        for value, expected in cases:
+            with self.subTest(value=value):
+                self.assertEqual(parse_range_header(value, 100), expected)
+
+    def test_unsatisfiable(self):
+        for value in ('bytes=100-', 'bytes=200-300', 'bytes=-0'):
+            with self.subTest(value=value):
+                with self.assertRaises(ValueError):
+                    parse_range_header(value, 100)
+
+class RangeCases:
+    """子类实现 setUpClass（在 cls.desktop 中启动服务）和 get(headers) -> (状态码, 响应头, 响应体)"""
+
+    @classmethod
+    def write_file(cls):
+        with open(os.path.join(cls.desktop, FILENAME), 'wb') as f:
+            f.write(CONTENT)
+
+    def test_full_download(self):
+        status, headers, body = self.get()
+        self.assertEqual(status, 200)
+        self.assertEqual(body, CONTENT)
+        self.assertEqual(headers['accept-ranges'], 'bytes')
+        self.assertTrue(headers['etag'])
+
+    def test_single_range(self):
+        status, headers, body = self.get({'Range': 'bytes=100-199'})
+        self.assertEqual(status, 206)
+        self.assertEqual(headers['content-range'], f'bytes 100-199/{len(CONTENT)}')
+        self.assertEqual(body, CONTENT[100:200])
+
+    def test_suffix_range(self):
+        status, headers, body = self.get({'Range': 'bytes=-10'})
+        self.assertEqual(status, 206)
+        self.assertEqual(body, CONTENT[-10:])
+
+    def test_unsatisfiable_range(self):
+        status, headers, body = self.get({'Range': f'bytes={len(CONTENT)}-'})
+        self.assertEqual(status, 416)
+        self.assertEqual(headers['content-range'], f'bytes */{len(CONTENT)}')
+        self.assertEqual(body, b'')
+
+    def test_multiple_ranges_send_whole_file(self):
+        status, headers, body = self.get({'Range': 'bytes=0-1,5-6'})
+        self.assertEqual(status, 200)
+        self.assertNotIn('content-range', headers)
+        self.assertEqual(body, CONTENT)
+
+    def test_if_range(self):
+        _, headers, _ = self.get()
+        cases = [
+            (headers['etag'], 206),
+            (headers['last-modified'], 206),
+            ('"stale"', 200),
+            ('W/' + headers['etag'], 200),
+            ('not a date', 200),
+        ]
+        for value, expected in cases:
+            with self.subTest(value=value):
+                status, _, body = self.get({'Range': 'bytes=0-9', 'If-Range': value})
+                self.assertEqual(status, expected)
+                self.assertEqual(body, CONTENT[:10] if expected == 206 else CONTENT)
+
+    def test_if_range_after_change(self):
+        _, headers, _ = self.get()
+        try:
+            with open(os.path.join(self.desktop, FILENAME), 'ab') as f:
+                f.write(b'more')
+            status, _, body = self.get({'Range': 'bytes=0-9', 'If-Range': headers['etag']})
+            self.assertEqual(status, 200)
+            self.assertEqual(body, CONTENT + b'more')
+        finally:
+            self.write_file()
+
+class MainRangeTest(RangeCases, unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.environ = dict(os.environ)
+        cls.home = tempfile.mkdtemp(prefix='localsend-test-')
+        cls.main = load_module('localsend_main_range', os.path.join(ROOT, 'main.py'), cls.home)
+        cls.desktop = cls.main.get_desktop_path()
+        cls.write_file()
+        cls.server = cls.main.PooledHTTPServer(('127.0.0.1', 0), cls.main.FileTransferHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        os.environ.clear()
+        os.environ.update(cls.environ)
+        shutil.rmtree(cls.home, ignore_errors=True)
+
+    def get(self, headers=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.server.server_address[1], timeout=5)
+        try:
+            connection.request('GET', '/api/download/' + urllib.parse.quote(FILENAME), headers=headers or {})
+            response = connection.getresponse()
+            return response.status, {k.lower(): v for k, v in response.getheaders()}, response.read()
+        finally:
+            connection.close()
+
+@unittest.skipIf(TestClient is None, '没有安装 fastapi')
+class BackendRangeTest(RangeCases, unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.environ = dict(os.environ)
+        cls.home = tempfile.mkdtemp(prefix='localsend-test-')
+        cls.backend = load_module('localsend_backend_range', os.path.join(ROOT, 'backend', 'main.py'), cls.home)
+        cls.desktop = cls.backend.DESKTOP_PATH
+        cls.write_file()
+        cls.client = TestClient(cls.backend.app)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.environ.clear()
+        os.environ.update(cls.environ)
+        shutil.rmtree(cls.home, ignore_errors=True)
+
+    def get(self, headers=None):
+        response = self.client.get('/api/download/' + urllib.parse.quote(FILENAME), headers=headers or {})
+        return response.status_code, {k.lower(): v for k, v in response.headers.items()}, response.content
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+# 分块上传的字节区间集合，以及摘要只沿连续前缀推进：运行 python -m unittest discover tests
+import io
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import unittest
+import importlib.util
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+
+from localsend_core import add_range, covered_end, range_covered, remove_range
+
+def load_main(home):
+    """在临时的 HOME 和状态目录中加载 main.py"""
+    os.environ['HOME'] = home
+    os.environ['LOCALSEND_STATE_DIR'] = os.path.join(home, '.localsend')
+    os.environ['LOCALSEND_DISCOVERY'] = '0'
+    os.makedirs(os.path.join(home, 'Desktop'), exist_ok=True)
+    spec = importlib.util.spec_from_file_location('localsend_main_ranges', os.path.join(ROOT, 'main.py'))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def build(ranges):
+    result = []
+    for start, end in ranges:
+        add_range(result, start, end)
+    return result
+
+class RangeSetTest(unittest.TestCase):
+    def test_add_range(self):
+        cases = [
+            ('空区间', [(5, 5), (7, 3)], []),
+            ('不相交', [(0, 10), (20, 30)], [[0, 10], [20, 30]]),
+            ('乱序', [(20, 30), (0, 10), (40, 50)], [[0, 10], [20, 30], [40, 50]]),
+            ('相邻合并', [(0, 10), (10, 20)], [[0, 20]]),
+            ('乱序相邻', [(10, 20), (0, 10)], [[0, 20]]),
+            ('重叠', [(0, 15), (10, 20)], [[0, 20]]),
+            ('重复', [(0, 10), (0, 10), (0, 10)], [[0, 10]]),
+            ('包含于已有区间', [(0, 30), (10, 20)], [[0, 30]]),
+            ('覆盖多个区间', [(0, 5), (10, 15), (20, 25), (3, 22)], [[0, 25]]),
+            ('填平空洞', [(0, 10), (20, 30), (10, 20)], [[0, 30]]),
+            ('只连到左侧', [(0, 10), (20, 30), (10, 15)], [[0, 15], [20, 30]]),
+            ('只连到右侧', [(0, 10), (20, 30), (15, 20)], [[0, 10], [15, 30]]),
+        ]
+        for label, ranges, expected in cases:
+            with self.subTest(case=label):
+                self.assertEqual(build(ranges), expected)
+
+    def test_remove_range(self):
+        cases = [
+            ('空区间', [(0, 10)], (5, 5), [[0, 10]]),
+            ('不相交', [(0, 10)], (20, 30), [[0, 10]]),
+            ('相邻不受影响', [(0, 10), (20, 30)], (10, 20), [[0, 10], [20, 30]]),
+            ('整个区间', [(0, 10), (20, 30)], (0, 10), [[20, 30]]),
+            ('切掉中间', [(0, 30)], (10, 20), [[0, 10], [20, 30]]),
+            ('切掉开头', [(0, 30)], (0, 5), [[5, 30]]),
+            ('切掉末尾', [(0, 30)], (25, 40), [[0, 25]]),
+            ('跨多个区间', [(0, 10), (20, 30), (40, 50)], (5, 45), [[0, 5], [45, 50]]),
+            ('全部去掉', [(0, 10), (20, 30)], (0, 100), []),
+        ]
+        for label, ranges, (start, end), expected in cases:
+            with self.subTest(case=label):
+                result = build(ranges)
+                remove_range(result, start, end)
+                self.assertEqual(result, expected)
+
+    def test_covered_end(self):
+        ranges = build([(0, 10), (20, 30)])
+        cases = [(0, 10), (5, 10), (10, 10), (15, 15), (20, 30), (29, 30), (30, 30), (100, 100)]
+        for position, expected in cases:
+            with self.subTest(position=position):
+                self.assertEqual(covered_end(ranges, position), expected)
+        self.assertEqual(covered_end([], 0), 0)
+
+    def test_range_covered(self):
+        ranges = build([(0, 10), (20, 30)])
+        cases = [
+            ((0, 10), True),
+            ((2, 8), True),
+            ((20, 30), True),
+            ((5, 5), True),
+            ((0, 11), False),
+            ((5, 25), False),
+            ((10, 20), False),
+            ((25, 35), False),
+            ((30, 40), False),
+        ]
+        for (start, end), expected in cases:
+            with self.subTest(start=start, end=end):
+                self.assertIs(range_covered(ranges, start, end), expected)
+        self.assertFalse(range_covered([], 0, 1))
+
+class UploadSessionRangeTest(unittest.TestCase):
+    CONTENT = bytes(range(256)) * 16
+
+    @classmethod
+    def setUpClass(cls):
+        cls.environ = dict(os.environ)
+        cls.home = tempfile.mkdtemp(prefix='localsend-test-')
+        cls.main = load_main(cls.home)
+        cls.directory = cls.main.get_desktop_path()
+
+    @classmethod
+    def tearDownClass(cls):
+        os.environ.clear()
+        os.environ.update(cls.environ)
+        shutil.rmtree(cls.home, ignore_errors=True)
+
+    def setUp(self):
+        digest = ('sha256', hashlib.sha256(self.CONTENT).hexdigest())
+        self.session = self.main.UploadSession('test-session', self.directory, 'ranges.bin', len(self.CONTENT),
+                                               1024, '127.0.0.1', expected_digest=digest)
+
+    def tearDown(self):
+        self.session.discard()
+
+    def write(self, start, end):
+        self.session.write_range(start, io.BytesIO(self.CONTENT[start:end]), end - start)
+
+    def test_ranges_past_size_are_rejected(self):
+        size = len(self.CONTENT)
+        for start, length in ((size, 1), (size - 10, 11), (-1, 10), (size + 100, 0)):
+            with self.subTest(start=start, length=length):
+                with self.assertRaises(self.main.UploadSessionError) as cm:
+                    self.session.write_range(start, io.BytesIO(b'x' * max(length, 0)), length)
+                self.assertEqual(cm.exception.status, 416)
+        self.assertEqual(self.session.received_ranges(), [])
+
+    def test_hash_follows_contiguous_prefix(self):
+        # (写入的区间, 之后的已接收区间, 之后的 hashed_upto)
+        steps = [
+            ((1000, 2000), [[1000, 2000]], 0),
+            ((3000, 4096), [[1000, 2000], [3000, 4096]], 0),
+            ((0, 500), [[0, 500], [1000, 2000], [3000, 4096]], 500),
+            ((500, 1000), [[0, 2000], [3000, 4096]], 2000),
+            ((2000, 2000), [[0, 2000], [3000, 4096]], 2000),
+            ((2500, 3000), [[0, 2000], [2500, 4096]], 2000),
+            ((2000, 2500), [[0, 4096]], 4096),
+        ]
+        for (start, end), received, hashed_upto in steps:
+            with self.subTest(start=start, end=end):
+                self.write(start, end)
+                self.assertEqual(self.session.received_ranges(), received)
+                self.assertEqual(self.session.hashed_upto, hashed_upto)
+        self.assertEqual(self.session.hasher.hexdigest(), hashlib.sha256(self.CONTENT).hexdigest())
+        self.assertEqual(self.session.missing_chunks(), [])
+
+    def test_rewriting_hashed_data_restarts_digest(self):
+        self.write(0, 2048)
+        self.assertEqual(self.session.hashed_upto, 2048)
+        self.write(1024, 2048)
+        self.assertEqual(self.session.received_ranges(), [[0, 2048]])
+        self.assertEqual(self.session.hashed_upto, 2048)
+        self.write(2048, 4096)
+        self.assertEqual(self.session.hasher.hexdigest(), hashlib.sha256(self.CONTENT).hexdigest())
+
+    def test_missing_chunks(self):
+        self.write(0, 1024)
+        self.write(1500, 3072)
+        # 分块 1 只收到一部分，仍视为缺失
+        self.assertEqual(self.session.missing_chunks(), [1, 3])
+        self.assertFalse(self.session.is_complete())
+
+if __name__ == '__main__':
+    unittest.main()